@@ -0,0 +1,120 @@
+"""Bulk prompts for the /batch endpoints.
+
+A batch is a list of prompts, a template such as "Morning brief for {symbol}"
+expanded over a list of symbols, or both. Items run with bounded concurrency
+and their results are produced as each one finishes, not in request order.
+"""
+import asyncio, time, uuid
+
+from metrics import registry
+
+batch_items = registry.counter("finchat_batch_items_total", "Batch items by result (ok or error)")
+batch_item_latency = registry.histogram("finchat_batch_item_seconds", "Time to answer one batch item")
+
+SYMBOL_FIELD = "{symbol}"
+
+def expand(prompts=(), template=None, symbols=()):
+    """Batch items for the given prompts, then one per distinct symbol for the template"""
+    items = [{"index": i, "prompt": prompt, "symbol": None} for i, prompt in enumerate(prompts)]
+    if template:
+        for symbol in dict.fromkeys(s.strip().upper() for s in symbols if s.strip()):
+            items.append({"index": len(items), "prompt": template.replace(SYMBOL_FIELD, symbol), "symbol": symbol})
+    return items
+
+async def run_batch(items, run_item, concurrency):
+    """Run the coroutine `run_item(item)` for every item, at most `concurrency` at a time.
+
+    Yields one "item" event per item as it finishes, with the dict returned by
+    `run_item` or the error it raised. Closing the generator early, e.g. when
+    the client disconnects, cancels the items still running.
+    """
+    pending = iter(items)
+    finished = asyncio.Queue()
+
+    async def run(item):
+        start = time.perf_counter()
+        try:
+            result = await run_item(item)
+            batch_items.inc(result="ok")
+        except Exception as e:
+            print(f"Error in batch item {item['index']}: {e}")
+            result = {"error": str(e) or type(e).__name__}
+            batch_items.inc(result="error")
+        elapsed = time.perf_counter() - start
+        batch_item_latency.observe(elapsed)
+        return {"type": "item", **item, **result, "seconds": round(elapsed, 3)}
+
+    async def worker():
+        # Workers share one iterator, so each item is taken exactly once
+        for item in pending:
+            finished.put_nowait(await run(item))
+
+    workers = [asyncio.create_task(worker()) for _ in range(min(concurrency, len(items)))]
+    try:
+        for _ in items:
+            yield await finished.get()
+    finally:
+        for task in workers:
+            task.cancel()
+
+class BatchJobs:
+    """Batches running in the background of this process, polled by job ID.
+
+    Finished jobs are forgotten `ttl` seconds after they end, and at most
+    `max_jobs` are kept.
+    """
+
+    def __init__(self, ttl=3600, max_jobs=100):
+        self.ttl = ttl
+        self.max_jobs = max_jobs
+        self._jobs = {}
+
+    def _prune(self):
+        now = time.monotonic()
+        for job_id, job in list(self._jobs.items()):
+            if job["ended"] is not None and now - job["ended"] > self.ttl:
+                del self._jobs[job_id]
+        finished = [job_id for job_id, job in self._jobs.items() if job["ended"] is not None]
+        for job_id in finished[:max(len(self._jobs) - self.max_jobs + 1, 0)]:
+            del self._jobs[job_id]
+
+    def start(self, events, total):
+        """Consume the async iterator `events` in a background task, returning the new job's ID"""
+        self._prune()
+        if len(self._jobs) >= self.max_jobs:
+            raise RuntimeError("Too many batch jobs running")
+        job_id = str(uuid.uuid4())
+        job = self._jobs[job_id] = {"status": "running", "total": total, "results": [], "error": None,
+                                    "started": time.monotonic(), "ended": None}
+
+        async def consume():
+            try:
+                async for event in events:
+                    job["results"].append(event)
+                job["status"] = "done"
+            except Exception as e:
+                print(f"Error in batch job {job_id}: {e}")
+                job["status"], job["error"] = "failed", str(e)
+            finally:
+                job["ended"] = time.monotonic()
+
+        # Keep a reference so the task is not garbage collected while it runs
+        job["task"] = asyncio.create_task(consume())
+        return job_id
+
+    def get(self, job_id, offset=0):
+        """Status of a job with its results from `offset` on, None for an unknown job"""
+        job = self._jobs.get(job_id)
+        if job is None:
+            return None
+        results = job["results"]
+        return {
+            "job_id": job_id,
+            "status": job["status"],
+            "total": job["total"],
+            "completed": len(results),
+            "failed": sum(1 for r in results if "error" in r),
+            "error": job["error"],
+            "seconds": round((job["ended"] or time.monotonic()) - job["started"], 3),
+            "results": results[offset:],
+        }
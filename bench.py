@@ -0,0 +1,1091 @@
+"""Offline benchmarks for the Finchat server.
+
+The Azure model and the Finnhub client are replaced with the fakes from
+fakes.py, so no API keys or network access are needed.
+
+    python bench.py load --concurrency 1,4,16,64 --requests 256
+    python bench.py stream
+    python bench.py cache --backend redis
+    python bench.py soak --requests 100000
+    python bench.py fanout --symbols 10
+    python bench.py news --articles 1000
+    python bench.py fastpath
+    python bench.py semantic
+    python bench.py replay --corpus bench_corpus.jsonl --concurrency 1,8,32
+    python bench.py threads --store sqlite
+    python bench.py tokens
+    python bench.py candles --symbols 20
+    python bench.py rerun --messages 10,50,200,1000
+    python bench.py batch --symbols 100 --concurrency 1,4,16
+    python bench.py hedge --requests 400
+    python bench.py symbols
+    python bench.py coalesce --requests 200
+    python bench.py quotes
+    python bench.py startup
+"""
+import argparse, asyncio, json, os, random, statistics, subprocess, sys, tempfile, time, types
+
+# llm.py builds the Azure client at import time, give it harmless settings
+os.environ.setdefault("AZURE_OPENAI_ENDPOINT", "http://localhost:9")
+os.environ.setdefault("OPENAI_API_KEY", "bench")
+os.environ.setdefault("OPENAI_API_VERSION", "2024-06-01")
+os.environ.setdefault("OPENAI_API_DEPLOYMENT", "bench")
+os.environ.setdefault("FINNHUB_API_KEY", "bench")
+os.environ.setdefault("FINNHUB_CALLS_PER_MINUTE", "1000000")
+os.environ.setdefault("FINNHUB_BURST", "1000")
+# Each benchmark measures its own feature, `coalesce` turns request coalescing back on
+os.environ.setdefault("COALESCE_WINDOW_SECONDS", "0")
+# The symbol index is built from the fake symbol list once and reused by later runs
+os.environ.setdefault("SYMBOL_INDEX_PATH", os.path.join(tempfile.gettempdir(), "finchat-bench-symbols.idx"))
+
+import httpx
+
+from fakes import FakeFinnhubClient, FakeRedis, install_fakes
+
+PROMPTS = [
+    "What's the current price of AAPL?",
+    "Summarize recent news for MSFT",
+    "Display earnings history for NVDA",
+    "Explain the 50/30/20 rule",
+]
+
+async def run_load(app, concurrency, total, prompts=PROMPTS):
+    """Send `total` chat requests with at most `concurrency` in flight, return requests/second"""
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        queue = asyncio.Queue()
+        for i in range(total):
+            queue.put_nowait(prompts[i % len(prompts)])
+        statuses = []
+
+        async def worker():
+            while not queue.empty():
+                prompt = queue.get_nowait()
+                response = await client.post("/", json={"prompt": prompt})
+                statuses.append(response.status_code)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+
+    failed = sum(1 for status in statuses if status != 200)
+    return total / elapsed, failed
+
+def load(args):
+    install_fakes(llm_latency=args.llm_latency, finnhub_latency=args.finnhub_latency)
+    from server import app
+
+    print(f"{'concurrency':>12} {'req/s':>10} {'failed':>8}")
+    for concurrency in args.concurrency:
+        throughput, failed = asyncio.run(run_load(app, concurrency, args.requests))
+        print(f"{concurrency:>12} {throughput:>10.1f} {failed:>8}")
+
+async def run_stream(app, prompt):
+    """Time to the first token event and to the final event for one streamed answer.
+
+    httpx's ASGI transport buffers whole responses, so the app is called
+    directly to see each body chunk as it is sent.
+    """
+    body = json.dumps({"prompt": prompt}).encode("utf-8")
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "POST",
+        "scheme": "http", "path": "/stream", "raw_path": b"/stream", "query_string": b"",
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+        "client": ("bench", 0), "server": ("bench", 80),
+    }
+    timings = {"first_token": None}
+    requests_sent = []
+    finished = asyncio.Event()
+    start = time.perf_counter()
+
+    async def receive():
+        # Deliver the body once, then report a disconnect when the response is done
+        if not requests_sent:
+            requests_sent.append(True)
+            return {"type": "http.request", "body": body, "more_body": False}
+        await finished.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] != "http.response.body":
+            return
+        if timings["first_token"] is None and b'"type": "token"' in message.get("body", b""):
+            timings["first_token"] = time.perf_counter() - start
+        if not message.get("more_body", False):
+            finished.set()
+
+    await app(scope, receive, send)
+    return timings["first_token"], time.perf_counter() - start
+
+def stream(args):
+    install_fakes(llm_latency=args.llm_latency, finnhub_latency=args.finnhub_latency, token_latency=args.token_latency)
+    from server import app
+
+    print(f"{'prompt':<40} {'first token':>12} {'complete':>10}")
+    for prompt in PROMPTS:
+        first_token, total = asyncio.run(run_stream(app, prompt))
+        # Fast-path answers arrive whole in the final event, without token events
+        first_token = f"{first_token:.3f}s" if first_token is not None else "-"
+        print(f"{prompt:<40} {first_token:>12} {total:>9.3f}s")
+
+def cache(args):
+    from cache import MemoryBackend, RedisBackend
+
+    backend = RedisBackend(FakeRedis()) if args.backend == "redis" else MemoryBackend()
+    _, fake_finnhub = install_fakes(llm_latency=args.llm_latency, finnhub_latency=args.finnhub_latency, cache_backend=backend)
+    import llm as finchat
+    from server import app
+
+    # Many users asking about the same few symbols at the same moment
+    prompts = [f"What's the current price of {symbol}?" for symbol in ("AAPL", "MSFT", "NVDA", "TSLA")]
+    throughput, failed = asyncio.run(run_load(app, args.concurrency, args.requests, prompts))
+
+    print(f"{args.requests} requests, {throughput:.1f} req/s, {failed} failed")
+    print(f"Finnhub upstream calls: {fake_finnhub.calls}")
+    for endpoint, counts in finchat.finnhub_client.stats().items():
+        print(f"  {endpoint}: {counts}")
+
+def rss_mb():
+    """Resident set size of this process in MiB"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except OSError:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def soak(args):
+    install_fakes()
+    import llm as finchat
+    from server import app
+
+    async def run():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            sent = 0
+            print(f"{'requests':>10} {'rss MiB':>10} {'threads':>8}")
+            while sent < args.requests:
+                batch = min(args.report_every, args.requests - sent)
+                for start in range(0, batch, args.concurrency):
+                    await asyncio.gather(*(
+                        client.post("/", json={"prompt": PROMPTS[(sent + start + i) % len(PROMPTS)]})
+                        for i in range(min(args.concurrency, batch - start))
+                    ))
+                sent += batch
+                print(f"{sent:>10} {rss_mb():>10.1f} {finchat.checkpointer.thread_count():>8}")
+
+    asyncio.run(run())
+
+def fanout(args):
+    install_fakes(finnhub_latency=args.finnhub_latency)
+    import llm as finchat
+
+    symbols = [f"SYM{i}" for i in range(args.symbols)]
+
+    start = time.perf_counter()
+    for symbol in symbols:
+        finchat.getStockPrice.invoke({"symbol": symbol})
+    sequential = time.perf_counter() - start
+
+    finchat.finnhub_client.clear()
+    start = time.perf_counter()
+    finchat.getStockPrices.invoke({"symbols": symbols})
+    batched = time.perf_counter() - start
+
+    print(f"{args.symbols} quotes: sequential getStockPrice {sequential:.3f}s, getStockPrices {batched:.3f}s")
+
+def news(args):
+    from news import build_digest, estimate_tokens
+
+    articles = FakeFinnhubClient(news_count=args.articles).company_news(symbol="AAPL")
+    build_digest(articles, query=args.query)  # Warm up
+
+    timings = []
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        digest = build_digest(articles, query=args.query, token_budget=args.token_budget)
+        timings.append(time.perf_counter() - start)
+
+    raw_tokens = estimate_tokens("\n".join(a["summary"] for a in articles))
+    digest_tokens = estimate_tokens(json.dumps(digest, separators=(",", ":")))
+    print(f"{args.articles} articles -> {len(digest)} records in {min(timings) * 1000:.1f} ms (best of {args.repeat})")
+    print(f"Prompt tokens: {raw_tokens} concatenated summaries, {digest_tokens} digest")
+
+# Prompts that look like price or profile questions but need the LLM
+NOT_FAST_PATH = [
+    "price target for TSLA", "What was the price of AAPL on 2020-01-01?", "who is the CEO of AAPL", "Tell me about apple pie",
+    "Tell me about AI", "Tell me about GME short squeeze", "Tell me about IRA accounts", "What does a CFP do?", "Tell me about visa",
+]
+
+def fastpath(args):
+    install_fakes(llm_latency=args.llm_latency, finnhub_latency=args.finnhub_latency)
+    import router
+    from server import app
+
+    prompts = PROMPTS + ["price of TSLA", "What does AMD do?", "Tell me about nvidia", "quote for $MSFT"]
+
+    async def run():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            latencies = {"fast path": [], "full graph": []}
+            for i in range(args.requests):
+                prompt = prompts[i % len(prompts)]
+                start = time.perf_counter()
+                await client.post("/", json={"prompt": prompt})
+                path = "fast path" if router.classify(prompt) else "full graph"
+                latencies[path].append(time.perf_counter() - start)
+            return latencies
+
+    latencies = asyncio.run(run())
+    served = len(latencies["fast path"])
+    print(f"fast path served {served}/{args.requests} requests ({served / args.requests:.0%})")
+    for path, values in latencies.items():
+        if values:
+            print(f"  {path:<10} mean latency {sum(values) / len(values) * 1000:8.1f} ms")
+    wrong = [prompt for prompt in NOT_FAST_PATH if router.classify(prompt)]
+    print(f"prompts wrongly taking the fast path: {len(wrong)}/{len(NOT_FAST_PATH)}")
+    if wrong:
+        print("  " + "\n  ".join(wrong))
+        sys.exit(1)
+
+# Paraphrases of the same general-finance questions
+PARAPHRASES = [
+    ["Explain the 50/30/20 rule", "Can you explain the 50/30/20 rule?", "what is the 50/30/20 rule", "Explain the 50/30/20 rule please"],
+    ["Snowball vs avalanche", "snowball vs avalanche?", "Tell me about snowball vs avalanche", "Explain snowball vs avalanche"],
+    ["How big should my emergency fund be?", "how big should an emergency fund be", "How big should my emergency fund be"],
+    ["What is dollar cost averaging?", "Explain dollar cost averaging", "dollar cost averaging?"],
+]
+
+# Questions that read alike but need different answers, so must never share one
+NEAR_MISSES = [
+    ("How much should I save for retirement at 25?", "How much should I save for retirement at 45?"),
+    ("Explain the 50/30/20 rule", "Explain the 70/20/10 rule"),
+    ("Is a Roth IRA better than a traditional IRA?", "Is a traditional IRA better than a Roth IRA?"),
+    ("Should I convert my traditional IRA to a Roth IRA?", "Should I convert my Roth IRA to a traditional IRA?"),
+    ("Is $10,000 enough for an emergency fund?", "Is $1,000 enough for an emergency fund?"),
+]
+
+def semantic(args):
+    install_fakes(llm_latency=args.llm_latency)
+    import llm as finchat
+    from server import app
+
+    prompts = [p for group in PARAPHRASES for p in group]
+    order = random.Random(0).choices(prompts, k=args.requests)
+
+    async def run():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            latencies = []
+            for i in range(args.requests):
+                start = time.perf_counter()
+                await client.post("/", json={"prompt": order[i]})
+                latencies.append(time.perf_counter() - start)
+            return latencies
+
+    latencies = asyncio.run(run())
+    stats = finchat.response_cache.stats()
+    print(f"{args.requests} requests, hit rate {stats['hit_rate']:.0%}, {stats['entries']} cached answers")
+    fast = [l for l in latencies if l < args.llm_latency]
+    slow = [l for l in latencies if l >= args.llm_latency]
+    if fast:
+        print(f"  cache hits   mean latency {sum(fast) / len(fast) * 1000:8.1f} ms")
+    if slow:
+        print(f"  LLM answers  mean latency {sum(slow) / len(slow) * 1000:8.1f} ms")
+
+    wrong = []
+    for first, second in NEAR_MISSES:
+        finchat.response_cache.clear()
+        finchat.response_cache.store(first, first)
+        if finchat.response_cache.lookup(second) is not None:
+            wrong.append(second)
+    print(f"near misses answered from the cache: {len(wrong)}/{len(NEAR_MISSES)}")
+    if wrong:
+        print("  " + "\n  ".join(wrong))
+        sys.exit(1)
+
+def threads(args):
+    install_fakes(llm_latency=args.llm_latency, finnhub_latency=args.finnhub_latency)
+    import llm as finchat
+    from checkpointer import BoundedMemorySaver, PersistentSaver, RedisStore, SQLiteStore, checkpoint_records
+    from langchain_core.messages import HumanMessage
+
+    redis = FakeRedis()
+    path = os.path.join(tempfile.mkdtemp(), "threads.db")
+
+    def make_saver():
+        # Each saver stands in for one uvicorn worker, all sharing one store
+        if args.store == "memory":
+            return BoundedMemorySaver()
+        store = SQLiteStore(path) if args.store == "sqlite" else RedisStore(redis)
+        return PersistentSaver(store)
+
+    # The memory store cannot be shared, so it runs on a single worker as the baseline
+    savers = [make_saver() for _ in range(1 if args.store == "memory" else args.workers)]
+    graphs = [finchat.create_graph(saver) for saver in savers]
+
+    async def conversation(n, latencies):
+        config = {"configurable": {"thread_id": f"bench-{n}"}}
+        for turn in range(args.turns):
+            worker = (n + turn) % len(graphs)
+            start = time.perf_counter()
+            await graphs[worker].ainvoke({"messages": [HumanMessage(PROMPTS[turn % len(PROMPTS)])]}, config)
+            await savers[worker].aflush()
+            latencies.append(time.perf_counter() - start)
+        # Any worker must see every turn, whichever worker served it
+        state = await graphs[(n + 1) % len(graphs)].aget_state(config)
+        return sum(isinstance(m, HumanMessage) for m in state.values["messages"])
+
+    async def run():
+        latencies = []
+        start = time.perf_counter()
+        turns_seen = await asyncio.gather(*(conversation(n, latencies) for n in range(args.conversations)))
+        return latencies, turns_seen, time.perf_counter() - start
+
+    latencies, turns_seen, elapsed = asyncio.run(run())
+    complete = sum(1 for seen in turns_seen if seen == args.turns)
+    print(f"{args.store} store, {len(graphs)} workers: {len(latencies) / elapsed:.1f} turns/s, "
+          f"p50 {percentile(latencies, 50) * 1000:.1f} ms, p95 {percentile(latencies, 95) * 1000:.1f} ms")
+    print(f"conversations with every turn visible: {complete}/{args.conversations}")
+    if args.store != "memory":
+        print(f"checkpoints put {checkpoint_records.value(op='put'):.0f}, writes put {checkpoint_records.value(op='put_writes'):.0f}, "
+              f"records flushed {checkpoint_records.value(op='flushed'):.0f}")
+        if args.store == "sqlite":
+            stored = savers[0].store._connection().execute("SELECT SUM(LENGTH(data)) FROM threads").fetchone()[0]
+        else:
+            stored = sum(len(value) for key in redis.scan_iter() for value in redis.get(key).values())
+        print(f"stored {stored / args.conversations / 1024:.1f} KiB per thread after {args.turns} turns")
+
+# One prompt per single-symbol tool the fake model calls
+TOOL_PROMPTS = [
+    "What does AAPL do and what is its profile?",
+    "What do analysts recommend for MSFT?",
+    "What's the latest quote and price for NVDA, and why did it move?",
+    "Display earnings history for AMZN",
+    "Summarize recent news for TSLA",
+]
+
+def tokens(args):
+    fake_llm, _ = install_fakes(llm_latency=args.llm_latency, prompt_token_latency=args.prompt_token_latency)
+    import llm as finchat
+    import projection
+    from server import app
+    from tracing import llm_tokens
+
+    # Every turn should reach the LLM and its tools, not the semantic cache
+    finchat.SEMANTIC_CACHE_LIVE_TTL = 0
+
+    async def run():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            results = {}
+            for enabled in (False, True):
+                projection.ENABLED = enabled
+                finchat.response_cache.clear()
+                prompt_tokens = llm_tokens.value(kind="prompt")
+                before = projection.token_report()
+                start = time.perf_counter()
+                for prompt in TOOL_PROMPTS * args.repeat:
+                    await client.post("/", json={"prompt": prompt})
+                turns = len(TOOL_PROMPTS) * args.repeat
+                report = {
+                    tool_name: {form: counts[form] - before.get(tool_name, {}).get(form, 0) for form in ("raw", "projected")}
+                    for tool_name, counts in projection.token_report().items()
+                }
+                results[enabled] = (
+                    (llm_tokens.value(kind="prompt") - prompt_tokens) / turns,
+                    (time.perf_counter() - start) / turns,
+                    report
+                )
+            return results
+
+    results = asyncio.run(run())
+    print(f"{'tool output':<12} {'prompt tokens/turn':>19} {'latency/turn':>13}")
+    for enabled, label in ((False, "raw JSON"), (True, "projected")):
+        per_turn, latency, _ = results[enabled]
+        print(f"{label:<12} {per_turn:>19.0f} {latency * 1000:>10.1f} ms")
+
+    # News is always sent as a digest, its raw tokens are the Finnhub articles it replaces
+    print(f"\n{'tool':<24} {'raw tokens/call':>16} {'projected':>10} {'saved':>6}")
+    for tool_name, counts in sorted(results[True][2].items()):
+        raw, projected = counts["raw"] / args.repeat, counts["projected"] / args.repeat
+        print(f"{tool_name:<24} {raw:>16.0f} {projected:>10.0f} {1 - projected / raw if raw else 0:>6.0%}")
+
+def candles(args):
+    os.environ["CANDLE_STORE_DIR"] = tempfile.mkdtemp()
+    _, fake_finnhub = install_fakes(finnhub_latency=args.finnhub_latency)
+    import llm as finchat
+
+    symbols = [f"SYM{i}" for i in range(args.symbols)]
+    print(f"{'pass':<28} {'Finnhub calls':>14} {'ms/query':>9}")
+    for label, period in (("cold, 6m", "6m"), ("repeat, 6m", "6m"), ("wider window, 5y", "5y"), ("repeat, 1y", "1y")):
+        calls = fake_finnhub.calls
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            for symbol in symbols:
+                finchat.getStockCandles.invoke({"symbol": symbol, "period": period})
+        per_query = (time.perf_counter() - start) / (args.repeat * len(symbols))
+        print(f"{label:<28} {fake_finnhub.calls - calls:>14} {per_query * 1000:>9.1f}")
+
+def batch(args):
+    os.environ["BATCH_CONCURRENCY"] = str(max(args.concurrency))
+    _, fake_finnhub = install_fakes(llm_latency=args.llm_latency, finnhub_latency=args.finnhub_latency)
+    import llm as finchat
+    from server import app
+
+    letters = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+    symbols = [f"Q{letters[i // 26 % 26]}{letters[i % 26]}" for i in range(args.symbols)]
+    template = "Morning brief for {symbol}: price, latest earnings and analyst recommendations"
+
+    async def sequential(client):
+        failed = 0
+        for symbol in symbols:
+            response = await client.post("/", json={"prompt": template.replace("{symbol}", symbol)})
+            failed += response.status_code != 200
+        return failed
+
+    async def batched(client, concurrency):
+        response = await client.post("/batch", json={"template": template, "symbols": symbols, "concurrency": concurrency})
+        events = [json.loads(line) for line in response.text.splitlines() if line]
+        return events[-1]["failed"] if response.status_code == 200 else len(symbols)
+
+    async def run():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            print(f"{'run':<26} {'seconds':>8} {'items/s':>8} {'Finnhub calls':>14} {'failed':>7}")
+            runs = [("sequential POST /", sequential, ())] + [(f"/batch, concurrency {c}", batched, (c,)) for c in args.concurrency]
+            for label, fn, extra in runs:
+                # Every run starts cold so they are comparable
+                finchat.finnhub_client.clear()
+                finchat.response_cache.clear()
+                calls = fake_finnhub.calls
+                start = time.perf_counter()
+                failed = await fn(client, *extra)
+                elapsed = time.perf_counter() - start
+                print(f"{label:<26} {elapsed:>8.2f} {len(symbols) / elapsed:>8.1f} {fake_finnhub.calls - calls:>14} {failed:>7}")
+
+    asyncio.run(run())
+
+def check_routing():
+    """Failover, deadline, hedging and circuit-breaker behaviour of DeploymentRouter, the names of failed checks"""
+    from deployments import Deployment, DeploymentRouter, llm_hedges
+    from fakes import FakeChatModel
+
+    def router(*models, fixed_order=False, **kwargs):
+        deployments = [Deployment(f"d{i}", FakeChatModel(**model), failure_threshold=3, cooldown=0.2)
+                       for i, model in enumerate(models)]
+        routed = DeploymentRouter(deployments, **{"call_timeout": 1.0, "min_hedge_delay": 0.01, "max_hedge_delay": 0.5, **kwargs})
+        if fixed_order:
+            routed.ranked = lambda: list(deployments)  # The first deployment is always the primary
+        return routed, deployments
+
+    async def timed(routed, timeout=None):
+        start = time.perf_counter()
+        try:
+            await routed.ainvoke("Explain the 50/30/20 rule", timeout=timeout, tools=False)
+            return time.perf_counter() - start, None
+        except Exception as e:
+            return time.perf_counter() - start, e
+
+    async def failover():
+        routed, (down, _, up) = router({"failure_rate": 1.0}, {"failure_rate": 1.0}, {}, fixed_order=True, hedge=False)
+        _, error = await timed(routed)
+        return error is None and up.model.calls == 1 and down.failures == 1
+
+    async def deadline():
+        routed, deployments = router({"latency": 2.0}, {"latency": 2.0}, call_timeout=0.2)
+        elapsed, error = await timed(routed)
+        return isinstance(error, TimeoutError) and elapsed < 0.3
+
+    async def hedge_after_p95():
+        routed, (primary, backup) = router({"latency": 0.02}, {"latency": 0.02}, fixed_order=True)
+        primary.latencies.extend([0.05] * 20)
+        _, error = await timed(routed)  # Answers before its p95, no hedge
+        if error is not None or backup.model.calls:
+            return False
+        won = llm_hedges.value(result="won")
+        primary.model.latency = 2.0
+        elapsed, error = await timed(routed)
+        return error is None and backup.model.calls == 1 and llm_hedges.value(result="won") == won + 1 and elapsed < 0.3
+
+    async def no_hedge_past_deadline():
+        # The deadline comes before the primary's p95: nothing is hedged and nobody is blamed for the timeout
+        routed, (primary, backup) = router({"latency": 2.0}, {"latency": 2.0}, fixed_order=True)
+        primary.latencies.extend([0.4] * 20)
+        _, error = await timed(routed, timeout=0.1)
+        return isinstance(error, TimeoutError) and backup.model.calls == 0 and primary.failures == 0
+
+    async def timeout_blame():
+        # The primary outlasted its p95 and is blamed, the hedge sent just before the deadline is not
+        routed, (primary, backup) = router({"latency": 2.0}, {"latency": 2.0}, fixed_order=True, call_timeout=0.2)
+        primary.latencies.extend([0.05] * 20)
+        _, error = await timed(routed)
+        return isinstance(error, TimeoutError) and backup.model.calls == 1 and primary.failures == 1 and backup.failures == 0
+
+    async def breaker():
+        random.seed(1)
+        routed, (bad, good) = router({"failure_rate": 1.0}, {}, hedge=False)
+        for _ in range(20):
+            await timed(routed)
+        skipped = bad.model.calls == bad.failure_threshold and not bad.healthy(time.monotonic())
+        bad.model.failure_rate = 0.0
+        await asyncio.sleep(bad.cooldown)
+        for _ in range(20):
+            await timed(routed)
+        return skipped and bad.model.calls > bad.failure_threshold and bad.failures == 0 and bad.healthy(time.monotonic())
+
+    failed = []
+    for check in (failover, deadline, hedge_after_p95, no_hedge_past_deadline, timeout_blame, breaker):
+        ok = asyncio.run(check())
+        print(f"  {check.__name__:<24} {'ok' if ok else 'FAILED'}")
+        if not ok:
+            failed.append(check.__name__)
+    return failed
+
+def hedge(args):
+    import llm as finchat
+    from server import app
+    from deployments import llm_hedges
+
+    print("routing checks")
+    failed = check_routing()
+    if failed:
+        print("Routing checks failed: " + ", ".join(failed))
+        sys.exit(1)
+
+    # Each prompt reaches the LLM once or twice, never the fast path or the semantic cache
+    prompts = ["Display earnings history for NVDA", "Explain the 50/30/20 rule", "Show me recommendation trends for MSFT",
+               "How should I build an emergency fund?"]
+    flaky = {"latency": args.llm_latency, "slow_rate": args.slow_rate, "slow_latency": args.slow_latency, "failure_rate": args.failure_rate}
+    scenarios = [
+        ("1 deployment", [flaky], False),
+        ("3 deployments, failover", [flaky] * 3, False),
+        ("3 deployments, hedged", [flaky] * 3, True),
+        ("3 deployments, 1 down, hedged", [flaky, flaky, {**flaky, "failure_rate": 1.0}], True),
+    ]
+    finchat.LLM_MIN_HEDGE_DELAY = args.min_hedge_delay
+    finchat.LLM_CALL_TIMEOUT = args.call_timeout
+
+    async def run(total):
+        transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)  # Failed turns count as 500s
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            latencies, bodies = [], []
+            queue = asyncio.Queue()
+            for i in range(total):
+                queue.put_nowait(prompts[i % len(prompts)])
+
+            async def worker():
+                while not queue.empty():
+                    prompt = queue.get_nowait()
+                    start = time.perf_counter()
+                    response = await client.post("/", json={"prompt": prompt})
+                    latencies.append(time.perf_counter() - start)
+                    bodies.append(response.json() if response.status_code == 200 else None)
+
+            await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+        failed = sum(1 for body in bodies if body is None or body["message"] == finchat.OUT_OF_TIME)
+        return latencies, failed
+
+    print(f"{'scenario':<32} {'p50 ms':>7} {'p95 ms':>7} {'p99 ms':>7} {'max ms':>7} {'failed':>6} {'hedges won/sent':>16}")
+    for label, deployments, hedged in scenarios:
+        finchat.LLM_HEDGE = hedged
+        install_fakes(finnhub_latency=args.finnhub_latency, deployments=deployments)
+        finchat.response_cache.threshold = 2.0
+        random.seed(1)
+        won, lost = llm_hedges.value(result="won"), llm_hedges.value(result="lost")
+        latencies, failed = asyncio.run(run(args.requests))
+        won, lost = llm_hedges.value(result="won") - won, llm_hedges.value(result="lost") - lost
+        print(f"{label:<32} {percentile(latencies, 50) * 1000:>7.0f} {percentile(latencies, 95) * 1000:>7.0f} "
+              f"{percentile(latencies, 99) * 1000:>7.0f} {max(latencies) * 1000:>7.0f} {failed:>6} {f'{won:.0f}/{won + lost:.0f}':>16}")
+
+def coalesce(args):
+    fake_llm, fake_finnhub = install_fakes(llm_latency=args.llm_latency, finnhub_latency=args.finnhub_latency)
+    import llm as finchat
+    from server import app, coalescer
+
+    # The same few questions asked by many users at once, spelled slightly differently
+    prompts = ["What's happening with TSLA?", "whats happening with tsla", "Display earnings history for NVDA",
+               "display earnings history for NVDA.", "Explain the 50/30/20 rule"]
+    finchat.response_cache.threshold = 2.0  # Only coalescing may share answers
+
+    async def run(total, window):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            async def send(i):
+                # A mix of POST / and /stream, with and without new sessions
+                path = "/stream" if i % 2 else "/"
+                body = {"prompt": prompts[i % len(prompts)], "session_id": f"bench-{window}-{i}" if i % 3 else None}
+                start = time.perf_counter()
+                response = await client.post(path, json=body)
+                ok = response.status_code == 200 and '"type": "error"' not in response.text
+                return time.perf_counter() - start, ok
+
+            start = time.perf_counter()
+            results = await asyncio.gather(*(send(i) for i in range(total)))
+            return time.perf_counter() - start, [latency for latency, _ in results], sum(1 for _, ok in results if not ok)
+
+    async def compare():
+        print(f"{'window':>7} {'seconds':>8} {'p50 ms':>7} {'p95 ms':>7} {'LLM calls':>10} {'Finnhub calls':>14} {'failed':>7}")
+        for window in (0, args.window):
+            coalescer.window = window
+            finchat.finnhub_client.clear()
+            llm_calls, finnhub_calls = fake_llm.calls, fake_finnhub.calls
+            elapsed, latencies, failed = await run(args.requests, window)
+            print(f"{window:>7g} {elapsed:>8.2f} {percentile(latencies, 50) * 1000:>7.0f} {percentile(latencies, 95) * 1000:>7.0f} "
+                  f"{fake_llm.calls - llm_calls:>10} {fake_finnhub.calls - finnhub_calls:>14} {failed:>7}")
+
+    asyncio.run(compare())
+
+def quotes(args):
+    from fakes import FakeQuoteServer
+
+    server = FakeQuoteServer(interval=args.trade_interval, symbol_limit=args.max_symbols)
+    os.environ["QUOTE_FEED_MAX_SYMBOLS"] = str(args.max_symbols)
+    os.environ["QUOTE_FEED_REBALANCE_SECONDS"] = "0.5"
+    import llm as finchat
+    from quotefeed import quote_feed_lookups
+
+    letters = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+    universe = [f"Q{letters[i // 26 % 26]}{letters[i % 26]}" for i in range(args.symbols)]
+    # Requests follow a Zipf distribution, and halfway through interest moves to other symbols
+    weights = [1 / (rank + 1) ** args.zipf for rank in range(len(universe))]
+    random.seed(1)
+
+    def phase(symbols, lookups):
+        latencies, ages = [], []
+        hits = quote_feed_lookups.value(result="hit")
+        for symbol in random.choices(symbols, weights=weights, k=lookups):
+            start = time.perf_counter()
+            quote = finchat.latest_quote(symbol)
+            latencies.append(time.perf_counter() - start)
+            ages.append(time.time() - quote["t"])
+            time.sleep(args.pause)
+        return latencies, ages, quote_feed_lookups.value(result="hit") - hits
+
+    print(f"{'feed':<5} {'phase':<14} {'p50 µs':>8} {'p99 µs':>8} {'mean µs':>8} {'REST calls':>11} {'feed hits':>10} {'mean age s':>11}")
+    for with_feed in (False, True):
+        _, fake_finnhub = install_fakes(finnhub_latency=args.finnhub_latency, quote_feed=server if with_feed else None)
+        if with_feed:
+            finchat.quote_feed.decay_interval = 2.0  # Fast enough for the shift to show within the run
+        for label, symbols in (("hot set A", universe), ("hot set B", universe[::-1])):
+            calls = fake_finnhub.calls
+            latencies, ages, hits = phase(symbols, args.lookups)
+            print(f"{'on' if with_feed else 'off':<5} {label:<14} {percentile(latencies, 50) * 1e6:>8.0f} {percentile(latencies, 99) * 1e6:>8.0f} "
+                  f"{statistics.mean(latencies) * 1e6:>8.0f} {fake_finnhub.calls - calls:>11} {hits / len(latencies):>10.0%} "
+                  f"{statistics.mean(ages):>11.1f}")
+    print(f"most symbols subscribed at once: {server.max_subscribed} (budget {args.max_symbols}), trades received: {server.trades}")
+    finchat.quote_feed.stop()
+    server.close()
+
+# Runs in a fresh interpreter, so the import is as cold as in a new container. The real Azure clients are
+# built (that cost is part of a cold start) but the fake model answers
+STARTUP_PROBE = """
+import asyncio, json, sys, time
+start = time.perf_counter()
+import server
+import_seconds = time.perf_counter() - start
+
+import httpx
+import llm as finchat
+from fakes import install_fakes
+
+install_fakes(llm_latency=float(sys.argv[2]), finnhub_latency=float(sys.argv[3]))
+fake_models = [(d.name, d.model) for d in finchat.llm.deployments]
+build_azure_models = finchat.azure_models
+finchat.azure_models = lambda: (build_azure_models(), fake_models)[1]
+finchat.llm = None
+finchat.response_cache.threshold = 2.0  # The second request must not be a cached answer to the first
+
+async def main():
+    result = {"import": import_seconds}
+    if sys.argv[1] == "warm":
+        await server.prewarm()
+        result["warm_up"] = server.startup["seconds"]
+        result["steps"] = server.startup["steps"]
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        for name, symbol in (("first", "NVDA"), ("second", "MSFT")):
+            start = time.perf_counter()
+            response = await client.post("/", json={"prompt": f"Display earnings history for {symbol}"})
+            assert response.status_code == 200, response.text
+            result[name] = time.perf_counter() - start
+    print(json.dumps(result))
+
+asyncio.run(main())
+"""
+
+def startup(args):
+    def probe(mode):
+        out = subprocess.run([sys.executable, "-c", STARTUP_PROBE, mode, str(args.llm_latency), str(args.finnhub_latency)],
+                             capture_output=True, text=True, check=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+        return json.loads(out.stdout.strip().splitlines()[-1])
+
+    runs = {mode: [probe(mode) for _ in range(args.repeat)] for mode in ("cold", "warm")}
+
+    def median(mode, key):
+        return statistics.median(run[key] for run in runs[mode])
+
+    print(f"{'':<34} {'no warm-up':>11} {'warm-up':>9}")
+    print(f"{'import server (s)':<34} {median('cold', 'import'):>11.2f} {median('warm', 'import'):>9.2f}")
+    print(f"{'warm-up until /readyz (s)':<34} {'-':>11} {median('warm', 'warm_up'):>9.2f}")
+    print(f"{'first request (ms)':<34} {median('cold', 'first') * 1000:>11.0f} {median('warm', 'first') * 1000:>9.0f}")
+    print(f"{'second request (ms)':<34} {median('cold', 'second') * 1000:>11.0f} {median('warm', 'second') * 1000:>9.0f}")
+    steps = runs["warm"][0]["steps"]
+    print("warm-up steps (s): " + ", ".join(f"{step} {seconds:.2f}" for step, seconds in steps.items()))
+
+# Prompts naming companies, with the symbol they should resolve to
+NAME_PROMPTS = [
+    ("What's the price of apple?", "AAPL"), ("What's the price of berkshire b?", "BRK.B"),
+    ("Tell me about palo alto networks", "PANW"), ("Show earnings for eli lilly", "LLY"),
+    ("How is coca-cola doing?", "KO"), ("Quote for general motors", "GM"), ("Tell me about snowflake", "SNOW"),
+    ("Recommendation trends for unitedhealth", "UNH"), ("News on crowdstrike", "CRWD"), ("Price of costco", "COST"),
+    # Everyday words that are also company names resolve to nothing
+    ("What's the price of bitcoin?", None), ("Snowball vs debt avalanche", None), ("How big should my emergency fund be?", None),
+]
+
+def symbols(args):
+    import symbols as symbol_index
+    import router
+    from fakes import FakeFinnhubClient
+
+    def timed(fn, repeat=1):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            result = fn()
+        return result, (time.perf_counter() - start) / repeat
+
+    records, fetch_seconds = timed(FakeFinnhubClient(symbol_count=args.symbols).stock_symbols)
+    index, build_seconds = timed(lambda: symbol_index.SymbolIndex.from_finnhub(records))
+    path = os.path.join(tempfile.mkdtemp(), "symbols.idx")
+    index.save(path)
+    index, load_seconds = timed(lambda: symbol_index.SymbolIndex.load(path), repeat=5)
+    print(f"{len(index)} symbols: fake fetch {fetch_seconds * 1000:.0f} ms, build {build_seconds * 1000:.0f} ms, "
+          f"load from disk {load_seconds * 1000:.0f} ms ({os.path.getsize(path) / 1024:.0f} KiB)")
+
+    index.search("nvidai")  # Builds the trigram index once
+    print(f"\n{'lookup':<50} {'µs':>8} result")
+    for label, fn in (
+        ("search symbol 'BRK.B'", lambda: index.search("BRK.B")),
+        ("search name 'berkshire b'", lambda: index.search("berkshire b")),
+        ("search prefix 'micros'", lambda: index.search("micros")),
+        ("search misspelling 'nvidai'", lambda: index.search("nvidai")),
+        ("mentions in 'Is general motors a buy vs coca-cola?'", lambda: index.mentions("Is general motors a buy vs coca-cola?")),
+    ):
+        result, seconds = timed(fn, repeat=args.repeat)
+        print(f"{label:<50} {seconds * 1e6:>8.1f} {' '.join(entry['symbol'] for entry in result)}")
+
+    catalog = types.SimpleNamespace(index=index)
+    print(f"\n{'prompt':<42} {'names only':>11} {'with index':>11}")
+    resolved = {False: 0, True: 0}
+    for prompt, expected in NAME_PROMPTS:
+        found = {}
+        for with_index in (False, True):
+            router.symbol_catalog = catalog if with_index else None
+            found[with_index] = router.find_symbols(prompt)
+            resolved[with_index] += found[with_index] == ([expected] if expected else [])
+        print(f"{prompt:<42} {' '.join(found[False]) or '-':>11} {' '.join(found[True]) or '-':>11}")
+    print(f"{'resolved correctly':<42} {resolved[False]:>8}/{len(NAME_PROMPTS)} {resolved[True]:>8}/{len(NAME_PROMPTS)}")
+
+def rerun(args):
+    import logging
+    from streamlit.testing.v1 import AppTest
+    # AppTest warns about a missing script context on every run, which does not affect the timing
+    logging.getLogger("streamlit.runtime.scriptrunner_utils.script_run_context").addFilter(lambda record: False)
+
+    def conversation(n):
+        text = "AAPL closed at **$189.84**, up 1.2% on the day. Analysts remain mostly bullish, with " + "more detail " * 20
+        return [
+            {"role": "user" if i % 2 == 0 else "assistant", "content": f"Question {i}" if i % 2 == 0 else text, "id": f"msg_{i}"}
+            for i in range(n)
+        ]
+
+    print(f"{'messages':>9} {'window':>7} {'ms/rerun':>9} {'elements':>9}")
+    for n in args.messages:
+        for window in (args.window, 0):
+            # client.py reads the window when the script runs, 0 draws the whole history
+            os.environ["CLIENT_RENDER_WINDOW"] = str(window)
+            at = AppTest.from_file("client.py", default_timeout=60)
+            at.session_state["conversation"] = conversation(n)
+            at.session_state["message_counter"] = n
+            at.session_state["current_chart_id"] = None
+            at.session_state["session_id"] = "bench"
+            at.run()  # The first run also imports the script's modules
+            start = time.perf_counter()
+            for _ in range(args.repeat):
+                at.run()
+            per_rerun = (time.perf_counter() - start) / args.repeat
+            print(f"{n:>9} {window or 'all':>7} {per_rerun * 1000:>9.1f} {len(at.chat_message):>9}")
+
+def load_corpus(path):
+    """Prompts of a JSONL corpus, one {"prompt": ..., "session": optional label} object per line.
+
+    Lines sharing a session label are sent in order as one conversation.
+    """
+    corpus = []
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                entry = json.loads(line)
+                corpus.append((entry["prompt"], entry.get("session")))
+    return corpus
+
+def percentile(values, q):
+    """The q-th percentile (0-100) of `values` by linear interpolation"""
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    position = (len(ordered) - 1) * q / 100
+    low = int(position)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (position - low)
+
+async def monitor_loop(lags, rss, stop, interval=0.01):
+    """Sample event-loop lag (how late a sleep wakes up) and RSS until `stop` is set"""
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        start = loop.time()
+        await asyncio.sleep(interval)
+        lags.append(max(0.0, loop.time() - start - interval))
+        rss.append(rss_mb())
+
+async def run_replay(app, corpus, concurrency, total, run_id):
+    """Replay `total` corpus entries with at most `concurrency` requests in flight.
+
+    Conversations are replayed in order by a single worker so follow-up
+    questions see the earlier turns; standalone prompts are spread over all
+    workers. Returns the measurements of the run as a dict.
+    """
+    queue = asyncio.Queue()
+    for i in range(total):
+        prompt, session = corpus[i % len(corpus)]
+        queue.put_nowait((prompt, f"{run_id}-{session}-{i // len(corpus)}" if session else None))
+    conversations = {}
+    latencies, statuses = [], []
+    lags, rss = [], [rss_mb()]
+    stop = asyncio.Event()
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+
+        async def send(prompt, session_id):
+            start = time.perf_counter()
+            response = await client.post("/", json={"prompt": prompt, "session_id": session_id})
+            latencies.append(time.perf_counter() - start)
+            statuses.append(response.status_code)
+
+        async def worker():
+            while not queue.empty():
+                prompt, session_id = queue.get_nowait()
+                if session_id is None:
+                    await send(prompt, None)
+                    continue
+                # Turns of one conversation must not overlap
+                lock = conversations.setdefault(session_id, asyncio.Lock())
+                async with lock:
+                    await send(prompt, session_id)
+
+        monitor = asyncio.create_task(monitor_loop(lags, rss, stop))
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+        stop.set()
+        await monitor
+
+    return {
+        "concurrency": concurrency,
+        "requests": total,
+        "failed": sum(1 for status in statuses if status != 200),
+        "throughput": total / elapsed,
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+        "p99": percentile(latencies, 99),
+        "mean": statistics.fmean(latencies),
+        "loop_lag_p99": percentile(lags, 99),
+        "loop_lag_max": max(lags, default=0.0),
+        "rss_start": rss[0],
+        "rss_peak": max(rss),
+    }
+
+def replay(args):
+    install_fakes(llm_latency=args.llm_latency, finnhub_latency=args.finnhub_latency, token_latency=args.token_latency)
+    import llm as finchat
+    from server import app
+
+    corpus = load_corpus(args.corpus)
+    total = args.requests or len(corpus)
+    results = []
+    print(f"{'concurrency':>11} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'lag p99':>8} {'lag max':>8} {'rss MiB':>8} {'failed':>6}")
+    for concurrency in args.concurrency:
+        # Every level starts cold so the levels are comparable
+        finchat.finnhub_client.clear()
+        finchat.response_cache.clear()
+        result = asyncio.run(run_replay(app, corpus, concurrency, total, f"c{concurrency}"))
+        results.append(result)
+        print(
+            f"{concurrency:>11} {result['throughput']:>8.1f} {result['p50'] * 1000:>8.1f} {result['p95'] * 1000:>8.1f} "
+            f"{result['p99'] * 1000:>8.1f} {result['loop_lag_p99'] * 1000:>8.1f} {result['loop_lag_max'] * 1000:>8.1f} "
+            f"{result['rss_peak']:>8.1f} {result['failed']:>6}"
+        )
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = {r["concurrency"]: r for r in json.load(f)}
+        regressions = [
+            f"concurrency {r['concurrency']}: p95 {baseline[r['concurrency']]['p95'] * 1000:.1f} -> {r['p95'] * 1000:.1f} ms"
+            for r in results
+            if r["concurrency"] in baseline and r["p95"] > baseline[r["concurrency"]]["p95"] * (1 + args.tolerance)
+        ]
+        regressions += [f"concurrency {r['concurrency']}: {r['failed']} failed requests" for r in results if r["failed"]]
+        if regressions:
+            print("Regressions against " + args.baseline + ":\n  " + "\n  ".join(regressions))
+            sys.exit(1)
+        print(f"No p95 regression beyond {args.tolerance:.0%} against {args.baseline}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    load_parser = subparsers.add_parser("load", help="throughput of POST / at increasing concurrency")
+    load_parser.add_argument("--concurrency", type=lambda s: [int(x) for x in s.split(",")], default=[1, 4, 16, 64])
+    load_parser.add_argument("--requests", type=int, default=256)
+    load_parser.add_argument("--llm-latency", type=float, default=0.2)
+    load_parser.add_argument("--finnhub-latency", type=float, default=0.1)
+    load_parser.set_defaults(func=load)
+
+    stream_parser = subparsers.add_parser("stream", help="time to first token versus full answer on /stream")
+    stream_parser.add_argument("--llm-latency", type=float, default=0.2)
+    stream_parser.add_argument("--finnhub-latency", type=float, default=0.1)
+    stream_parser.add_argument("--token-latency", type=float, default=0.02)
+    stream_parser.set_defaults(func=stream)
+
+    cache_parser = subparsers.add_parser("cache", help="Finnhub calls saved by the response cache")
+    cache_parser.add_argument("--backend", choices=["memory", "redis"], default="memory")
+    cache_parser.add_argument("--concurrency", type=int, default=32)
+    cache_parser.add_argument("--requests", type=int, default=256)
+    cache_parser.add_argument("--llm-latency", type=float, default=0.05)
+    cache_parser.add_argument("--finnhub-latency", type=float, default=0.2)
+    cache_parser.set_defaults(func=cache)
+
+    soak_parser = subparsers.add_parser("soak", help="RSS and stored threads over many requests")
+    soak_parser.add_argument("--requests", type=int, default=100_000)
+    soak_parser.add_argument("--concurrency", type=int, default=16)
+    soak_parser.add_argument("--report-every", type=int, default=10_000)
+    soak_parser.set_defaults(func=soak)
+
+    fanout_parser = subparsers.add_parser("fanout", help="one multi-symbol tool call versus one call per symbol")
+    fanout_parser.add_argument("--symbols", type=int, default=10)
+    fanout_parser.add_argument("--finnhub-latency", type=float, default=0.2)
+    fanout_parser.set_defaults(func=fanout)
+
+    news_parser = subparsers.add_parser("news", help="news digest latency and prompt tokens saved")
+    news_parser.add_argument("--articles", type=int, default=1000)
+    news_parser.add_argument("--query", default="What does the latest earnings guidance mean for AAPL?")
+    news_parser.add_argument("--token-budget", type=int, default=800)
+    news_parser.add_argument("--repeat", type=int, default=5)
+    news_parser.set_defaults(func=news)
+
+    fastpath_parser = subparsers.add_parser("fastpath", help="share and latency of prompts answered without the LLM")
+    fastpath_parser.add_argument("--requests", type=int, default=40)
+    fastpath_parser.add_argument("--llm-latency", type=float, default=0.2)
+    fastpath_parser.add_argument("--finnhub-latency", type=float, default=0.1)
+    fastpath_parser.set_defaults(func=fastpath)
+
+    semantic_parser = subparsers.add_parser("semantic", help="hit rate and latency of the semantic response cache")
+    semantic_parser.add_argument("--requests", type=int, default=60)
+    semantic_parser.add_argument("--llm-latency", type=float, default=0.3)
+    semantic_parser.set_defaults(func=semantic)
+
+    candles_parser = subparsers.add_parser("candles", help="Finnhub calls and latency of price history lookups on the local candle store")
+    candles_parser.add_argument("--symbols", type=int, default=20)
+    candles_parser.add_argument("--repeat", type=int, default=3)
+    candles_parser.add_argument("--finnhub-latency", type=float, default=0.1)
+    candles_parser.set_defaults(func=candles)
+
+    tokens_parser = subparsers.add_parser("tokens", help="prompt tokens and latency of tool-using turns with raw versus projected tool output")
+    tokens_parser.add_argument("--repeat", type=int, default=4)
+    tokens_parser.add_argument("--llm-latency", type=float, default=0.05)
+    tokens_parser.add_argument("--prompt-token-latency", type=float, default=0.0001, help="fake LLM seconds per prompt token")
+    tokens_parser.set_defaults(func=tokens)
+
+    batch_parser = subparsers.add_parser("batch", help="wall time of a template over many symbols, sequential POSTs versus /batch")
+    batch_parser.add_argument("--symbols", type=int, default=100)
+    batch_parser.add_argument("--concurrency", type=lambda s: [int(x) for x in s.split(",")], default=[1, 4, 16])
+    batch_parser.add_argument("--llm-latency", type=float, default=0.1)
+    batch_parser.add_argument("--finnhub-latency", type=float, default=0.05)
+    batch_parser.set_defaults(func=batch)
+
+    hedge_parser = subparsers.add_parser("hedge", help="LLM tail latency and failures with one or several flaky deployments, with and without hedging")
+    hedge_parser.add_argument("--requests", type=int, default=400)
+    hedge_parser.add_argument("--concurrency", type=int, default=16)
+    hedge_parser.add_argument("--llm-latency", type=float, default=0.1)
+    hedge_parser.add_argument("--slow-rate", type=float, default=0.05, help="share of LLM calls that are slow")
+    hedge_parser.add_argument("--slow-latency", type=float, default=2.0)
+    hedge_parser.add_argument("--failure-rate", type=float, default=0.02, help="share of LLM calls that fail")
+    hedge_parser.add_argument("--min-hedge-delay", type=float, default=0.05)
+    hedge_parser.add_argument("--call-timeout", type=float, default=5.0)
+    hedge_parser.add_argument("--finnhub-latency", type=float, default=0.02)
+    hedge_parser.set_defaults(func=hedge)
+
+    symbols_parser = subparsers.add_parser("symbols", help="symbol index load time, lookup latency and company names resolved")
+    symbols_parser.add_argument("--symbols", type=int, default=30_000)
+    symbols_parser.add_argument("--repeat", type=int, default=2000)
+    symbols_parser.set_defaults(func=symbols)
+
+    coalesce_parser = subparsers.add_parser("coalesce", help="a burst of identical prompts with and without in-flight coalescing")
+    coalesce_parser.add_argument("--requests", type=int, default=200)
+    coalesce_parser.add_argument("--window", type=float, default=5.0)
+    coalesce_parser.add_argument("--llm-latency", type=float, default=0.3)
+    coalesce_parser.add_argument("--finnhub-latency", type=float, default=0.1)
+    coalesce_parser.set_defaults(func=coalesce)
+
+    quotes_parser = subparsers.add_parser("quotes", help="price lookup latency and REST calls with and without the live quote feed")
+    quotes_parser.add_argument("--symbols", type=int, default=500)
+    quotes_parser.add_argument("--lookups", type=int, default=3000, help="lookups per phase")
+    quotes_parser.add_argument("--max-symbols", type=int, default=50)
+    quotes_parser.add_argument("--zipf", type=float, default=1.1)
+    quotes_parser.add_argument("--pause", type=float, default=0.001, help="seconds between lookups")
+    quotes_parser.add_argument("--trade-interval", type=float, default=0.05)
+    quotes_parser.add_argument("--finnhub-latency", type=float, default=0.05)
+    quotes_parser.set_defaults(func=quotes)
+
+    startup_parser = subparsers.add_parser("startup", help="import time, warm-up time and first-request latency of a fresh server process")
+    startup_parser.add_argument("--repeat", type=int, default=3)
+    startup_parser.add_argument("--llm-latency", type=float, default=0.1)
+    startup_parser.add_argument("--finnhub-latency", type=float, default=0.05)
+    startup_parser.set_defaults(func=startup)
+
+    rerun_parser = subparsers.add_parser("rerun", help="Streamlit client rerun time against conversation length, windowed versus full")
+    rerun_parser.add_argument("--messages", type=lambda s: [int(x) for x in s.split(",")], default=[10, 50, 200, 1000])
+    rerun_parser.add_argument("--window", type=int, default=20)
+    rerun_parser.add_argument("--repeat", type=int, default=5)
+    rerun_parser.set_defaults(func=rerun)
+
+    replay_parser = subparsers.add_parser("replay", help="latency percentiles, throughput, RSS and event-loop lag over a JSONL corpus")
+    replay_parser.add_argument("--corpus", default="bench_corpus.jsonl")
+    replay_parser.add_argument("--concurrency", type=lambda s: [int(x) for x in s.split(",")], default=[1, 8, 32])
+    replay_parser.add_argument("--requests", type=int, default=0, help="requests per level, defaults to the corpus size")
+    replay_parser.add_argument("--llm-latency", type=float, default=0.2)
+    replay_parser.add_argument("--finnhub-latency", type=float, default=0.1)
+    replay_parser.add_argument("--token-latency", type=float, default=0.0)
+    replay_parser.add_argument("--save", help="write the results as JSON, to use as a later baseline")
+    replay_parser.add_argument("--baseline", help="exit with status 1 if p95 latency regresses against these saved results")
+    replay_parser.add_argument("--tolerance", type=float, default=0.2, help="allowed p95 increase over the baseline")
+    replay_parser.set_defaults(func=replay)
+
+    threads_parser = subparsers.add_parser("threads", help="conversations spread over workers sharing a persistent checkpointer")
+    threads_parser.add_argument("--store", choices=["memory", "sqlite", "redis"], default="sqlite")
+    threads_parser.add_argument("--workers", type=int, default=2)
+    threads_parser.add_argument("--conversations", type=int, default=50)
+    threads_parser.add_argument("--turns", type=int, default=4)
+    threads_parser.add_argument("--llm-latency", type=float, default=0.05)
+    threads_parser.add_argument("--finnhub-latency", type=float, default=0.02)
+    threads_parser.set_defaults(func=threads)
+
+    args = parser.parse_args()
+    args.func(args)
+
+if __name__ == "__main__":
+    main()
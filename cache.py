@@ -0,0 +1,206 @@
+import contextlib, contextvars, json, threading, time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+from metrics import registry
+from tracing import record_cache_result
+
+# Seconds each Finnhub endpoint stays fresh: quotes move constantly, news hourly,
+# profiles, earnings and analyst recommendations change a few times a quarter
+CACHE_TTLS = {
+    "quote": 15,
+    "company_news": 10 * 60,
+    "company_profile2": 6 * 60 * 60,
+    "company_earnings": 6 * 60 * 60,
+    "recommendation_trends": 6 * 60 * 60,
+}
+
+finnhub_cache_requests = registry.counter(
+    "finchat_finnhub_cache_requests_total",
+    "Finnhub lookups by endpoint and result (hit, miss or coalesced)"
+)
+
+# Results already looked up inside a `snapshot()` block, by cache key
+_snapshot = contextvars.ContextVar("finnhub_snapshot", default=None)
+
+@contextlib.contextmanager
+def snapshot():
+    """Serve every repeated Finnhub lookup inside the block from its first result, even past its TTL.
+
+    Tasks and threads started from the block share the same snapshot, so all
+    items of a batch see one consistent set of data and fetch each call once.
+    """
+    token = _snapshot.set({})
+    try:
+        yield
+    finally:
+        _snapshot.reset(token)
+
+class MemoryBackend:
+    """In-process cache with a TTL per entry and least-recently-used eviction"""
+
+    def __init__(self, max_entries=4096):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+class RedisBackend:
+    """Cache stored in Redis (or anything speaking its get/set/scan API) and shared by every worker.
+
+    Values are stored as JSON and expire through Redis' own TTLs; size bounds
+    and eviction come from the server's `maxmemory` policy.
+    """
+
+    def __init__(self, client, prefix="finchat:finnhub:"):
+        self.client = client
+        self.prefix = prefix
+
+    def get(self, key):
+        raw = self.client.get(self.prefix + key)
+        if raw is None:
+            return None
+        return json.loads(raw)
+
+    def set(self, key, value, ttl):
+        self.client.set(self.prefix + key, json.dumps(value, separators=(",", ":")), ex=int(ttl))
+
+    def clear(self):
+        for key in self.client.scan_iter(match=self.prefix + "*"):
+            self.client.delete(key)
+
+def create_backend(kind="memory", max_entries=4096, redis_url=None):
+    """Build the cache backend named by `kind` ("memory" or "redis")"""
+    if kind == "redis":
+        # Optional dependency, only needed when the cache is shared across workers
+        import redis
+        return RedisBackend(redis.Redis.from_url(redis_url or "redis://localhost:6379/0"))
+    return MemoryBackend(max_entries=max_entries)
+
+class CachedFinnhubClient:
+    """Wrap a `finnhub.Client` so repeated lookups are served from a shared cache.
+
+    Concurrent misses for the same call are coalesced: the first caller fetches
+    from Finnhub and the others wait for its result instead of issuing their own
+    request. Upstream requests take a token from `rate_limiter` first, if given.
+    Cached values are shared between callers and must not be mutated.
+    """
+
+    def __init__(self, client, backend=None, ttls=None, rate_limiter=None):
+        self.client = client
+        self.backend = backend if backend is not None else MemoryBackend()
+        self.rate_limiter = rate_limiter
+        self.ttls = {**CACHE_TTLS, **(ttls or {})}
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def _cached(self, endpoint, **kwargs):
+        key = endpoint + ":" + json.dumps(kwargs, sort_keys=True, separators=(",", ":"))
+        taken = _snapshot.get()
+        if taken is None:
+            return self._lookup(endpoint, key, kwargs)
+        if key in taken:
+            finnhub_cache_requests.inc(endpoint=endpoint, result="hit")
+            record_cache_result(endpoint, "hit")
+            return taken[key]
+        value = taken[key] = self._lookup(endpoint, key, kwargs)
+        return value
+
+    def _lookup(self, endpoint, key, kwargs):
+        value = self.backend.get(key)
+        if value is not None:
+            finnhub_cache_requests.inc(endpoint=endpoint, result="hit")
+            record_cache_result(endpoint, "hit")
+            return value
+
+        with self._lock:
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = self._inflight[key] = Future()
+
+        if not leader:
+            finnhub_cache_requests.inc(endpoint=endpoint, result="coalesced")
+            record_cache_result(endpoint, "coalesced")
+            return future.result()
+
+        finnhub_cache_requests.inc(endpoint=endpoint, result="miss")
+        record_cache_result(endpoint, "miss")
+        try:
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire()
+            value = getattr(self.client, endpoint)(**kwargs)
+            if value is not None:
+                self.backend.set(key, value, self.ttls[endpoint])
+            future.set_result(value)
+            return value
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[key]
+
+    def company_profile2(self, symbol):
+        return self._cached("company_profile2", symbol=symbol)
+
+    def recommendation_trends(self, symbol):
+        return self._cached("recommendation_trends", symbol=symbol)
+
+    def quote(self, symbol):
+        return self._cached("quote", symbol=symbol)
+
+    def company_earnings(self, symbol):
+        return self._cached("company_earnings", symbol=symbol)
+
+    def company_news(self, symbol, _from, to):
+        return self._cached("company_news", symbol=symbol, _from=_from, to=to)
+
+    def stock_candles(self, symbol, resolution, _from, to):
+        """Fetch candles straight from Finnhub, history is cached by `candles.CandleStore`"""
+        finnhub_cache_requests.inc(endpoint="stock_candles", result="miss")
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire()
+        return self.client.stock_candles(symbol, resolution, _from, to)
+
+    def stock_symbols(self, exchange):
+        """Fetch an exchange's symbol list straight from Finnhub, it is kept by `symbols.SymbolCatalog`"""
+        finnhub_cache_requests.inc(endpoint="stock_symbols", result="miss")
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire()
+        return self.client.stock_symbols(exchange)
+
+    def stats(self):
+        """Hit, miss and coalesced counts per endpoint"""
+        stats = {}
+        for _, labels, value in finnhub_cache_requests.samples():
+            stats.setdefault(labels["endpoint"], {})[labels["result"]] = value
+        return stats
+
+    def clear(self):
+        self.backend.clear()
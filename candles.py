@@ -0,0 +1,221 @@
+import datetime, json, os, threading
+
+import numpy as np
+
+from metrics import registry
+
+candle_requests = registry.counter(
+    "finchat_candle_requests_total",
+    "Candle lookups by how much of the range had to be downloaded (none, partial or full)"
+)
+
+COLUMNS = ("t", "o", "h", "l", "c", "v")
+RESOLUTION_SECONDS = {"1": 60, "5": 300, "15": 900, "30": 1800, "60": 3600, "D": 86400, "W": 7 * 86400, "M": 31 * 86400}
+# The newest bars are fetched again once the stored range is this far behind
+REFRESH_SECONDS = 15 * 60
+
+PERIOD_DAYS = {"1m": 31, "3m": 92, "6m": 183, "1y": 365, "2y": 730, "5y": 1826}
+# Extra history fetched before a window so the 200-day average is defined from its first day
+WARMUP_DAYS = 300
+TRADING_DAYS_PER_YEAR = 252
+
+def _empty():
+    return {name: np.zeros(0, dtype=np.int64 if name == "t" else np.float64) for name in COLUMNS}
+
+def merge(parts):
+    """Concatenate candle column dicts into one sorted by time, later parts winning on equal timestamps"""
+    merged = {name: np.concatenate([part[name] for part in parts]) for name in COLUMNS}
+    order = np.argsort(merged["t"], kind="stable")
+    t = merged["t"][order]
+    # A stable sort keeps the parts in order, so the last bar of each run of equal times is the newest
+    keep = order[np.r_[t[1:] != t[:-1], True]] if len(t) else order
+    return {name: merged[name][keep] for name in COLUMNS}
+
+class CandleStore:
+    """Candle history per symbol and resolution, kept as memory-mapped NumPy column files.
+
+    Each series lives in `root/<resolution>/<symbol>/` as one .npy file per column
+    plus meta.json with the time range already covered. A lookup downloads only
+    the parts of the requested range outside that coverage, so history is never
+    fetched twice; the newest bar is fetched again once the coverage is more than
+    REFRESH_SECONDS behind the requested end.
+
+    Args:
+        root (str): Directory of the store
+        fetch (callable): fetch(symbol, resolution, from_ts, to_ts) returning a
+            Finnhub stock_candles response
+    """
+
+    def __init__(self, root, fetch):
+        self.root = root
+        self.fetch = fetch
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+
+    def _lock(self, key):
+        with self._locks_lock:
+            return self._locks.setdefault(key, threading.Lock())
+
+    def _dir(self, symbol, resolution):
+        return os.path.join(self.root, resolution, symbol.replace("/", "_").replace(".", "_"))
+
+    def _read(self, directory):
+        try:
+            with open(os.path.join(directory, "meta.json")) as f:
+                meta = json.load(f)
+        except FileNotFoundError:
+            return None, None
+        columns = {name: np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r") for name in COLUMNS}
+        return columns, meta
+
+    def _write(self, directory, columns, meta):
+        # Columns first and meta.json last, each replaced atomically, so readers never see a torn file
+        os.makedirs(directory, exist_ok=True)
+        for name in COLUMNS:
+            tmp = os.path.join(directory, f".{name}.npy.tmp")
+            with open(tmp, "wb") as f:
+                np.save(f, np.ascontiguousarray(columns[name]))
+            os.replace(tmp, os.path.join(directory, f"{name}.npy"))
+        tmp = os.path.join(directory, ".meta.json.tmp")
+        with open(tmp, "w") as f:
+            json.dump(meta, f)
+        os.replace(tmp, os.path.join(directory, "meta.json"))
+
+    def _missing(self, meta, start, end, resolution):
+        if meta is None:
+            return [(start, end)]
+        missing = []
+        if start < meta["from"]:
+            missing.append((start, meta["from"]))
+        if end > meta["to"] + REFRESH_SECONDS:
+            # Starting one bar early replaces a bar that was still forming when it was stored
+            missing.append((max(meta["to"] - RESOLUTION_SECONDS[resolution], meta["from"]), end))
+        return missing
+
+    def _download(self, symbol, resolution, start, end):
+        response = self.fetch(symbol, resolution, int(start), int(end)) or {}
+        if response.get("s") != "ok" or not response.get("t"):
+            return _empty()
+        return {name: np.asarray(response[name], dtype=np.int64 if name == "t" else np.float64) for name in COLUMNS}
+
+    def get(self, symbol, resolution, start, end):
+        """Candles of `symbol` with bar times in [start, end], as a dict of column arrays (t, o, h, l, c, v)"""
+        # Aligned to whole bars so lookups made moments apart ask for the same range
+        start = int(start) // RESOLUTION_SECONDS[resolution] * RESOLUTION_SECONDS[resolution]
+        end = int(end)
+        directory = self._dir(symbol, resolution)
+        with self._lock((symbol, resolution)):
+            columns, meta = self._read(directory)
+            missing = self._missing(meta, start, end, resolution)
+            candle_requests.inc(result="none" if not missing else "full" if meta is None else "partial")
+            if missing:
+                parts = [columns] if columns is not None else []
+                parts += [self._download(symbol, resolution, a, b) for a, b in missing]
+                meta = {
+                    "from": min(start, meta["from"]) if meta else start,
+                    "to": max(end, meta["to"]) if meta else end,
+                }
+                self._write(directory, merge(parts), meta)
+                columns, meta = self._read(directory)
+
+        lo, hi = np.searchsorted(columns["t"], [start, end + 1])
+        return {name: columns[name][lo:hi] for name in COLUMNS}
+
+def sma(values, window):
+    """Simple moving average, NaN until `window` values are available"""
+    out = np.full(len(values), np.nan)
+    if len(values) >= window:
+        sums = np.cumsum(np.r_[0.0, values])
+        out[window - 1:] = (sums[window:] - sums[:-window]) / window
+    return out
+
+# pandas is imported by the functions that use it: it takes about a second to load and only
+# price history questions need it, so the server starts without it
+
+def ema(values, window):
+    """Exponential moving average with the usual 2 / (window + 1) smoothing"""
+    import pandas as pd
+    return pd.Series(values).ewm(span=window, adjust=False).mean().to_numpy()
+
+def rsi(values, window=14):
+    """Wilder's relative strength index, NaN for the first `window` values"""
+    import pandas as pd
+    delta = np.diff(values, prepend=np.nan)
+    gains = pd.Series(np.clip(delta, 0, None)).ewm(alpha=1 / window, adjust=False, min_periods=window).mean()
+    losses = pd.Series(np.clip(-delta, 0, None)).ewm(alpha=1 / window, adjust=False, min_periods=window).mean()
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return (100 - 100 / (1 + gains / losses)).to_numpy()
+
+def volatility(values, window=20):
+    """Annualized rolling standard deviation of daily log returns"""
+    import pandas as pd
+    returns = np.diff(np.log(values), prepend=np.nan)
+    return pd.Series(returns).rolling(window).std().to_numpy() * np.sqrt(TRADING_DAYS_PER_YEAR)
+
+def drawdown(values):
+    """Fall from the running maximum at every point, as a negative fraction"""
+    return values / np.maximum.accumulate(values) - 1
+
+def period_start(period, now):
+    """Unix time at which a period such as "6m", "1y" or "ytd" ending at `now` starts"""
+    period = period.lower()
+    if period == "ytd":
+        return datetime.datetime(datetime.datetime.fromtimestamp(now, datetime.timezone.utc).year, 1, 1,
+                                 tzinfo=datetime.timezone.utc).timestamp()
+    if period not in PERIOD_DAYS:
+        raise ValueError(f"Unknown period {period!r}, use one of {', '.join([*PERIOD_DAYS, 'ytd'])}")
+    return now - PERIOD_DAYS[period] * 86400
+
+def analyze(columns, window_start, points=12):
+    """Summarize daily candles from `window_start` on, with indicators computed over all of `columns`.
+
+    Returns:
+        tuple: (summary dict for the model, list of daily records for the chart),
+        or (None, []) if there are no candles in the window
+    """
+    close = np.asarray(columns["c"], dtype=np.float64)
+    first = int(np.searchsorted(columns["t"], window_start))
+    if first >= len(close):
+        return None, []
+
+    series = {
+        "sma50": sma(close, 50),
+        "sma200": sma(close, 200),
+        "ema20": ema(close, 20),
+        "rsi14": rsi(close, 14),
+        "volatility20": volatility(close, 20),
+    }
+    window = close[first:]
+    dates = np.datetime_as_string(np.asarray(columns["t"][first:], dtype=np.int64).astype("datetime64[s]"), unit="D").tolist()
+    window_drawdown = drawdown(window)
+
+    def latest(values):
+        value = values[-1]
+        return None if np.isnan(value) else round(float(value), 2)
+
+    summary = {
+        "from": dates[0],
+        "to": dates[-1],
+        "start": round(float(window[0]), 2),
+        "last": round(float(window[-1]), 2),
+        "change_pct": round(float(window[-1] / window[0] - 1) * 100, 2),
+        "high": round(float(np.max(columns["h"][first:])), 2),
+        "low": round(float(np.min(columns["l"][first:])), 2),
+        "max_drawdown_pct": round(float(window_drawdown.min()) * 100, 2),
+        **{name: latest(values) for name, values in series.items()},
+    }
+    summary["volatility20"] = None if summary["volatility20"] is None else round(summary["volatility20"] * 100, 2)
+    # A few evenly spaced closes so the model can describe the path, not just the endpoints
+    picks = np.unique(np.linspace(0, len(window) - 1, min(points, len(window))).astype(int))
+    summary["closes"] = {dates[i]: round(float(window[i]), 2) for i in picks}
+
+    records = [
+        {
+            "date": dates[i],
+            "close": round(float(window[i]), 2),
+            "sma50": None if np.isnan(series["sma50"][first + i]) else round(float(series["sma50"][first + i]), 2),
+            "sma200": None if np.isnan(series["sma200"][first + i]) else round(float(series["sma200"][first + i]), 2),
+        }
+        for i in range(len(window))
+    ]
+    return summary, records
@@ -0,0 +1,400 @@
+import asyncio, atexit, random, sqlite3, threading, time, zlib
+from collections import OrderedDict
+
+import ormsgpack
+from langgraph.checkpoint.base import (
+    WRITES_IDX_MAP, BaseCheckpointSaver, CheckpointTuple, get_checkpoint_id, get_checkpoint_metadata
+)
+from langgraph.checkpoint.memory import MemorySaver
+
+from metrics import registry
+
+checkpoint_records = registry.counter(
+    "finchat_checkpoint_records_total",
+    "Checkpoint records by operation, flushed is lower than put when buffered writes are coalesced"
+)
+checkpoint_flush = registry.histogram("finchat_checkpoint_flush_seconds", "Time to write one batch of checkpoints to the store")
+
+# Flushed records kept in memory so pending writes can be added without reading the store
+RECENT_RECORDS = 1000
+
+class BoundedMemorySaver(MemorySaver):
+    """MemorySaver that forgets threads once there are too many or they sit idle.
+
+    Threads are tracked in least-recently-used order. When more than
+    `max_threads` are stored, the oldest are evicted down to 90% of the limit in
+    one pass, and any thread not touched for `idle_ttl` seconds is dropped.
+    """
+
+    def __init__(self, max_threads=1000, idle_ttl=3600, **kwargs):
+        super().__init__(**kwargs)
+        self.max_threads = max_threads
+        self.idle_ttl = idle_ttl
+        self._last_used = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _touch(self, thread_id):
+        now = time.monotonic()
+        with self._lock:
+            self._last_used[thread_id] = now
+            self._last_used.move_to_end(thread_id)
+
+            expired = []
+            for candidate, last_used in self._last_used.items():
+                if now - last_used < self.idle_ttl:
+                    break
+                expired.append(candidate)
+            if len(self._last_used) - len(expired) > self.max_threads:
+                keep = int(self.max_threads * 0.9)
+                expired = list(self._last_used)[:len(self._last_used) - keep]
+            if expired:
+                self._evict(expired)
+
+    def _evict(self, thread_ids):
+        """Drop every checkpoint, write and blob of the given threads in a single pass"""
+        thread_ids = set(thread_ids)
+        for thread_id in thread_ids:
+            self._last_used.pop(thread_id, None)
+            self.storage.pop(thread_id, None)
+        for key in [k for k in self.writes if k[0] in thread_ids]:
+            del self.writes[key]
+        for key in [k for k in self.blobs if k[0] in thread_ids]:
+            del self.blobs[key]
+
+    def get_tuple(self, config):
+        self._touch(config["configurable"]["thread_id"])
+        return super().get_tuple(config)
+
+    def put(self, config, checkpoint, metadata, new_versions):
+        self._touch(config["configurable"]["thread_id"])
+        return super().put(config, checkpoint, metadata, new_versions)
+
+    def delete_thread(self, thread_id):
+        with self._lock:
+            self._evict([thread_id])
+
+    def clear(self):
+        """Forget every thread"""
+        with self._lock:
+            self._last_used.clear()
+            self.storage.clear()
+            self.writes.clear()
+            self.blobs.clear()
+
+    def thread_count(self):
+        # Not __len__: LangGraph tests the checkpointer for truthiness
+        return len(self._last_used)
+
+    async def aflush(self):
+        pass  # Nothing is buffered, every write is already visible
+
+class SQLiteStore:
+    """Checkpoint records in a SQLite database in WAL mode, shared by every worker on the host"""
+
+    def __init__(self, path="finchat_threads.db"):
+        self.path = path
+        self._local = threading.local()
+        with self._connection() as db:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS threads ("
+                "thread_id TEXT, checkpoint_ns TEXT, data BLOB, updated_at REAL, "
+                "PRIMARY KEY (thread_id, checkpoint_ns))"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS threads_updated_at ON threads (updated_at)")
+
+    def _connection(self):
+        # sqlite3 connections belong to the thread that opened them
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+        return db
+
+    def get(self, thread_id, checkpoint_ns):
+        row = self._connection().execute(
+            "SELECT data FROM threads WHERE thread_id = ? AND checkpoint_ns = ?", (thread_id, checkpoint_ns)
+        ).fetchone()
+        return row[0] if row else None
+
+    def set_many(self, records, ttl):
+        """Write (thread_id, checkpoint_ns, data) records in one transaction"""
+        now = time.time()
+        db = self._connection()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            db.executemany(
+                "INSERT OR REPLACE INTO threads (thread_id, checkpoint_ns, data, updated_at) VALUES (?, ?, ?, ?)",
+                [(thread_id, checkpoint_ns, data, now) for thread_id, checkpoint_ns, data in records]
+            )
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+
+    def delete(self, thread_id):
+        self._connection().execute("DELETE FROM threads WHERE thread_id = ?", (thread_id,))
+
+    def prune(self, ttl):
+        """Delete threads not written for `ttl` seconds, returning how many rows were removed"""
+        return self._connection().execute("DELETE FROM threads WHERE updated_at < ?", (time.time() - ttl,)).rowcount
+
+    def clear(self):
+        self._connection().execute("DELETE FROM threads")
+
+    def thread_count(self):
+        return self._connection().execute("SELECT COUNT(DISTINCT thread_id) FROM threads").fetchone()[0]
+
+class RedisStore:
+    """Checkpoint records in Redis (or anything speaking its hash API), one hash per thread.
+
+    Threads expire through Redis' own TTLs, refreshed on every write.
+    """
+
+    def __init__(self, client, prefix="finchat:thread:"):
+        self.client = client
+        self.prefix = prefix
+
+    def get(self, thread_id, checkpoint_ns):
+        return self.client.hget(self.prefix + thread_id, checkpoint_ns)
+
+    def set_many(self, records, ttl):
+        """Write (thread_id, checkpoint_ns, data) records in one pipelined round trip"""
+        pipeline = self.client.pipeline(transaction=False)
+        for thread_id, checkpoint_ns, data in records:
+            pipeline.hset(self.prefix + thread_id, checkpoint_ns, data)
+            pipeline.expire(self.prefix + thread_id, int(ttl))
+        pipeline.execute()
+
+    def delete(self, thread_id):
+        self.client.delete(self.prefix + thread_id)
+
+    def prune(self, ttl):
+        return 0  # Redis expires idle threads itself
+
+    def clear(self):
+        for key in self.client.scan_iter(match=self.prefix + "*"):
+            self.client.delete(key)
+
+    def thread_count(self):
+        return sum(1 for _ in self.client.scan_iter(match=self.prefix + "*"))
+
+class PersistentSaver(BaseCheckpointSaver):
+    """Checkpointer backed by a store shared between workers, so any worker can continue any thread.
+
+    Only the latest checkpoint of each thread is kept, together with its
+    pending writes, as one msgpack record compressed with zlib. Writes are
+    buffered and flushed by a background thread every `flush_interval`
+    seconds, so the several checkpoints of one graph run usually cost a single
+    store write; the buffer is read first, so this worker always sees its own
+    writes. Threads not written for `ttl` seconds are pruned.
+    """
+
+    def __init__(self, store, ttl=7 * 24 * 3600, flush_interval=0.02, prune_interval=300, serde=None):
+        super().__init__(serde=serde)
+        self.store = store
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self.prune_interval = prune_interval
+        self._dirty = {}  # (thread_id, checkpoint_ns) -> record waiting to be flushed
+        self._recent = OrderedDict()  # Records this worker flushed last, to add writes without a read
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._last_prune = time.monotonic()
+        self._wake = threading.Event()
+        threading.Thread(target=self._flush_loop, name="checkpoint-flush", daemon=True).start()
+        atexit.register(self.flush)
+
+    def _flush_loop(self):
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+                if time.monotonic() - self._last_prune >= self.prune_interval:
+                    self._last_prune = time.monotonic()
+                    self.store.prune(self.ttl)
+            except Exception as e:
+                print(f"Error flushing checkpoints: {e}")
+
+    def flush(self):
+        """Write every buffered record to the store in one batch"""
+        with self._flush_lock:
+            with self._lock:
+                dirty, self._dirty = self._dirty, {}
+            if not dirty:
+                return
+            start = time.perf_counter()
+            try:
+                self.store.set_many(
+                    [(thread_id, checkpoint_ns, self._pack(record)) for (thread_id, checkpoint_ns), record in dirty.items()],
+                    self.ttl
+                )
+            except Exception:
+                # Keep the records for the next flush unless newer ones replaced them
+                with self._lock:
+                    for key, record in dirty.items():
+                        self._dirty.setdefault(key, record)
+                raise
+            checkpoint_flush.observe(time.perf_counter() - start)
+            checkpoint_records.inc(len(dirty), op="flushed")
+            with self._lock:
+                for key, record in dirty.items():
+                    self._remember(key, record)
+
+    async def aflush(self):
+        """Flush buffered records off the event loop, if there are any"""
+        if self._dirty:
+            await asyncio.to_thread(self.flush)
+
+    def _remember(self, key, record):
+        self._recent[key] = record
+        self._recent.move_to_end(key)
+        while len(self._recent) > RECENT_RECORDS:
+            self._recent.popitem(last=False)
+
+    @staticmethod
+    def _pack(record):
+        return zlib.compress(ormsgpack.packb(record), 1)
+
+    @staticmethod
+    def _unpack(data):
+        return ormsgpack.unpackb(zlib.decompress(data))
+
+    def _load(self, thread_id, checkpoint_ns):
+        with self._lock:
+            record = self._dirty.get((thread_id, checkpoint_ns))
+        if record is not None:
+            return record
+        data = self.store.get(thread_id, checkpoint_ns)
+        return self._unpack(data) if data is not None else None
+
+    def get_tuple(self, config):
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        record = self._load(thread_id, checkpoint_ns)
+        checkpoint_id = get_checkpoint_id(config)
+        if record is None or (checkpoint_id and checkpoint_id != record["id"]):
+            return None
+        writes = sorted(record["writes"], key=lambda w: (w[0], w[1]))
+        return CheckpointTuple(
+            config={"configurable": {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns, "checkpoint_id": record["id"]}},
+            checkpoint=self.serde.loads_typed(tuple(record["checkpoint"])),
+            metadata=self.serde.loads_typed(tuple(record["metadata"])),
+            pending_writes=[(task_id, channel, self.serde.loads_typed((kind, value))) for task_id, _, channel, kind, value, _ in writes],
+            parent_config=(
+                {"configurable": {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns, "checkpoint_id": record["parent"]}}
+                if record["parent"] else None
+            ),
+        )
+
+    def list(self, config, *, filter=None, before=None, limit=None):
+        """The latest checkpoint of the thread in `config`, the only one this saver keeps"""
+        if config is None or limit == 0:
+            return
+        checkpoint = self.get_tuple(config)
+        if checkpoint is None:
+            return
+        if before is not None and checkpoint.config["configurable"]["checkpoint_id"] >= get_checkpoint_id(before):
+            return
+        if filter and any(checkpoint.metadata.get(k) != v for k, v in filter.items()):
+            return
+        yield checkpoint
+
+    def put(self, config, checkpoint, metadata, new_versions):
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        record = {
+            "id": checkpoint["id"],
+            "parent": config["configurable"].get("checkpoint_id"),
+            "checkpoint": list(self.serde.dumps_typed(checkpoint)),
+            "metadata": list(self.serde.dumps_typed(get_checkpoint_metadata(config, metadata))),
+            "writes": [],
+        }
+        with self._lock:
+            self._dirty[(thread_id, checkpoint_ns)] = record
+        checkpoint_records.inc(op="put")
+        return {"configurable": {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns, "checkpoint_id": checkpoint["id"]}}
+
+    def put_writes(self, config, writes, task_id, task_path=""):
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        checkpoint_id = config["configurable"]["checkpoint_id"]
+        key = (thread_id, checkpoint_ns)
+        with self._lock:
+            record = self._dirty.get(key) or self._recent.get(key)
+        if record is None or record["id"] != checkpoint_id:
+            data = self.store.get(thread_id, checkpoint_ns)
+            record = self._unpack(data) if data is not None else None
+            if record is None or record["id"] != checkpoint_id:
+                return  # Writes for a checkpoint that is no longer the latest are never read
+        with self._lock:
+            # Copy so a record being flushed is never changed underneath the flush
+            record = dict(record, writes=list(record["writes"]))
+            existing = {(w[0], w[1]) for w in record["writes"]}
+            for idx, (channel, value) in enumerate(writes):
+                idx = WRITES_IDX_MAP.get(channel, idx)
+                if idx >= 0 and (task_id, idx) in existing:
+                    continue
+                record["writes"] = [w for w in record["writes"] if (w[0], w[1]) != (task_id, idx)]
+                record["writes"].append([task_id, idx, channel, *self.serde.dumps_typed(value), task_path])
+            current = self._dirty.get(key)
+            if current is None or current["id"] == checkpoint_id:
+                self._dirty[key] = record
+        checkpoint_records.inc(op="put_writes")
+
+    def delete_thread(self, thread_id):
+        with self._flush_lock:
+            with self._lock:
+                for key in [k for k in self._dirty if k[0] == thread_id]:
+                    del self._dirty[key]
+                for key in [k for k in self._recent if k[0] == thread_id]:
+                    del self._recent[key]
+            self.store.delete(thread_id)
+
+    def clear(self):
+        """Forget every thread"""
+        with self._flush_lock:
+            with self._lock:
+                self._dirty.clear()
+                self._recent.clear()
+            self.store.clear()
+
+    def thread_count(self):
+        self.flush()
+        return self.store.thread_count()
+
+    def get_next_version(self, current, channel):
+        # Same ordered string versions as MemorySaver
+        current_v = 0 if current is None else current if isinstance(current, int) else int(current.split(".")[0])
+        return f"{current_v + 1:032}.{random.random():016}"
+
+    async def aget_tuple(self, config):
+        # Buffered records are served in place; store reads run off the event loop
+        return await asyncio.to_thread(self.get_tuple, config)
+
+    async def alist(self, config, *, filter=None, before=None, limit=None):
+        for checkpoint in await asyncio.to_thread(lambda: list(self.list(config, filter=filter, before=before, limit=limit))):
+            yield checkpoint
+
+    async def aput(self, config, checkpoint, metadata, new_versions):
+        return self.put(config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(self, config, writes, task_id, task_path=""):
+        await asyncio.to_thread(self.put_writes, config, writes, task_id, task_path)
+
+    async def adelete_thread(self, thread_id):
+        await asyncio.to_thread(self.delete_thread, thread_id)
+
+def create_checkpointer(kind="memory", max_threads=1000, idle_ttl=3600, sqlite_path="finchat_threads.db",
+                        redis_url=None, flush_interval=0.02):
+    """Build the checkpointer named by `kind` ("memory", "sqlite" or "redis")"""
+    if kind == "sqlite":
+        return PersistentSaver(SQLiteStore(sqlite_path), ttl=idle_ttl, flush_interval=flush_interval)
+    if kind == "redis":
+        # Optional dependency, only needed when threads are shared across hosts
+        import redis
+        client = redis.Redis.from_url(redis_url or "redis://localhost:6379/0")
+        return PersistentSaver(RedisStore(client), ttl=idle_ttl, flush_interval=flush_interval)
+    return BoundedMemorySaver(max_threads=max_threads, idle_ttl=idle_ttl)
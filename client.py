@@ -1,63 +1,109 @@
 import streamlit as st
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import json
+import os
 import pandas as pd
 import altair as alt
 import time
+import uuid
 
-def process_tool_data(tool_data):
-    if not tool_data:
-        return None
-    try:
-        data = json.loads(tool_data)
-        df = pd.DataFrame(data)
-        
-        required_columns = ['strongBuy', 'buy', 'hold', 'sell', 'strongSell', 'period']
-        if not all(col in df.columns for col in required_columns):
-            print(f"Missing columns. Available columns: {df.columns.tolist()}")
-            return None
-            
-        df['period'] = pd.to_datetime(df['period']).dt.strftime('%Y-%m')
-        
-        df_melted = df.melt(
-            id_vars=['period'],
-            value_vars=['strongBuy', 'buy', 'hold', 'sell', 'strongSell'],
-            var_name='Recommendation',
-            value_name='Count'
+# Seconds to connect to the server, and to wait for the next bytes of an answer
+CONNECT_TIMEOUT = float(os.getenv("CLIENT_CONNECT_TIMEOUT", "3.05"))
+READ_TIMEOUT = float(os.getenv("CLIENT_READ_TIMEOUT", "60"))
+# Messages drawn in full, older ones stay collapsed until asked for
+RENDER_WINDOW = int(os.getenv("CLIENT_RENDER_WINDOW", "20"))
+
+@st.cache_resource
+def http_session():
+    """Keep-alive HTTP session shared by every rerun and browser session of this app"""
+    session = requests.Session()
+    # Retry only failed connects: a POST that reached the server must not be sent twice
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=32, max_retries=Retry(total=2, connect=2, read=0, backoff_factor=0.2))
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+# Colors of the analyst rating series, from strong buy to strong sell
+RECOMMENDATION_COLORS = {
+    'strongBuy': '#1a9850', 'buy': '#91cf60', 'hold': '#ffffbf', 'sell': '#fc8d59', 'strongSell': '#d73027'
+}
+
+def build_chart(spec, df):
+    """Altair chart for a payload's chart spec, or None for metric tiles and tables.
+
+    Multi-series charts fold the columns in the browser (transform_fold), so the
+    DataFrame is used as sent without melting it in Python.
+    """
+    kind = spec.get("type")
+    if kind in ("stacked_bar", "grouped_bar", "line"):
+        series = [col for col in spec["series"] if col in df.columns]
+        colors = [RECOMMENDATION_COLORS[col] for col in series] if set(series) <= set(RECOMMENDATION_COLORS) else None
+        color = alt.Color('Series:N', sort=series, scale=alt.Scale(domain=series, range=colors) if colors else alt.Undefined)
+        base = alt.Chart(df).transform_fold(series, as_=['Series', 'Value'])
+        if kind == "line":
+            chart = base.mark_line().encode(
+                x=alt.X(f"{spec['x']}:T", title=None),
+                y=alt.Y('Value:Q', title=None, scale=alt.Scale(zero=False)),
+                color=color,
+                tooltip=[f"{spec['x']}:T", 'Series:N', 'Value:Q']
+            )
+        else:
+            chart = base.mark_bar().encode(
+                x=alt.X(f"{spec['x']}:N", title=None),
+                y=alt.Y('Value:Q', title=None),
+                color=color,
+                xOffset='Series:N' if kind == "grouped_bar" else alt.Undefined,
+                tooltip=[f"{spec['x']}:N", 'Series:N', 'Value:Q']
+            )
+    elif kind == "bar":
+        chart = alt.Chart(df).mark_bar().encode(
+            x=alt.X(f"{spec['x']}:N", title=None),
+            y=alt.Y(f"{spec['y']}:Q", title=None),
+            color=f"{spec['color']}:N" if spec.get("color") else alt.Undefined,
+            xOffset=f"{spec['color']}:N" if spec.get("color") else alt.Undefined,
+            tooltip=list(df.columns)
         )
-        
-        return df_melted
-        
-    except Exception as e:
-        print(f"Error processing tool data: {e}")
+    else:
         return None
+    return chart.properties(height=400, title=spec.get("title", ""))
 
-def create_altair_chart(df):
-    if df is None or df.empty:
-        return None
-        
-    chart = alt.Chart(df).mark_bar().encode(
-        x=alt.X('period:N', title='Period'),
-        y=alt.Y('Count:Q', title='Number of Recommendations'),
-        color=alt.Color('Recommendation:N', 
-            scale=alt.Scale(
-                domain=['strongBuy', 'buy', 'hold', 'sell', 'strongSell'],
-                range=['#1a9850', '#91cf60', '#ffffbf', '#fc8d59', '#d73027']
-            )
-        ),
-        tooltip=['period', 'Recommendation', 'Count']
-    ).properties(
-        width=600,
-        height=400,
-        title='Analyst Recommendations'
-    )
-    
-    return chart
+def decode_tool_results(tool_results):
+    """Turn the server's column-oriented tool payloads into (spec, DataFrame, chart) views.
+
+    Called once when an answer arrives; the views are kept in the session state
+    so Streamlit reruns draw them without parsing or reshaping anything again.
+    """
+    views = []
+    for payload in tool_results or []:
+        df = pd.DataFrame(payload["columns"])
+        if df.empty:
+            continue
+        views.append((payload["chart"], df, build_chart(payload["chart"], df)))
+    return views
+
+def render_views(views, key):
+    """Draw decoded tool results: charts, quote tiles and tables"""
+    for i, (spec, df, chart) in enumerate(views):
+        if chart is not None:
+            st.altair_chart(chart, use_container_width=True, key=f"{key}_{i}")
+        elif spec.get("type") == "metric":
+            columns = st.columns(min(len(df), 4))
+            for j, row in enumerate(df.itertuples(index=False)):
+                row = row._asdict()
+                delta = row.get(spec["delta"])
+                columns[j % len(columns)].metric(
+                    row[spec["label"]], f"${row[spec['value']]:,.2f}", f"{delta:+.2f}%" if delta is not None else None
+                )
+        else:
+            st.caption(spec.get("title", ""))
+            st.dataframe(df, hide_index=True, use_container_width=True)
 
-def reset_server_state():
-    """Reset the server state completely"""
+def reset_server_state(session_id=None):
+    """Reset one session on the server, or the server state completely"""
     try:
-        reset_response = requests.post(f"{URL}/reset")
+        reset_response = http_session().post(f"{URL}/reset", json={'session_id': session_id}, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT))
         if reset_response.status_code == 200:
             print("Server state reset successfully")
         else:
@@ -65,10 +111,58 @@ def reset_server_state():
     except Exception as e:
         print(f"Error resetting server state: {e}")
 
+def stream_chat(prompt, session_id, message_placeholder):
+    """Stream the answer from the server, rendering tokens into the placeholder as they arrive.
+
+    Returns the final event with the message, tool data, tool type and message ID,
+    or None if the server reported an error or could not be reached in time.
+    """
+    try:
+        response = http_session().post(f"{URL}/stream", data=json.dumps({'prompt': prompt, 'session_id': session_id}),
+                                       headers={'Content-Type': 'application/json'}, stream=True,
+                                       timeout=(CONNECT_TIMEOUT, READ_TIMEOUT))
+    except requests.exceptions.RequestException as e:
+        message_placeholder.error(f"Could not reach the server: {e}")
+        return None
+    if response.status_code != 200:
+        message_placeholder.error(f"Error from server: {response.status_code}")
+        response.close()
+        return None
+
+    with response:
+        return read_stream(response, message_placeholder)
+
+def read_stream(response, message_placeholder):
+    """Render NDJSON events of a /stream response until the final event"""
+    text = ""
+    try:
+        for line in response.iter_lines(decode_unicode=True):
+            if not line:
+                continue
+            event = json.loads(line)
+            if event["type"] == "token":
+                text += event["content"]
+                message_placeholder.markdown(text + "▌")
+            elif event["type"] == "tool_start":
+                # Only the answer written after the tool calls is kept
+                text = ""
+                message_placeholder.markdown(f"Fetching data with `{event['name']}`...")
+            elif event["type"] == "final":
+                return event
+            elif event["type"] == "error":
+                message_placeholder.error(f"Error from server: {event['error']}")
+                return None
+    except requests.exceptions.RequestException as e:
+        message_placeholder.error(f"Lost the connection to the server: {e}")
+        return None
+
+    message_placeholder.error("Server closed the stream before the answer was complete.")
+    return None
+
 # Set page config to change the title on the navbar
 st.set_page_config(page_title="Stonks Chat 📈")
 
-URL = 'http://server:8000'
+URL = os.getenv('FINCHAT_SERVER_URL', 'http://server:8000')
 
 st.title("🔍 Search Stonks")
 st.markdown(
@@ -95,23 +189,41 @@ if "conversation" not in st.session_state:
     st.session_state.conversation = []
     st.session_state.message_counter = 0
     st.session_state.current_chart_id = None  # Track which message has a chart
+    st.session_state.session_id = str(uuid.uuid4())  # Server keeps the conversation under this ID
 
-# Function to render all messages including charts
+# Start a new conversation, forgetting the old one on the server too
+if st.sidebar.button("New conversation"):
+    reset_server_state(st.session_state.session_id)
+    st.session_state.conversation = []
+    st.session_state.current_chart_id = None
+    st.session_state.session_id = str(uuid.uuid4())
+    st.session_state.earlier_pages = 0
+
+# Function to render one message, with its charts if it is the current answer
+def render_message(message):
+    with st.chat_message(message["role"]):
+        # Always render the content
+        st.markdown(message["content"])
+        
+        # Tool results are only drawn for the current active answer, from views decoded on arrival
+        if message.get("views") and message.get("id") == st.session_state.current_chart_id:
+            render_views(message["views"], f"chart_{message.get('id', 'default')}")
+
+# Function to render the conversation, the latest RENDER_WINDOW messages plus one more window per "Show earlier" click
 def render_conversation():
-    for message in st.session_state.conversation:
-        with st.chat_message(message["role"]):
-            # Always render the content
-            st.markdown(message["content"])
-            
-            # Handle chart rendering - only for the current active chart
-            if message.get("chart_data") and message.get("id") == st.session_state.current_chart_id:
-                df = process_tool_data(message["chart_data"])
-                if df is not None and not df.empty:
-                    chart = create_altair_chart(df)
-                    if chart:
-                        # Generate a unique key for this chart
-                        chart_key = f"chart_{message.get('id', 'default')}"
-                        st.altair_chart(chart, use_container_width=True, key=chart_key)
+    conversation = st.session_state.conversation
+    pages = st.session_state.get("earlier_pages", 0)
+    shown = RENDER_WINDOW * (pages + 1) if RENDER_WINDOW > 0 else len(conversation)
+    hidden = max(len(conversation) - shown, 0)
+    # Older messages cost nothing on reruns until they are expanded, and only a window at a time
+    if hidden and st.button(f"Show {min(hidden, RENDER_WINDOW)} earlier messages ({hidden} hidden)"):
+        st.session_state.earlier_pages = pages + 1
+        st.rerun()
+    if pages and st.button("Hide earlier messages"):
+        st.session_state.earlier_pages = 0
+        st.rerun()
+    for message in conversation[hidden:]:
+        render_message(message)
 
 # Render existing conversation
 render_conversation()
@@ -120,8 +232,8 @@ render_conversation()
 if prompt := st.chat_input("Type a message..."):
     # IMPORTANT: Reset chart state completely for ALL messages when new prompt received
     for message in st.session_state.conversation:
-        if "chart_data" in message:
-            message["chart_data"] = None
+        if "views" in message:
+            message["views"] = None
     
     # Create a new user message
     user_message = {
@@ -136,62 +248,42 @@ if prompt := st.chat_input("Type a message..."):
     with st.chat_message("user"):
         st.markdown(prompt)
     
-    # Create API request
-    data = {'prompt': prompt}
-    headers = {'Content-Type': 'application/json'}
-    
     # Process response with a placeholder
     with st.chat_message("assistant"):
         message_placeholder = st.empty()
         message_placeholder.markdown("Thinking...")
         
-        # Get response from server
-        response = requests.post(URL, data=json.dumps(data), headers=headers)
+        try:
+            # Stream response from server
+            parsed_response = stream_chat(prompt, st.session_state.session_id, message_placeholder)
+        except json.JSONDecodeError:
+            parsed_response = None
+            message_placeholder.error("Failed to parse server response as JSON.")
         
-        if response.status_code == 200:
-            try:
-                # Parse response data
-                parsed_response = json.loads(response.content)
-                message_content = parsed_response.get("message", "")
-                tool_data = parsed_response.get("tool_data")
-                tool_type = parsed_response.get("tool_type")
-                message_id = parsed_response.get("message_id") or f"assistant_{st.session_state.message_counter}"
-                
-                # Update placeholder with response text
-                message_placeholder.markdown(message_content)
-                
-                # Create assistant message with proper ID
-                assistant_message = {
-                    "role": "assistant",
-                    "content": message_content,
-                    "id": message_id,
-                    "chart_data": None  # Will be set only if chart data exists
-                }
-                st.session_state.message_counter += 1
-                
-                # Handle chart data if present
-                chart_container = st.container()
-                if tool_data and tool_type == "chart":
-                    # Store chart data in message
-                    assistant_message["chart_data"] = tool_data
-                    st.session_state.current_chart_id = message_id
-                    
-                    # Display chart for current response
-                    with chart_container:
-                        df = process_tool_data(tool_data)
-                        if df is not None and not df.empty:
-                            chart = create_altair_chart(df)
-                            if chart:
-                                # Use message ID as part of chart key
-                                st.altair_chart(chart, use_container_width=True, key=f"new_chart_{message_id}")
-                
-                # Add message to conversation
-                st.session_state.conversation.append(assistant_message)
-                
-            except json.JSONDecodeError:
-                message_placeholder.error("Failed to parse server response as JSON.")
-        else:
-            message_placeholder.error(f"Error from server: {response.status_code}")
+        if parsed_response is not None:
+            message_content = parsed_response.get("message", "")
+            message_id = parsed_response.get("message_id") or f"assistant_{st.session_state.message_counter}"
+            
+            # Update placeholder with the complete response text
+            message_placeholder.markdown(message_content)
+            
+            # Create assistant message with proper ID
+            assistant_message = {
+                "role": "assistant",
+                "content": message_content,
+                "id": message_id,
+                "views": decode_tool_results(parsed_response.get("tool_results"))
+            }
+            st.session_state.message_counter += 1
+            
+            # Draw every tool result of this answer
+            if assistant_message["views"]:
+                st.session_state.current_chart_id = message_id
+                with st.container():
+                    render_views(assistant_message["views"], f"new_chart_{message_id}")
+            
+            # Add message to conversation
+            st.session_state.conversation.append(assistant_message)
         
 # Footer for streamlit chat UI
 footer = st._bottom.empty()
@@ -0,0 +1,151 @@
+"""Sharing of one graph run between identical prompts asked at the same time.
+
+When a market event makes many users ask "what's happening with TSLA" within
+seconds, the first request (the leader) runs the graph and every request with
+the same normalized prompt that arrives within `window` seconds of it (a
+follower) waits for that run instead of starting its own. Streaming
+subscribers replay the events published so far and then follow the live ones.
+"""
+import asyncio, re, time
+
+from metrics import registry
+
+coalesced_requests = registry.counter(
+    "finchat_coalesced_requests_total",
+    "Chat requests by coalescing role: leader (ran the graph), follower (shared a leader's run) or bypass (had earlier context)"
+)
+coalescing_ratio = registry.gauge("finchat_coalescing_ratio", "Share of coalescable chat requests answered by another request's run")
+flight_subscribers = registry.histogram(
+    "finchat_coalesced_subscribers",
+    "Requests answered by one shared graph run",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256, 512)
+)
+
+TOKEN_PATTERN = re.compile(r"\w+(?:[.,]\w+)*|[^\w\s'\"?!.,;:]")
+
+def normalize_prompt(prompt):
+    """Lower-case words, numbers and symbols of a prompt, without spacing, quotes or sentence punctuation"""
+    return " ".join(TOKEN_PATTERN.findall(prompt.lower().replace("'", "").replace("’", "")))
+
+class Flight:
+    """One graph run and the requests waiting for it, `streaming` if it publishes streaming events"""
+
+    def __init__(self, key, streaming=False):
+        self.key = key
+        self.streaming = streaming
+        self.started = time.monotonic()
+        self.subscribers = 1
+        self.events = []
+        self.task = None
+        self._changed = asyncio.Event()
+        self._future = asyncio.get_running_loop().create_future()
+        self._future.add_done_callback(lambda _: self._notify())
+
+    def publish(self, event):
+        """Pass a streaming event on to every subscriber, including ones that join later"""
+        self.events.append(event)
+        self._notify()
+
+    def _notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def start(self, run):
+        """Run the coroutine `run(publish)` in a task of its own, so no subscriber leaving can cancel it"""
+        async def main():
+            try:
+                self._future.set_result(await run(self.publish))
+            except Exception as e:
+                self.fail(e)
+            except BaseException:
+                self.cancel()
+                raise
+
+        self.task = asyncio.create_task(main())
+
+    def fail(self, error):
+        """End the flight with `error`, raised to every subscriber"""
+        if not self._future.done():
+            self._future.set_exception(error)
+            # Retrieved here so a flight nobody waits for does not log "exception never retrieved"
+            self._future.exception()
+
+    def cancel(self):
+        """End the flight because its leader or run was cancelled, an error to the subscribers rather than their own cancellation"""
+        self.fail(RuntimeError("The shared graph run was cancelled"))
+
+    async def result(self):
+        """What the run returned, or the error it raised"""
+        return await asyncio.shield(self._future)
+
+    async def follow(self):
+        """Every event published so far, then each new one until the run ends"""
+        sent = 0
+        while True:
+            while sent < len(self.events):
+                yield self.events[sent]
+                sent += 1
+            if self._future.done():
+                return
+            await self._changed.wait()
+
+class Coalescer:
+    """In-flight graph runs by normalized prompt, joinable for `window` seconds after they start.
+
+    A window of 0 turns coalescing off.
+    """
+
+    def __init__(self, window=5.0):
+        self.window = window
+        self._flights = {}
+        self._counts = {"leader": 0, "follower": 0}
+
+    @property
+    def enabled(self):
+        return self.window > 0
+
+    def join(self, key, streaming=False):
+        """The run of an identical prompt started within the window, None if there is none.
+
+        A `streaming` request only joins a run that publishes streaming events.
+        """
+        flight = self._flights.get(key) if key is not None else None
+        if flight is None or (streaming and not flight.streaming):
+            return None
+        failed = flight._future.done() and (flight._future.cancelled() or flight._future.exception() is not None)
+        if failed or time.monotonic() - flight.started > self.window:
+            # A failed run is not shared with newcomers, they try again
+            del self._flights[key]
+            return None
+        flight.subscribers += 1
+        self._count("follower")
+        return flight
+
+    def lead(self, key, streaming=False):
+        """A new flight for `key` that later requests can join, or a private one if `key` is None"""
+        flight = Flight(key, streaming)
+        if key is None:
+            coalesced_requests.inc(role="bypass")
+            return flight
+        self._flights[key] = flight
+        self._count("leader")
+        flight._future.add_done_callback(lambda _: self._finish(flight))
+        return flight
+
+    def _count(self, role):
+        coalesced_requests.inc(role=role)
+        self._counts[role] += 1
+        coalescing_ratio.set(self._counts["follower"] / (self._counts["leader"] + self._counts["follower"]))
+
+    def _finish(self, flight):
+        # Requests arriving just after a fast run still share it until the window closes
+        remaining = flight.started + self.window - time.monotonic()
+        asyncio.get_running_loop().call_later(max(remaining, 0), self._forget, flight)
+
+    def _forget(self, flight):
+        flight_subscribers.observe(flight.subscribers)
+        if self._flights.get(flight.key) is flight:
+            del self._flights[flight.key]
+
+    def __len__(self):
+        return len(self._flights)
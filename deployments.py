@@ -0,0 +1,179 @@
+"""Routing of LLM calls over several model deployments.
+
+Each call goes to a healthy deployment picked at random, weighted towards
+the ones that have been answering fastest. If it has not answered after
+the deployment's recent p95 latency, one duplicate (hedged) request is sent
+to the next deployment and the first answer wins. Failed calls move on to
+the next deployment, and every call has a deadline. A deployment that fails
+`failure_threshold` times in a row is skipped for `cooldown` seconds.
+"""
+import asyncio, collections, random, time
+
+from metrics import registry
+
+llm_attempts = registry.counter(
+    "finchat_llm_attempts_total",
+    "LLM requests by deployment and outcome (ok, error, timeout or cancelled when another request won)"
+)
+llm_hedges = registry.counter("finchat_llm_hedges_total", "Hedged LLM requests by whether the hedge answered first (won or lost)")
+llm_deployment_latency = registry.histogram("finchat_llm_deployment_seconds", "Latency of successful LLM requests by deployment")
+
+def percentile(values, q):
+    """The q-th percentile (0-100) of `values` by nearest rank, None if there are none"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * q / 100), len(ordered) - 1)]
+
+class Deployment:
+    """A chat model deployment with the latency and failure history routing is based on"""
+
+    def __init__(self, name, model, window=100, failure_threshold=3, cooldown=30.0):
+        self.name = name
+        self.model = model
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.latencies = collections.deque(maxlen=window)
+        self.failures = 0
+        self.down_until = 0.0
+
+    def healthy(self, now):
+        return now >= self.down_until
+
+    def record_success(self, seconds):
+        self.latencies.append(seconds)
+        self.failures = 0
+
+    def record_failure(self):
+        self.failures += 1
+        if self.failures >= self.failure_threshold:
+            # After the cooldown one request probes it again, a single failure sends it back
+            self.down_until = time.monotonic() + self.cooldown
+            self.failures = self.failure_threshold - 1
+
+    def weight(self, default_latency):
+        """Selection weight, inversely proportional to the median recent latency"""
+        median = percentile(self.latencies, 50)
+        return 1 / max(median if median is not None else default_latency, 0.01)
+
+class DeploymentRouter:
+    """Send chat model calls to the best of several deployments, with deadlines and hedging.
+
+    Args:
+        deployments (list): Deployment objects, in order of preference until latencies are known
+        tools (list): Tools bound to every deployment's model for calls with `tools=True`
+        call_timeout (float): Deadline in seconds of one call, over all its attempts
+        hedge_quantile (float): Latency percentile of the chosen deployment after which a hedge is sent
+        min_hedge_delay (float): Shortest wait before hedging, so fast deployments are not doubled up
+        max_hedge_delay (float): Longest wait before hedging, also used while a deployment has no history
+        hedge (bool): Whether to send hedged requests at all
+    """
+
+    def __init__(self, deployments, tools=(), call_timeout=30.0, hedge_quantile=95, min_hedge_delay=0.5,
+                 max_hedge_delay=10.0, hedge=True):
+        self.deployments = deployments
+        self.call_timeout = call_timeout
+        self.hedge_quantile = hedge_quantile
+        self.min_hedge_delay = min_hedge_delay
+        self.max_hedge_delay = max_hedge_delay
+        self.hedge = hedge
+        self._with_tools = {d.name: d.model.bind_tools(tools) if tools else d.model for d in deployments}
+
+    def ranked(self):
+        """Healthy deployments in latency-weighted random order, then the unhealthy ones by when they recover"""
+        now = time.monotonic()
+        pool = [d for d in self.deployments if d.healthy(now)]
+        down = sorted((d for d in self.deployments if not d.healthy(now)), key=lambda d: d.down_until)
+        known = [percentile(d.latencies, 50) for d in pool if d.latencies]
+        # Deployments without history are weighted like an average one, so they get tried
+        default_latency = sum(known) / len(known) if known else 1.0
+        order = []
+        while pool:
+            pick = random.choices(pool, weights=[d.weight(default_latency) for d in pool])[0]
+            order.append(pick)
+            pool.remove(pick)
+        return order + down
+
+    def hedge_delay(self, deployment):
+        p = percentile(deployment.latencies, self.hedge_quantile)
+        return min(max(p if p is not None else self.max_hedge_delay, self.min_hedge_delay), self.max_hedge_delay)
+
+    async def _attempt(self, deployment, prompt, tools, config):
+        model = self._with_tools[deployment.name] if tools else deployment.model
+        start = time.perf_counter()
+        try:
+            response = await model.ainvoke(prompt, config)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            deployment.record_failure()
+            llm_attempts.inc(deployment=deployment.name, outcome="error")
+            raise
+        elapsed = time.perf_counter() - start
+        deployment.record_success(elapsed)
+        llm_attempts.inc(deployment=deployment.name, outcome="ok")
+        llm_deployment_latency.observe(elapsed, deployment=deployment.name)
+        return response
+
+    async def ainvoke(self, prompt, timeout=None, tools=True):
+        """Answer `prompt` from the first deployment that responds before the deadline.
+
+        Args:
+            prompt: Chat prompt value or list of messages
+            timeout (float): Seconds left for this call, capped at `call_timeout`
+            tools (bool): Whether the model may call tools
+
+        Raises:
+            TimeoutError: If no deployment answered in time
+            Exception: The last deployment error if every deployment failed
+        """
+        budget = self.call_timeout if timeout is None else min(timeout, self.call_timeout)
+        deadline = time.monotonic() + budget
+        candidates = self.ranked()
+        running = {}  # Task to its deployment and start time
+        hedge = None
+        last_error = None
+
+        def launch(deployment, config):
+            running[asyncio.create_task(self._attempt(deployment, prompt, tools, config))] = (deployment, time.monotonic())
+
+        try:
+            while candidates or running:
+                if not running:
+                    # The first request streams through the caller's callbacks, so /stream still sees tokens
+                    launch(candidates.pop(0), None)
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                delay = self.hedge_delay(next(iter(running.values()))[0])
+                # No hedge once the deadline comes first, it would be cancelled before it could answer
+                can_hedge = self.hedge and hedge is None and candidates and len(running) == 1 and delay < remaining
+                wait = delay if can_hedge else remaining
+                done, _ = await asyncio.wait(running, timeout=wait, return_when=asyncio.FIRST_COMPLETED)
+
+                for task in done:
+                    deployment, _ = running.pop(task)
+                    if task.exception() is None:
+                        if hedge is not None:
+                            llm_hedges.inc(result="won" if deployment is hedge else "lost")
+                        return task.result()
+                    last_error = task.exception()
+                    print(f"LLM call to {deployment.name} failed: {last_error}")
+
+                if not done and can_hedge:
+                    hedge = candidates.pop(0)
+                    # Without callbacks, so its tokens are not streamed twice
+                    launch(hedge, {"callbacks": []})
+        finally:
+            now = time.monotonic()
+            timed_out = now >= deadline
+            for task, (deployment, started) in running.items():
+                task.cancel()
+                llm_attempts.inc(deployment=deployment.name, outcome="timeout" if timed_out else "cancelled")
+                # Only an attempt that outlasted its deployment's usual latency counts against it
+                if timed_out and now - started >= self.hedge_delay(deployment):
+                    deployment.record_failure()
+
+        if last_error is not None and not running:
+            raise last_error
+        raise TimeoutError(f"No LLM deployment answered within {budget:.1f}s")
@@ -0,0 +1,518 @@
+"""Deterministic local stand-ins for Azure OpenAI and Finnhub.
+
+Used by bench.py to exercise the server and the graph without API keys or
+network access. Latencies are configurable so the fakes behave like slow
+upstream services.
+"""
+import asyncio, json, random, re, threading, time, uuid, zlib
+
+import numpy as np
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, HumanMessage, ToolMessage
+from langchain_core.messages.utils import count_tokens_approximately
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+# Keywords that make the fake model call a tool, in the order they are checked
+TOOL_KEYWORDS = [
+    ("recommend", "getStockRecommendation"),
+    ("sma", "getStockCandles"),
+    ("rsi", "getStockCandles"),
+    ("moving average", "getStockCandles"),
+    ("done over", "getStockCandles"),
+    ("performed", "getStockCandles"),
+    ("news", "getCompanyNews"),
+    ("earning", "getCompanyEarnings"),
+    ("price", "getStockPrice"),
+    ("quote", "getStockPrice"),
+    ("profile", "getStockData"),
+    ("what does", "getStockData"),
+]
+
+# A few company names so prompts like "price of apple" resolve to a symbol
+COMPANY_NAMES = {
+    "apple": "AAPL",
+    "microsoft": "MSFT",
+    "nvidia": "NVDA",
+    "tesla": "TSLA",
+    "amazon": "AMZN",
+    "google": "GOOGL",
+    "amd": "AMD",
+}
+
+TICKER_PATTERN = re.compile(r"\b[A-Z]{1,5}\b")
+STOPWORDS = {"I", "A", "AND", "OR", "THE", "OF", "VS", "ETF", "EPS", "USD"}
+
+def find_symbols(text):
+    """Extract ticker symbols from a prompt using upper-case words and known company names"""
+    symbols = [word for word in TICKER_PATTERN.findall(text) if word not in STOPWORDS]
+    lowered = text.lower()
+    for name, symbol in COMPANY_NAMES.items():
+        if name in lowered and symbol not in symbols:
+            symbols.append(symbol)
+    return symbols
+
+class FakeLLMError(Exception):
+    """Failure injected by FakeChatModel"""
+
+class FakeChatModel(BaseChatModel):
+    """Scripted chat model that calls tools for ticker questions and answers everything else.
+
+    The first turn of a market question returns one tool call per symbol and
+    matched keyword. Once tool results are in the history the model writes a
+    short Markdown answer. Every call takes `latency` seconds plus
+    `prompt_token_latency` per prompt token before the first token, and
+    streamed answers wait `token_latency` between words. To stand in for an
+    unreliable deployment, a `slow_rate` share of calls take `slow_latency`
+    seconds instead of `latency` and a `failure_rate` share fail.
+    """
+
+    latency: float = 0.0
+    token_latency: float = 0.0
+    prompt_token_latency: float = 0.0
+    slow_rate: float = 0.0
+    slow_latency: float = 0.0
+    failure_rate: float = 0.0
+    calls: int = 0
+
+    @property
+    def _llm_type(self) -> str:
+        return "finchat-fake"
+
+    def bind_tools(self, tools, **kwargs):
+        return self
+
+    def _respond(self, messages) -> AIMessage:
+        message = self._script(messages)
+        prompt_tokens = count_tokens_approximately(messages)
+        completion_tokens = count_tokens_approximately([message])
+        message.usage_metadata = {
+            "input_tokens": prompt_tokens,
+            "output_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        }
+        return message
+
+    def _script(self, messages) -> AIMessage:
+        last = messages[-1]
+        if isinstance(last, HumanMessage):
+            text = last.content if isinstance(last.content, str) else str(last.content)
+            lowered = text.lower()
+            tool_names = []
+            for keyword, name in TOOL_KEYWORDS:
+                if keyword in lowered and name not in tool_names:
+                    tool_names.append(name)
+            symbols = find_symbols(text)
+            if tool_names and symbols:
+                tool_calls = [
+                    {
+                        "name": name,
+                        "args": {"symbol": symbol, "query": text} if name == "getCompanyNews" else {"symbol": symbol},
+                        "id": f"call_{uuid.uuid4().hex[:12]}"
+                    }
+                    for symbol in symbols
+                    for name in tool_names
+                ]
+                return AIMessage(content="", tool_calls=tool_calls)
+            return AIMessage(content=f"## Answer\n\nHere is some general guidance about: *{text}*")
+
+        # Summarise the tool results gathered since the last human message
+        tool_names = []
+        for message in reversed(messages):
+            if isinstance(message, HumanMessage):
+                break
+            if isinstance(message, ToolMessage):
+                tool_names.append(message.name)
+        bullets = "\n".join(f"- Data from **{name}**" for name in reversed(tool_names))
+        return AIMessage(content=f"## Market data\n\n{bullets}")
+
+    def _time_to_first_token(self, messages):
+        latency = self.slow_latency if random.random() < self.slow_rate else self.latency
+        return latency + self.prompt_token_latency * count_tokens_approximately(messages)
+
+    def _maybe_fail(self):
+        if random.random() < self.failure_rate:
+            raise FakeLLMError("Injected deployment failure (503)")
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        self.calls += 1
+        time.sleep(self._time_to_first_token(messages))
+        self._maybe_fail()
+        return ChatResult(generations=[ChatGeneration(message=self._respond(messages))])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        self.calls += 1
+        await asyncio.sleep(self._time_to_first_token(messages))
+        self._maybe_fail()
+        return ChatResult(generations=[ChatGeneration(message=self._respond(messages))])
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        self.calls += 1
+        await asyncio.sleep(self._time_to_first_token(messages))
+        self._maybe_fail()
+        message = self._respond(messages)
+        if message.tool_calls:
+            tool_call_chunks = [
+                {"name": call["name"], "args": json.dumps(call["args"]), "id": call["id"], "index": i}
+                for i, call in enumerate(message.tool_calls)
+            ]
+            yield ChatGenerationChunk(message=AIMessageChunk(content="", tool_call_chunks=tool_call_chunks,
+                                                             usage_metadata=message.usage_metadata))
+            return
+
+        words = re.split(r"(?<=\s)", message.content)
+        for i, word in enumerate(words):
+            if self.token_latency:
+                await asyncio.sleep(self.token_latency)
+            # Usage arrives with the last chunk, as with OpenAI's stream_usage
+            usage = message.usage_metadata if i == len(words) - 1 else None
+            yield ChatGenerationChunk(message=AIMessageChunk(content=word, usage_metadata=usage))
+
+# Words the fake news summaries are drawn from
+NEWS_VOCABULARY = (
+    "revenue margin guidance outlook analysts investors quarter demand supply chain cloud "
+    "services hardware chips consumer enterprise growth slowdown inflation rates tariffs "
+    "regulators lawsuit settlement dividend buyback valuation forecast upgrade downgrade "
+    "partnership acquisition launch pricing subscription advertising china europe india"
+).split()
+
+def _seed(symbol):
+    return zlib.crc32(symbol.encode("utf-8"))
+
+# Real listings the fake symbol list always contains, including near-misses that make names ambiguous and names
+# made of everyday words
+LISTINGS = [
+    ("AAPL", "APPLE INC", "Common Stock"), ("APLE", "APPLE HOSPITALITY REIT INC", "REIT"),
+    ("MSFT", "MICROSOFT CORP", "Common Stock"), ("NVDA", "NVIDIA CORP", "Common Stock"),
+    ("TSLA", "TESLA INC", "Common Stock"), ("AMZN", "AMAZON.COM INC", "Common Stock"),
+    ("GOOGL", "ALPHABET INC-CL A", "Common Stock"), ("GOOG", "ALPHABET INC-CL C", "Common Stock"),
+    ("META", "META PLATFORMS INC-CLASS A", "Common Stock"), ("BRK.A", "BERKSHIRE HATHAWAY INC-CL A", "Common Stock"),
+    ("BRK.B", "BERKSHIRE HATHAWAY INC-CL B", "Common Stock"), ("BHLB", "BERKSHIRE HILLS BANCORP INC", "Common Stock"),
+    ("KO", "COCA-COLA CO/THE", "Common Stock"), ("COKE", "COCA-COLA CONSOLIDATED INC", "Common Stock"),
+    ("MCD", "MCDONALD'S CORP", "Common Stock"), ("JPM", "JPMORGAN CHASE & CO", "Common Stock"),
+    ("JNJ", "JOHNSON & JOHNSON", "Common Stock"), ("PG", "PROCTER & GAMBLE CO/THE", "Common Stock"),
+    ("COST", "COSTCO WHOLESALE CORP", "Common Stock"), ("TGT", "TARGET CORP", "Common Stock"),
+    ("GM", "GENERAL MOTORS CO", "Common Stock"), ("GE", "GENERAL ELECTRIC CO", "Common Stock"),
+    ("TROW", "T ROWE PRICE GROUP INC", "Common Stock"), ("SNOW", "SNOWFLAKE INC-CLASS A", "Common Stock"),
+    ("CRWD", "CROWDSTRIKE HOLDINGS INC - A", "Common Stock"), ("PANW", "PALO ALTO NETWORKS INC", "Common Stock"),
+    ("LLY", "ELI LILLY & CO", "Common Stock"), ("UNH", "UNITEDHEALTH GROUP INC", "Common Stock"),
+    ("SPY", "SPDR S&P 500 ETF TRUST", "ETP"), ("QQQ", "INVESCO QQQ TRUST SERIES 1", "ETP"),
+    ("BTM", "BITCOIN DEPOT INC - A", "Common Stock"), ("AVLNF", "AVALANCHE INTERNATIONAL CORP", "Common Stock"),
+    ("EMRG", "EMERGENCY FUND INC", "Common Stock"),
+]
+SYLLABLES = ["ab", "ar", "ex", "on", "ix", "or", "ta", "ve", "lo", "qu", "zen", "tri", "nova", "gen", "tek", "max", "pro", "sol"]
+NAME_WORDS = ["Systems", "Therapeutics", "Bancorp", "Energy", "Networks", "Foods", "Industries", "Partners", "Brands", "Labs"]
+
+class FakeFinnhubClient:
+    """Drop-in replacement for `finnhub.Client` returning deterministic data per symbol.
+
+    Each call blocks for `latency` seconds, like the real synchronous client.
+    company_news returns `news_count` articles, every fourth one a syndicated
+    copy of an earlier story.
+    """
+
+    def __init__(self, latency=0.0, news_count=20, symbol_count=30_000):
+        self.latency = latency
+        self.news_count = news_count
+        self.symbol_count = symbol_count
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def _call(self):
+        with self._lock:
+            self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def company_profile2(self, symbol=None, **kwargs):
+        self._call()
+        return {
+            "country": "US",
+            "currency": "USD",
+            "exchange": "NASDAQ NMS - GLOBAL MARKET",
+            "ipo": "1980-12-12",
+            "marketCapitalization": float(_seed(symbol) % 3_000_000),
+            "name": f"{symbol} Inc",
+            "phone": "14089961010",
+            "shareOutstanding": float(_seed(symbol) % 20_000),
+            "ticker": symbol,
+            "weburl": f"https://www.{symbol.lower()}.com/",
+            "logo": f"https://static.finnhub.io/logo/{symbol.lower()}.png",
+            "finnhubIndustry": "Technology",
+        }
+
+    def recommendation_trends(self, symbol=None, **kwargs):
+        self._call()
+        seed = _seed(symbol)
+        return [
+            {
+                "buy": 10 + (seed + month) % 15,
+                "hold": 5 + (seed + month) % 10,
+                "period": f"2024-{12 - month:02d}-01",
+                "sell": (seed + month) % 4,
+                "strongBuy": 5 + (seed + month) % 12,
+                "strongSell": (seed + month) % 2,
+                "symbol": symbol,
+            }
+            for month in range(4)
+        ]
+
+    def quote(self, symbol=None, **kwargs):
+        self._call()
+        price = 50 + _seed(symbol) % 400
+        return {"c": price, "d": 1.25, "dp": 0.5, "h": price + 2, "l": price - 3, "o": price - 1, "pc": price - 1.25, "t": int(time.time())}
+
+    def company_earnings(self, symbol=None, limit=None, **kwargs):
+        self._call()
+        seed = _seed(symbol)
+        return [
+            {
+                "actual": round(1 + (seed % 100) / 100 + q / 10, 2),
+                "estimate": round(1 + (seed % 100) / 100, 2),
+                "period": f"2024-{3 * (4 - q):02d}-30",
+                "quarter": 4 - q,
+                "surprise": round(q / 10, 2),
+                "surprisePercent": round(q * 2.5, 2),
+                "symbol": symbol,
+                "year": 2024,
+            }
+            for q in range(4)
+        ]
+
+    def stock_symbols(self, exchange="US", **kwargs):
+        """LISTINGS plus generated companies, `symbol_count` in all, about the size of the US list"""
+        self._call()
+        rng = random.Random(exchange)
+        records = [{"symbol": s, "displaySymbol": s, "description": d, "type": t, "currency": "USD"} for s, d, t in LISTINGS]
+        taken = {s for s, _, _ in LISTINGS}
+        while len(records) < self.symbol_count:
+            stem = "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4)))
+            symbol = "".join(rng.choice("ABCDEFGHIJKLMNOPQRSTUVWXYZ") for _ in range(rng.randint(2, 4)))
+            symbol += "" if rng.random() < 0.9 else ".U"
+            if symbol in taken:
+                continue
+            taken.add(symbol)
+            description = f"{stem.upper()} {rng.choice(NAME_WORDS).upper()} {rng.choice(['INC', 'CORP', 'LTD', 'PLC'])}"
+            records.append({"symbol": symbol, "displaySymbol": symbol, "description": description,
+                            "type": "Common Stock" if rng.random() < 0.8 else "ETP", "currency": "USD"})
+        return records
+
+    def stock_candles(self, symbol=None, resolution="D", _from=0, to=0, **kwargs):
+        """Daily weekday candles from a deterministic price path, so overlapping ranges agree"""
+        self._call()
+        days = np.arange(int(_from) // 86400 + (int(_from) % 86400 > 0), int(to) // 86400 + 1)
+        days = days[(days + 3) % 7 < 5]  # 1970-01-01 was a Thursday
+        if not len(days):
+            return {"s": "no_data"}
+        seed = _seed(symbol)
+        noise = np.array([zlib.crc32(f"{symbol}{day}".encode()) % 2000 / 1000 - 1 for day in days])
+        close = (50 + seed % 400) * np.exp(0.25 * np.sin(days / 37 + seed % 7) + 0.08 * np.sin(days / 9)) * (1 + 0.01 * noise)
+        return {
+            "s": "ok",
+            "t": (days * 86400).tolist(),
+            "o": (close * (1 - 0.004 * noise)).round(2).tolist(),
+            "h": (close * 1.012).round(2).tolist(),
+            "l": (close * 0.988).round(2).tolist(),
+            "c": close.round(2).tolist(),
+            "v": (1_000_000 + np.abs(noise) * 500_000).round().tolist(),
+        }
+
+    def company_news(self, symbol=None, _from=None, to=None, **kwargs):
+        self._call()
+        now = int(time.time())
+        topics = ["earnings", "product launch", "analyst upgrade", "supply chain", "lawsuit", "buyback", "guidance"]
+        articles = []
+        for i in range(self.news_count):
+            if i % 4 == 3:
+                # Syndicated copy of an earlier story with a different source and sign-off
+                original = articles[(i * 7) % len(articles)]
+                articles.append({**original, "id": _seed(symbol) + i, "source": "SyndicateWire",
+                                 "summary": original["summary"] + " Reporting by wire staff.",
+                                 "url": f"https://syndicate.example.com/{symbol.lower()}/{i}"})
+                continue
+            topic = topics[i % len(topics)]
+            words = random.Random(_seed(symbol) + i).choices(NEWS_VOCABULARY, k=30)
+            articles.append({
+                "category": "company",
+                "datetime": now - i * 600,
+                "headline": f"{symbol} {topic} update number {i} draws investor attention",
+                "id": _seed(symbol) + i,
+                "image": "",
+                "related": symbol,
+                "source": "FakeWire",
+                "summary": f"{symbol} shares moved after the {topic} news. " + " ".join(words) + ".",
+                "url": f"https://news.example.com/{symbol.lower()}/{i}",
+            })
+        return articles
+
+class FakeRedis:
+    """The subset of the redis-py client used by `cache.RedisBackend` and `checkpointer.RedisStore`, kept in a dict"""
+
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at is not None and expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            return value
+
+    def set(self, key, value, ex=None):
+        if isinstance(value, str):
+            value = value.encode("utf-8")
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + ex if ex else None)
+        return True
+
+    def delete(self, *keys):
+        with self._lock:
+            return sum(1 for key in keys if self._data.pop(key, None) is not None)
+
+    def scan_iter(self, match="*"):
+        prefix = match.rstrip("*")
+        with self._lock:
+            keys = [key for key in self._data if key.startswith(prefix)]
+        return iter(keys)
+
+    def hget(self, key, field):
+        mapping = self.get(key)
+        return mapping.get(field) if mapping is not None else None
+
+    def hset(self, key, field, value):
+        with self._lock:
+            mapping, expires_at = self._data.get(key, ({}, None))
+            mapping[field] = value
+            self._data[key] = (mapping, expires_at)
+        return 1
+
+    def expire(self, key, seconds):
+        with self._lock:
+            if key not in self._data:
+                return False
+            self._data[key] = (self._data[key][0], time.monotonic() + seconds)
+        return True
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+class FakePipeline:
+    """Queues FakeRedis commands until `execute`, like a redis-py pipeline"""
+
+    def __init__(self, client):
+        self.client = client
+        self.commands = []
+
+    def __getattr__(self, name):
+        method = getattr(self.client, name)
+        return lambda *args, **kwargs: self.commands.append((method, args, kwargs))
+
+    def execute(self):
+        commands, self.commands = self.commands, []
+        return [method(*args, **kwargs) for method, args, kwargs in commands]
+
+class FakeQuoteServer:
+    """Local stand-in for Finnhub's websocket trades feed, running in a thread of its own.
+
+    Clients subscribe with {"type": "subscribe", "symbol": ...} and receive
+    {"type": "trade", "data": [{"s", "p", "t", "v"}]} messages every
+    `interval` seconds for each subscribed symbol, with prices walking
+    randomly from the fake REST quote. Like Finnhub it answers with an error
+    message beyond `symbol_limit` subscriptions per connection.
+    """
+
+    def __init__(self, interval=0.05, symbol_limit=50):
+        self.interval = interval
+        self.symbol_limit = symbol_limit
+        self.subscribed = set()
+        self.max_subscribed = 0
+        self.trades = 0
+        self._prices = {}
+        self._loop = None
+        self._ready = threading.Event()
+        self._thread = threading.Thread(target=lambda: asyncio.run(self._serve()), name="fake-quote-server", daemon=True)
+        self._thread.start()
+        self._ready.wait(10)
+
+    async def _serve(self):
+        import websockets
+
+        self._loop = asyncio.get_running_loop()
+        self._stop = asyncio.Event()
+        async with websockets.serve(self._handle, "127.0.0.1", 0) as server:
+            self.port = server.sockets[0].getsockname()[1]
+            self._ready.set()
+            await self._stop.wait()
+
+    @property
+    def url(self):
+        return f"ws://127.0.0.1:{self.port}?token=fake"
+
+    async def _handle(self, ws):
+        symbols = set()
+
+        async def trades():
+            while True:
+                await asyncio.sleep(self.interval)
+                data = []
+                for symbol in list(symbols):
+                    price = self._prices.get(symbol, 50 + _seed(symbol) % 400)
+                    price = self._prices[symbol] = round(price * (1 + random.gauss(0, 0.001)), 2)
+                    data.append({"s": symbol, "p": price, "t": int(time.time() * 1000), "v": random.randint(1, 500)})
+                if data:
+                    self.trades += len(data)
+                    await ws.send(json.dumps({"type": "trade", "data": data}))
+                else:
+                    await ws.send(json.dumps({"type": "ping"}))
+
+        sender = asyncio.create_task(trades())
+        try:
+            async for raw in ws:
+                message = json.loads(raw)
+                if message.get("type") == "subscribe":
+                    if len(symbols) >= self.symbol_limit:
+                        await ws.send(json.dumps({"type": "error", "msg": "Subscribing to too many symbols"}))
+                        continue
+                    symbols.add(message["symbol"])
+                elif message.get("type") == "unsubscribe":
+                    symbols.discard(message["symbol"])
+                self.subscribed = set(symbols)
+                self.max_subscribed = max(self.max_subscribed, len(symbols))
+        finally:
+            sender.cancel()
+
+    def close(self):
+        self._loop.call_soon_threadsafe(self._stop.set)
+        self._thread.join(5)
+
+def install_fakes(llm_latency=0.0, finnhub_latency=0.0, token_latency=0.0, cache_backend=None, prompt_token_latency=0.0,
+                  deployments=None, quote_feed=None):
+    """Swap the Azure model and Finnhub client in `llm.py` for the fakes above.
+
+    The fake models sit behind the same deployment router as the real ones: one
+    with the given latencies, or one per dict of FakeChatModel settings in
+    `deployments`. The fake Finnhub client sits behind the same response cache
+    as the real one, using `cache_backend` or a fresh in-process backend.
+    With a FakeQuoteServer as `quote_feed`, prices of hot symbols come from a
+    live feed connected to it, seeded from the fake Finnhub client.
+    Returns the first fake model and the fake Finnhub client.
+    """
+    import llm as finchat
+    from cache import CachedFinnhubClient
+
+    defaults = {"latency": llm_latency, "token_latency": token_latency, "prompt_token_latency": prompt_token_latency}
+    fake_llms = [FakeChatModel(**{**defaults, **settings}) for settings in deployments or [{}]]
+    fake_llm = fake_llms[0]
+    fake_finnhub = FakeFinnhubClient(latency=finnhub_latency)
+    finchat.llm = finchat.create_router([(f"fake-{i}", model) for i, model in enumerate(fake_llms)])
+    finchat.finnhub_client = CachedFinnhubClient(fake_finnhub, backend=cache_backend, rate_limiter=finchat.finnhub_limiter)
+    if finchat.quote_feed is not None:
+        finchat.quote_feed.stop()
+    finchat.quote_feed = None
+    if quote_feed is not None:
+        finchat.quote_feed = finchat.create_quote_feed(quote_feed.url)
+    return fake_llm, fake_finnhub
@@ -1,16 +1,31 @@
 import os 
 from dotenv import load_dotenv 
-from langchain_openai import AzureChatOpenAI
 from langgraph.checkpoint.memory import MemorySaver
-from langgraph.graph import START, MessagesState, StateGraph, END
+from langgraph.constants import START, END
 from typing import Annotated, Optional, Dict, Any
 from typing_extensions import TypedDict
-from langgraph.graph.message import add_messages
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain_core.tools import tool
-import requests, finnhub, datetime, json
-from langgraph.prebuilt import ToolNode, tools_condition
-import pandas as pd
+from langchain_core.messages import AIMessage, HumanMessage, RemoveMessage, SystemMessage, ToolMessage
+from langchain_core.messages.utils import count_tokens_approximately, trim_messages
+from langchain_core.runnables import RunnableConfig
+import requests, finnhub, datetime
+from cache import CachedFinnhubClient, create_backend
+from checkpointer import create_checkpointer
+from deployments import Deployment, DeploymentRouter
+from ratelimit import TokenBucket
+from news import build_digest
+from projection import (
+    NO_DATA, compact_json, project_earnings, project_earnings_many, project_profile, project_profiles, project_quote, project_quotes,
+    project_recommendations, projected, record_tokens, table
+)
+from quotefeed import QuoteFeed
+from semantic_cache import SemanticCache
+from tracing import propagate, record_cache_result, record_llm_usage, span, traced_tool
+from concurrent.futures import ThreadPoolExecutor
+from metrics import registry
+from urllib.parse import urlparse
+import asyncio, candles, gc, router, symbols, threading, time, uuid
 
 # Load environment variables from .env file 
 load_dotenv() 
@@ -22,9 +37,14 @@ Your role is to provide insights on budgeting, savings, investments, debt manage
 # Available Tools:
 - getStockData: Get company profile and general information
 - getStockRecommendation: Get analyst recommendations and trends
-- getCompanyNews: Get recent news articles from last 7 days
+- getCompanyNews: Get a digest of distinct recent news stories from last 7 days, pass the user's question as `query`
 - getStockPrice: Get real-time stock price and trading data
 - getCompanyEarnings: Get quarterly earnings history and estimates
+- getStockPrices: Get real-time prices for several stocks at once
+- getStockProfiles: Get company profiles for several stocks at once
+- getCompaniesEarnings: Get earnings history for several companies at once
+- getStockCandles: Get daily price history over a period with moving averages, RSI, volatility and drawdown
+- lookupSymbol: Find the ticker symbol of a company by name, use it whenever you are unsure of a symbol
 
 # Tone & Personality:
 - Friendly, professional, and approachable
@@ -57,13 +77,74 @@ Your role is to provide insights on budgeting, savings, investments, debt manage
 - Use Bold, Italics, and Hyperlinks for emphasis
 - Include tool-generated data in formatted responses
 - Only use recommendations tool if the user prompt SPECIFICALLY asks for it
+- When a question covers several stocks, use the multi-symbol tools with all symbols in one call
 """
 
-# Creating a Finnhub client to access stock data
-finnhub_client = finnhub.Client(os.getenv("FINNHUB_API_KEY"))
+# Global Finnhub rate limit matched to the API plan, with Finnhub's 30 calls/second burst cap
+finnhub_limiter = TokenBucket(
+    rate=float(os.getenv("FINNHUB_CALLS_PER_MINUTE", "60")) / 60,
+    capacity=float(os.getenv("FINNHUB_BURST", "30"))
+)
+
+# Creating a Finnhub client to access stock data, cached per endpoint and shared by all requests
+finnhub_client = CachedFinnhubClient(
+    finnhub.Client(os.getenv("FINNHUB_API_KEY")),
+    backend=create_backend(
+        os.getenv("FINNHUB_CACHE_BACKEND", "memory"),
+        max_entries=int(os.getenv("FINNHUB_CACHE_SIZE", "4096")),
+        redis_url=os.getenv("REDIS_URL")
+    ),
+    rate_limiter=finnhub_limiter
+)
+
+def create_quote_feed(url):
+    """Live feed of the most requested symbols' prices from the websocket at `url`, seeded from REST quotes"""
+    return QuoteFeed(
+        url,
+        seed=lambda symbol: finnhub_client.quote(symbol=symbol),
+        max_symbols=int(os.getenv("QUOTE_FEED_MAX_SYMBOLS", "50")),
+        min_requests=float(os.getenv("QUOTE_FEED_MIN_REQUESTS", "2")),
+        rebalance_interval=float(os.getenv("QUOTE_FEED_REBALANCE_SECONDS", "10"))
+    )
+
+# Finnhub allows one websocket per API key, so the feed is off unless QUOTE_FEED=1 (one worker, or one key per worker)
+quote_feed = None
+if os.getenv("QUOTE_FEED", "0") == "1":
+    quote_feed = create_quote_feed(f"{os.getenv('QUOTE_FEED_URL', 'wss://ws.finnhub.io')}?token={os.getenv('FINNHUB_API_KEY')}")
+
+def latest_quote(symbol):
+    """Quote of a hot symbol from the live feed, of any other symbol from the (cached) REST API"""
+    quote = quote_feed.lookup(symbol) if quote_feed is not None else None
+    if quote is not None:
+        record_cache_result("quote_feed", "hit")
+        return quote
+    return finnhub_client.quote(symbol=symbol)
+
+# Approximate prompt tokens a news digest may use
+NEWS_TOKEN_BUDGET = int(os.getenv("NEWS_TOKEN_BUDGET", "800"))
+
+# Bounded pool the multi-symbol tools fan out on
+finnhub_pool = ThreadPoolExecutor(max_workers=int(os.getenv("FINNHUB_MAX_WORKERS", "8")), thread_name_prefix="finnhub")
+
+def fetch_many(fetch, symbols):
+    """Call `fetch(symbol)` for every symbol concurrently on the Finnhub pool.
+
+    Returns a dict of symbol to result, with None for symbols whose request failed.
+    """
+    futures = {symbol: finnhub_pool.submit(propagate(fetch), symbol) for symbol in dict.fromkeys(symbols)}
+    results = {}
+    for symbol, future in futures.items():
+        try:
+            results[symbol] = future.result()
+        except Exception as e:
+            print(f"Error fetching data for {symbol}: {e}")
+            results[symbol] = None
+    return results
 
 # Creating a Company Profile Tool
-@tool
+@tool(response_format="content_and_artifact")
+@traced_tool
+@projected(project_profile)
 def getStockData(symbol: str):
     """Get general company information and profile data from Finnhub API.
 
@@ -71,21 +152,9 @@ def getStockData(symbol: str):
         symbol (str): Stock symbol/ticker of the company (e.g. 'AAPL' for Apple Inc.)
 
     Returns:
-        dict: Company profile data containing:
-            - country: Company's country of registration
-            - currency: Company's reporting currency
-            - exchange: Listed exchange
-            - ipo: IPO date
-            - marketCapitalization: Market capitalization value
-            - name: Company name
-            - phone: Company phone number
-            - shareOutstanding: Number of outstanding shares
-            - ticker: Stock symbol
-            - weburl: Company website URL
-            - logo: URL to company logo
-            - finnhubIndustry: Industry classification
-        
-    Returns None if API request fails.
+        str: Compact JSON company profile with name, ticker, exchange, finnhubIndustry,
+            country, currency, marketCapitalization and shareOutstanding (both in millions)
+            and ipo date, or an error object if the request fails.
     """
     try:
         response = finnhub_client.company_profile2(symbol=symbol)
@@ -95,7 +164,9 @@ def getStockData(symbol: str):
         return None
 
 # Creating a Stock Recommendation Tool
-@tool
+@tool(response_format="content_and_artifact")
+@traced_tool
+@projected(project_recommendations)
 def getStockRecommendation(symbol: str):
     """Get latest analyst recommendation trends for a company from Finnhub API.
 
@@ -103,27 +174,20 @@ def getStockRecommendation(symbol: str):
         symbol (str): Stock symbol/ticker of the company (e.g. 'AAPL' for Apple Inc.)
 
     Returns:
-        list[dict]: List of monthly recommendation trends with each dict containing:
-            - buy: Number of buy recommendations
-            - hold: Number of hold recommendations
-            - period: Time period of recommendations (YYYY-MM-DD)
-            - sell: Number of sell recommendations
-            - strongBuy: Number of strong buy recommendations
-            - strongSell: Number of strong sell recommendations
-            - symbol: Stock symbol
-
-    Returns None if API request fails.
+        str: Table of the latest monthly recommendation trends, one line per month with
+            period (YYYY-MM-DD) and the number of strongBuy, buy, hold, sell and strongSell
+            ratings, or an error object if the request fails.
     """
     try:
-        response = finnhub_client.recommendation_trends(symbol=symbol)
-        print(response)
-        return response
+        return finnhub_client.recommendation_trends(symbol=symbol)
     except requests.exceptions.RequestException as e:
         print(f"Error fetching company recommendation data: {e}")
         return None
     
 # Creating a Stock Pice Tool
-@tool
+@tool(response_format="content_and_artifact")
+@traced_tool
+@projected(project_quote)
 def getStockPrice(symbol: str):
     """Get real-time stock price data from Finnhub API.
 
@@ -131,27 +195,21 @@ def getStockPrice(symbol: str):
         symbol (str): Stock symbol/ticker of the company (e.g. 'AAPL' for Apple Inc.)
 
     Returns:
-        dict: Real-time stock price data containing:
-            - c: Current price
-            - d: Change
-            - dp: Percent change
-            - h: High price of the day
-            - l: Low price of the day
-            - o: Open price of the day
-            - pc: Previous close price
-            - t: Timestamp
-
-    Returns None if API request fails.
+        str: Compact JSON quote with c (current price), d (change), dp (percent change),
+            h/l (day high/low), o (open), pc (previous close) and t (UTC time),
+            or an error object if the request fails.
     """
     try:
-        response = finnhub_client.quote(symbol=symbol)
+        response = latest_quote(symbol)
         return response
     except requests.exceptions.RequestException as e:
         print(f"Error fetching company quote data: {e}")
         return None
 
 # Creating a Company Earnings History Tool
-@tool
+@tool(response_format="content_and_artifact")
+@traced_tool
+@projected(project_earnings)
 def getCompanyEarnings(symbol: str):
     """Get quarterly earnings history and analyst estimates for a company from Finnhub API.
 
@@ -159,17 +217,9 @@ def getCompanyEarnings(symbol: str):
         symbol (str): Stock symbol/ticker of the company (e.g. 'AAPL' for Apple Inc.)
 
     Returns:
-        list[dict]: List of quarterly earnings reports with each dict containing:
-            - actual: Actual earnings per share (EPS)
-            - estimate: Estimated EPS by analysts
-            - period: Reporting period date (YYYY-MM-DD)
-            - quarter: Fiscal quarter (1-4)
-            - surprise: Difference between actual and estimated EPS
-            - surprisePercent: Percentage difference from estimate
-            - symbol: Stock symbol
-            - year: Fiscal year
-            
-    Returns None if API request fails.
+        str: Table of the latest quarterly reports, one line per quarter with period
+            (YYYY-MM-DD), actual and estimate EPS and surprisePercent, or an error
+            object if the request fails.
     """
     try:
         response = finnhub_client.company_earnings(symbol=symbol)
@@ -179,26 +229,21 @@ def getCompanyEarnings(symbol: str):
         return None
 
 # Creating a Company News Tools
-@tool
-def getCompanyNews(symbol: str):
-    """Get recent news articles and summaries for a company from Finnhub API.
+@tool(response_format="content_and_artifact")
+@traced_tool
+def getCompanyNews(symbol: str, query: str = ""):
+    """Get a digest of recent, distinct news stories for a company from Finnhub API.
 
     Args:
         symbol (str): Stock symbol/ticker of the company (e.g. 'AAPL' for Apple Inc.)
+        query (str): The user's question or topic of interest, used to rank stories by relevance
 
     Returns:
-        str: JSON-formatted string containing:
-            - summaries: Combined text of all news article summaries
+        str: Compact JSON string containing:
+            - articles: Most relevant and recent stories from the last 7 days, syndicated
+              copies removed, each with headline, source, url, datetime (UTC) and summary
             - error: Error message if no news data is available or an error occurred
             
-        News data includes articles from the last 7 days with fields:
-            - category: News category/type
-            - datetime: Unix timestamp of publication
-            - headline: Article headline
-            - summary: Article summary text
-            - url: Link to full article
-            - source: News source name
-            
     Returns JSON error object if API request fails or no news data available.
     """
     try:
@@ -210,89 +255,536 @@ def getCompanyNews(symbol: str):
         response = finnhub_client.company_news(symbol=symbol, _from=str(from_date), to=str(to_date))
         
         if not response:
-            return json.dumps({"error": "No news data available"}, indent=4)
+            return compact_json({"error": "No news data available"}), None
 
-        # Extract summaries, handling missing keys
-        summaries = []
-        for item in response:
-            if "summary" in item and item["summary"]:
-                summaries.append(item["summary"])
+        # Deduplicate, rank and cut the articles down to the prompt budget
+        articles = build_digest(response, query=query, token_budget=NEWS_TOKEN_BUDGET)
         
-        if not summaries:
-            return json.dumps({"error": "No summaries found in response"}, indent=4)
-
-        # Combine summaries
-        combined_summaries = "\n".join(summaries)
+        if not articles:
+            return compact_json({"error": "No articles found in response"}), None
 
-        # Convert to JSON object
-        result_json = json.dumps({"summaries": combined_summaries}, indent=4, ensure_ascii=False)
+        # Convert to compact JSON object, the digest records travel as the artifact
+        result_json = compact_json({"articles": articles})
+        record_tokens("getCompanyNews", response, result_json)
 
-        return result_json
+        return result_json, articles
 
     except finnhub.FinnhubAPIException as e:
         print(f"API error: {e}")
-        return json.dumps({"error": f"API error: {e}"}, indent=4)
+        return compact_json({"error": f"API error: {e}"}), None
     except Exception as e:
         print(f"Unexpected error: {e}")
-        return json.dumps({"error": f"Unexpected error: {e}"}, indent=4)
+        return compact_json({"error": f"Unexpected error: {e}"}), None
+
+
+# Creating a Multi-Symbol Stock Price Tool
+@tool(response_format="content_and_artifact")
+@traced_tool
+@projected(project_quotes)
+def getStockPrices(symbols: list[str]):
+    """Get real-time stock price data for several companies at once from Finnhub API.
+
+    Args:
+        symbols (list[str]): Stock symbols/tickers of the companies (e.g. ['AAPL', 'MSFT', 'NVDA'])
+
+    Returns:
+        str: Table with one line per symbol and the same fields as getStockPrice
+            (c, d, dp, h, l, o, pc, t), followed by the symbols without data, if any.
+    """
+    return fetch_many(latest_quote, symbols)
+
+# Creating a Multi-Symbol Company Profile Tool
+@tool(response_format="content_and_artifact")
+@traced_tool
+@projected(project_profiles)
+def getStockProfiles(symbols: list[str]):
+    """Get general company information and profile data for several companies at once from Finnhub API.
+
+    Args:
+        symbols (list[str]): Stock symbols/tickers of the companies (e.g. ['AAPL', 'MSFT', 'NVDA'])
+
+    Returns:
+        str: Compact JSON mapping of each symbol to its company profile, with the same
+            fields as getStockData. A symbol maps to null if its request failed.
+    """
+    return fetch_many(lambda symbol: finnhub_client.company_profile2(symbol=symbol), symbols)
+
+# Creating a Multi-Symbol Company Earnings Tool
+@tool(response_format="content_and_artifact")
+@traced_tool
+@projected(project_earnings_many)
+def getCompaniesEarnings(symbols: list[str]):
+    """Get quarterly earnings history and analyst estimates for several companies at once from Finnhub API.
+
+    Args:
+        symbols (list[str]): Stock symbols/tickers of the companies (e.g. ['AAPL', 'MSFT', 'NVDA'])
+
+    Returns:
+        str: Table with one line per symbol and quarter and the same fields as
+            getCompanyEarnings, followed by the symbols without data, if any.
+    """
+    return fetch_many(lambda symbol: finnhub_client.company_earnings(symbol=symbol), symbols)
+
+# Daily candle history on local disk, only ranges not downloaded before are fetched from Finnhub
+candle_store = candles.CandleStore(
+    os.getenv("CANDLE_STORE_DIR", "data/candles"),
+    fetch=lambda symbol, resolution, start, end: finnhub_client.stock_candles(symbol, resolution, start, end)
+)
+
+# Creating a Price History Tool
+@tool(response_format="content_and_artifact")
+@traced_tool
+def getStockCandles(symbol: str, period: str = "6m"):
+    """Get daily price history and technical indicators for a stock over a period from Finnhub API.
+
+    Args:
+        symbol (str): Stock symbol/ticker of the company (e.g. 'AAPL' for Apple Inc.)
+        period (str): One of '1m', '3m', '6m', 'ytd', '1y', '2y' or '5y'
+
+    Returns:
+        str: Compact JSON summary of the period: first and last trading day, start and
+            last close, change_pct, high, low, max_drawdown_pct, the latest sma50, sma200,
+            ema20, rsi14 and volatility20 (annualized %, 20 days), and evenly spaced closes.
+            An error object if the period is unknown or there is no data.
+    """
+    try:
+        now = time.time()
+        window_start = candles.period_start(period, now)
+        columns = candle_store.get(symbol, "D", window_start - candles.WARMUP_DAYS * 86400, now)
+        summary, records = candles.analyze(columns, window_start)
+        if summary is None:
+            return compact_json({"error": "No price history available"}), None
+        return compact_json({"symbol": symbol, **summary}), records
+    except ValueError as e:
+        return compact_json({"error": str(e)}), None
+    except Exception as e:
+        print(f"Error fetching price history: {e}")
+        return compact_json({"error": f"Unexpected error: {e}"}), None
+
+# Ticker symbols and company names of the exchange, loaded from disk and refreshed from Finnhub in the background
+symbol_catalog = symbols.SymbolCatalog(
+    os.getenv("SYMBOL_INDEX_PATH", "data/symbols.idx"),
+    fetch=lambda: finnhub_client.stock_symbols(exchange=os.getenv("SYMBOL_EXCHANGE", "US")),
+    max_age=float(os.getenv("SYMBOL_INDEX_MAX_AGE", str(24 * 60 * 60)))
+)
+router.symbol_catalog = symbol_catalog
+
+# Creating a Symbol Lookup Tool
+@tool(response_format="content_and_artifact")
+@traced_tool
+def lookupSymbol(query: str):
+    """Find ticker symbols by company name, name prefix or symbol, from a local index (no API call).
+
+    Args:
+        query (str): Company name or part of it, e.g. 'berkshire b', 'nvidia', 'coca cola'
+
+    Returns:
+        str: Table of up to 5 matches, best first, with symbol, name and type
+    """
+    matches = symbol_catalog.index.search(query)
+    if not matches:
+        return NO_DATA, []
+    return table(matches, ("symbol", "name", "type")), matches
 
 
 # Initialize Azure OpenAI LLM 
-tools = [getStockData, getStockRecommendation, getCompanyNews, getStockPrice, getCompanyEarnings]
-llm = AzureChatOpenAI( 
-    deployment_name=os.getenv("OPENAI_API_DEPLOYMENT"),
-    model=os.getenv("OPENAI_API_MODEL"),
-    temperature=0.8,
-    max_tokens=1000
-).bind_tools(tools)
+tools = [getStockData, getStockRecommendation, getCompanyNews, getStockPrice, getCompanyEarnings,
+         getStockPrices, getStockProfiles, getCompaniesEarnings, getStockCandles, lookupSymbol]
+
+# Pool the tools run on from the graph. Waits for the Finnhub rate limiter block its threads, so they must not be
+# the event loop's default executor that /reset, the checkpointer and warm-up share. Separate from finnhub_pool,
+# which the multi-symbol tools wait on
+tool_pool = ThreadPoolExecutor(max_workers=int(os.getenv("TOOL_MAX_WORKERS", "16")), thread_name_prefix="tool")
+
+def run_on_tool_pool(tool_fn):
+    """Give a sync tool a coroutine that runs its function on tool_pool"""
+    async def run(**kwargs):
+        return await asyncio.get_running_loop().run_in_executor(tool_pool, propagate(lambda: tool_fn.func(**kwargs)))
+
+    tool_fn.coroutine = run
+    return tool_fn
+
+for tool_fn in tools:
+    run_on_tool_pool(tool_fn)
+
+# Deadline of one LLM call over all its attempts, and bounds on how long to wait before hedging it
+LLM_CALL_TIMEOUT = float(os.getenv("LLM_CALL_TIMEOUT", "30"))
+LLM_HEDGE = os.getenv("LLM_HEDGE", "1") == "1"
+LLM_MIN_HEDGE_DELAY = float(os.getenv("LLM_MIN_HEDGE_DELAY", "0.5"))
+LLM_MAX_HEDGE_DELAY = float(os.getenv("LLM_MAX_HEDGE_DELAY", "10"))
+
+def llm_deployments():
+    """(deployment, endpoint) pairs from OPENAI_API_DEPLOYMENTS ("name@endpoint,..."), else the single configured one"""
+    default_endpoint = os.getenv("AZURE_OPENAI_ENDPOINT")
+    entries = [e.strip() for e in os.getenv("OPENAI_API_DEPLOYMENTS", "").split(",") if e.strip()]
+    if not entries:
+        return [(os.getenv("OPENAI_API_DEPLOYMENT"), default_endpoint)]
+    return [(name, endpoint or default_endpoint) for name, _, endpoint in (e.partition("@") for e in entries)]
+
+def create_router(models):
+    """Route LLM calls over (name, chat model) pairs with the deadline and hedging settings above"""
+    return DeploymentRouter(
+        [Deployment(name, model) for name, model in models],
+        tools=tools,
+        call_timeout=LLM_CALL_TIMEOUT,
+        min_hedge_delay=LLM_MIN_HEDGE_DELAY,
+        max_hedge_delay=LLM_MAX_HEDGE_DELAY,
+        hedge=LLM_HEDGE
+    )
+
+def azure_models():
+    """(name, AzureChatOpenAI) pairs for the configured deployments, each with a keep-alive connection pool of its own"""
+    # Imported here: langchain_openai and the OpenAI SDK take seconds to load, which the server's start does not wait for
+    from langchain_openai import AzureChatOpenAI
+    from openai import DefaultAsyncHttpxClient
+
+    deployments = llm_deployments()
+    return [
+        # Named after their host too when there are several, as the same deployment name often exists in each region
+        (f"{deployment}@{urlparse(endpoint or '').hostname}" if len(deployments) > 1 else deployment, AzureChatOpenAI( 
+            azure_deployment=deployment,
+            azure_endpoint=endpoint,
+            model=os.getenv("OPENAI_API_MODEL"),
+            temperature=0.8,
+            max_tokens=1000,
+            max_retries=0,  # The router moves on to another deployment instead
+            http_async_client=DefaultAsyncHttpxClient()
+        ))
+        for deployment, endpoint in deployments
+    ]
+
+# The deployment router, built on first use by get_llm (or swapped for fakes by bench.py)
+llm = None
+_llm_lock = threading.Lock()
+
+def get_llm():
+    global llm
+    if llm is None:
+        with _llm_lock:
+            if llm is None:
+                llm = create_router(azure_models())
+    return llm
+
+def add_messages(left, right):
+    """LangGraph's message reducer, imported on the first turn with the rest of langgraph.graph"""
+    from langgraph.graph.message import add_messages as merge
+    return merge(left, right)
 
 class CustomState(TypedDict):
     messages: Annotated[list, add_messages]
     chart_data: Optional[Dict[str, Any]] = None
     message_id: Optional[str] = None
 
-# Define a new graph
-workflow = StateGraph(CustomState)
+# Tool-calling rounds per turn before the LLM must answer with what it has, and the time a whole turn may take
+GRAPH_MAX_TOOL_ROUNDS = int(os.getenv("GRAPH_MAX_TOOL_ROUNDS", "4"))
+GRAPH_TIME_BUDGET = float(os.getenv("GRAPH_TIME_BUDGET", "60"))
+OUT_OF_TIME = "Sorry, I couldn't finish answering in time. Please try again, or ask about fewer things at once."
+
+graph_budget_exhausted = registry.counter(
+    "finchat_graph_budget_exhausted_total",
+    "Turns cut short by the tool-round limit (tools), the time budget (time) or an LLM deadline (llm_timeout)"
+)
+
+def run_config(thread_id):
+    """Config of one graph run on a thread, with the turn's deadline and a step limit behind GRAPH_MAX_TOOL_ROUNDS"""
+    return {
+        "configurable": {"thread_id": thread_id, "__deadline": time.monotonic() + GRAPH_TIME_BUDGET},
+        # Router, then the LLM and tools once per round, then the final answer, with some slack
+        "recursion_limit": 2 * GRAPH_MAX_TOOL_ROUNDS + 4
+    }
+
+# Token budget for earlier turns of a conversation, and how much of an old tool output is kept
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "3000"))
+OLD_TOOL_OUTPUT_CHARS = int(os.getenv("OLD_TOOL_OUTPUT_CHARS", "500"))
+
+def compact_history(messages):
+    """Bound the conversation sent to the LLM so prompt size stays flat in long sessions.
+
+    The current turn (from the latest human message on) is always kept whole.
+    Tool outputs from earlier turns are truncated, then the oldest turns are
+    dropped until the rest fits in HISTORY_TOKEN_BUDGET.
+
+    Returns:
+        tuple: (messages to send, state updates that apply the same compaction to the thread)
+    """
+    last_human = max((i for i, m in enumerate(messages) if isinstance(m, HumanMessage)), default=0)
+    earlier, current = messages[:last_human], messages[last_human:]
+
+    updates = []
+    compacted = []
+    for message in earlier:
+        if isinstance(message, ToolMessage) and isinstance(message.content, str) and len(message.content) > OLD_TOOL_OUTPUT_CHARS:
+            message = message.model_copy(update={"content": message.content[:OLD_TOOL_OUTPUT_CHARS] + " ...[truncated]"})
+            updates.append(message)  # Same ID, so it replaces the full output in the thread
+        compacted.append(message)
+
+    budget = max(HISTORY_TOKEN_BUDGET - count_tokens_approximately(current), 0)
+    kept = trim_messages(
+        compacted,
+        max_tokens=budget,
+        strategy="last",
+        token_counter=count_tokens_approximately,
+        start_on="human"
+    ) if compacted and budget else []
+
+    kept_ids = {m.id for m in kept}
+    dropped = [m for m in compacted if m.id not in kept_ids]
+    updates = [u for u in updates if u.id in kept_ids] + [RemoveMessage(id=m.id) for m in dropped if m.id]
+    return kept + current, updates
+
+# Answers to standalone questions, reused for near-duplicate prompts. Answers built
+# from live tool data are kept only briefly
+response_cache = SemanticCache(
+    threshold=float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.96")),
+    max_entries=int(os.getenv("SEMANTIC_CACHE_SIZE", "1000")),
+    ttl=float(os.getenv("SEMANTIC_CACHE_TTL", str(24 * 60 * 60))),
+    symbols_of=router.find_symbols
+)
+SEMANTIC_CACHE_LIVE_TTL = float(os.getenv("SEMANTIC_CACHE_LIVE_TTL", "60"))
+
+def standalone_question(messages):
+    """The prompt of a single-turn conversation, None once there is earlier context"""
+    human = [m for m in messages if isinstance(m, HumanMessage)]
+    if len(human) == 1 and isinstance(human[0].content, str):
+        return human[0].content
+    return None
+
+def replay_tool_messages(messages):
+    """Copies of cached tool calls and results with fresh IDs, to add to another thread"""
+    call_ids = {}
+    copies = []
+    for message in messages:
+        if isinstance(message, AIMessage):
+            tool_calls = []
+            for call in message.tool_calls:
+                call_ids[call["id"]] = f"call_{uuid.uuid4().hex[:12]}"
+                tool_calls.append({**call, "id": call_ids[call["id"]]})
+            copies.append(AIMessage(content=message.content, tool_calls=tool_calls))
+        else:
+            copies.append(message.model_copy(update={"id": None, "tool_call_id": call_ids.get(message.tool_call_id, message.tool_call_id)}))
+    return copies
+
+def with_symbol_hints(history):
+    """Add the tickers of companies the latest prompt names as a system note just before it, so the LLM does not guess"""
+    last_human = max((i for i, m in enumerate(history) if isinstance(m, HumanMessage)), default=None)
+    if last_human is None or not isinstance(history[last_human].content, str):
+        return history
+    mentions = router.name_mentions(history[last_human].content)
+    if not mentions:
+        return history
+    hint = SystemMessage(content="Ticker symbols of companies named in the next message: " +
+                         "; ".join(f"{name} = {symbol}" for name, symbol in mentions))
+    return history[:last_human] + [hint] + history[last_human:]
 
 # Action taken by the home node
-def invoke_llm(state: CustomState):
+async def invoke_llm(state: CustomState, config: RunnableConfig):
     # Get existing messages and state
     messages = state.get("messages", [])
     chart_data = state.get("chart_data", None)
     message_id = state.get("message_id", None)
     
+    # Reuse the answer to a near-identical standalone question
+    question = standalone_question(messages)
+    if question is not None and isinstance(messages[-1], HumanMessage):
+        with span("semantic_cache"):
+            cached = response_cache.lookup(question)
+        if cached is not None:
+            # The cached turn's tool results come along, so the client still gets their charts
+            replayed = replay_tool_messages(cached["tool_messages"])
+            return {"messages": replayed + [AIMessage(content=cached["answer"])], "chart_data": chart_data, "message_id": message_id}
+    
     # Create prompt with system message
     prompt_template = ChatPromptTemplate([
         ("system", SYSTEM_PROMPT),
         MessagesPlaceholder("messages")
     ])
     
-    # Create prompt with messages
-    prompt = prompt_template.invoke({"messages": messages})
+    # Create prompt with a bounded history
+    history, updates = compact_history(messages)
+    prompt = prompt_template.invoke({"messages": with_symbol_hints(history)})
+    
+    # Answer without more tools once the turn has used its rounds, and give up once its time is up
+    deadline = config.get("configurable", {}).get("__deadline")
+    remaining = deadline - time.monotonic() if deadline is not None else None
+    last_human = max((i for i, m in enumerate(messages) if isinstance(m, HumanMessage)), default=0)
+    tool_rounds = sum(1 for m in messages[last_human:] if isinstance(m, AIMessage) and m.tool_calls)
+    if tool_rounds >= GRAPH_MAX_TOOL_ROUNDS:
+        graph_budget_exhausted.inc(reason="tools")
+    if remaining is not None and remaining <= 0:
+        graph_budget_exhausted.inc(reason="time")
+        return {"messages": updates + [AIMessage(content=OUT_OF_TIME)], "chart_data": chart_data, "message_id": message_id}
     
-    # Get response from LLM
-    response = llm.invoke(prompt)
+    # Get response from LLM without blocking the event loop
+    with span("llm"):
+        try:
+            response = await get_llm().ainvoke(prompt, timeout=remaining, tools=tool_rounds < GRAPH_MAX_TOOL_ROUNDS)
+        except TimeoutError as e:
+            print(f"Error calling the LLM: {e}")
+            graph_budget_exhausted.inc(reason="llm_timeout")
+            return {"messages": updates + [AIMessage(content=OUT_OF_TIME)], "chart_data": chart_data, "message_id": message_id}
+        record_llm_usage(response)
     
-    # Return response with state
+    # Cache final answers, briefly if they were built from live tool data
+    if question is not None and not response.tool_calls and response.content:
+        tool_messages = [m for m in messages if isinstance(m, ToolMessage) or (isinstance(m, AIMessage) and m.tool_calls)]
+        response_cache.store(
+            question,
+            {"answer": response.content, "tool_messages": tool_messages},
+            ttl=SEMANTIC_CACHE_LIVE_TTL if tool_messages else None
+        )
+    
+    # Return response with state, dropping the compacted history from the thread
     return {
-        "messages": response,
+        "messages": updates + [response],
         "chart_data": chart_data,
         "message_id": message_id
     }
 
-# Define a graph with a single node
-workflow.add_edge(START, "home")
-workflow.add_node("home", invoke_llm)
-tool_node = ToolNode(tools)
-workflow.add_node("tools", tool_node)
-workflow.add_conditional_edges("home", tools_condition, ["tools", END])
-workflow.add_edge("tools", "home")
-
-# Function to create a fresh graph instance
-def create_graph():
-    """Create a fresh graph instance with a new memory saver"""
-    memory = MemorySaver()
-    return workflow.compile(checkpointer=memory)
-
-# For backwards compatibility
-graph = create_graph()
\ No newline at end of file
+fastpath_requests = registry.counter("finchat_fastpath_requests_total", "Prompts answered by the fast path (served) or sent on to the LLM (fallback)")
+fastpath_latency = registry.histogram("finchat_fastpath_latency_seconds", "Latency of prompts answered by the fast path")
+
+# Action taken by the router node
+async def route_query(state: CustomState, config: RunnableConfig):
+    """Answer simple single-ticker price and profile questions without an LLM round trip.
+
+    The tool call, its result and a templated answer are added to the thread as if
+    the LLM had produced them, so later turns see the same history either way.
+    Anything the classifier is unsure about is left for the home node.
+    """
+    with span("router"):
+        start = time.perf_counter()
+        # The start-up warm-up turn is left out of the fast-path metrics
+        counted = not config["configurable"].get("__warm_up")
+        last = state["messages"][-1]
+        match = router.classify(last.content) if isinstance(last, HumanMessage) else None
+        if match is None:
+            if counted:
+                fastpath_requests.inc(result="fallback")
+            return {}
+
+        intent, symbol = match
+        tool_fn, render = (getStockPrice, router.render_price) if intent == "price" else (getStockData, router.render_profile)
+        call_id = f"fastpath_{uuid.uuid4().hex[:12]}"
+        tool_call = {"name": tool_fn.name, "args": {"symbol": symbol}, "id": call_id, "type": "tool_call"}
+        # Invoked with a tool call, the tool returns the same ToolMessage the LLM path would add
+        tool_message = await tool_fn.ainvoke(tool_call)
+        answer = render(symbol, tool_message.artifact)
+        if answer is None:
+            if counted:
+                fastpath_requests.inc(result="fallback")
+            return {}
+
+        if counted:
+            fastpath_requests.inc(result="served")
+            fastpath_latency.observe(time.perf_counter() - start)
+        return {
+            "messages": [
+                AIMessage(content="", tool_calls=[tool_call]),
+                tool_message,
+                AIMessage(content=answer)
+            ]
+        }
+
+def after_route(state: CustomState):
+    # The fast path ends on its own answer, everything else goes to the LLM
+    return END if isinstance(state["messages"][-1], AIMessage) else "home"
+
+def create_workflow():
+    """The graph: router, then the LLM and its tools"""
+    # Imported here: langgraph.graph and langgraph.prebuilt take a few hundred milliseconds to load
+    from langgraph.graph import StateGraph
+    from langgraph.prebuilt import ToolNode, tools_condition
+
+    workflow = StateGraph(CustomState)
+    workflow.add_edge(START, "router")
+    workflow.add_node("router", route_query)
+    workflow.add_conditional_edges("router", after_route, ["home", END])
+    workflow.add_node("home", invoke_llm)
+    workflow.add_node("tools", ToolNode(tools))
+    workflow.add_conditional_edges("home", tools_condition, ["tools", END])
+    workflow.add_edge("tools", "home")
+    return workflow
+
+# Function to compile the workflow
+def create_graph(checkpointer=None):
+    """Compile the workflow with the given checkpointer, or a fresh in-memory one"""
+    if checkpointer is None:
+        checkpointer = MemorySaver()
+    with span("graph_compile"):
+        return create_workflow().compile(checkpointer=checkpointer)
+
+# Single compiled graph shared by every request, conversations are keyed by thread ID.
+# With the sqlite or redis checkpointer any worker or replica can continue any conversation.
+checkpointer = create_checkpointer(
+    os.getenv("GRAPH_CHECKPOINTER", "memory"),
+    max_threads=int(os.getenv("GRAPH_MAX_THREADS", "1000")),
+    idle_ttl=float(os.getenv("GRAPH_THREAD_IDLE_SECONDS", "3600")),
+    sqlite_path=os.getenv("GRAPH_SQLITE_PATH", "finchat_threads.db"),
+    redis_url=os.getenv("REDIS_URL"),
+    flush_interval=float(os.getenv("GRAPH_FLUSH_SECONDS", "0.02"))
+)
+graph = None  # Compiled on first use by get_graph
+_graph_lock = threading.Lock()
+
+def get_graph():
+    global graph
+    if graph is None:
+        with _graph_lock:
+            if graph is None:
+                graph = create_graph(checkpointer)
+    return graph
+
+# Symbol whose price question exercises the graph, its Finnhub connection and the fast path at start-up, empty to skip
+WARMUP_SYMBOL = os.getenv("WARMUP_SYMBOL", "AAPL")
+
+async def warm_up():
+    """Build the LLM clients and the graph and open upstream connections, before the first request needs them.
+
+    Connection failures are only logged, a slow upstream should not keep the
+    server from starting. Returns the seconds each step took.
+    """
+    timings = {}
+
+    async def step(name, fn, required=True):
+        start = time.perf_counter()
+        try:
+            await fn()
+        except Exception as e:
+            if required:
+                raise
+            print(f"Error warming up {name}: {e}")
+        timings[name] = round(time.perf_counter() - start, 3)
+
+    async def open_llm_connections():
+        # Any answer from the endpoint leaves a TLS connection in the deployment's pool
+        for deployment in get_llm().deployments:
+            client = getattr(deployment.model, "http_async_client", None)
+            endpoint = getattr(deployment.model, "azure_endpoint", None)
+            if client is not None and endpoint:
+                await client.head(endpoint)
+
+    async def first_turn():
+        if not WARMUP_SYMBOL:
+            return
+        # A price question the fast path answers, stopping before the LLM if it is not
+        config = run_config(f"warmup-{uuid.uuid4()}")
+        config["configurable"]["__warm_up"] = True
+        try:
+            await get_graph().ainvoke({"messages": [HumanMessage(f"What's the price of {WARMUP_SYMBOL}?")]}, config,
+                                      interrupt_before=["home"])
+        finally:
+            await checkpointer.adelete_thread(config["configurable"]["thread_id"])
+
+    async def in_thread(fn):
+        await asyncio.to_thread(fn)
+
+    # Imports and construction run in a thread, so health checks are answered meanwhile
+    await step("llm_clients", lambda: in_thread(get_llm))
+    await step("graph", lambda: in_thread(get_graph))
+    await step("symbol_index", lambda: in_thread(lambda: symbol_catalog.index), required=False)
+    await step("llm_connections", open_llm_connections, required=False)
+    await step("first_turn", first_turn, required=False)
+    # Move everything loaded so far out of the collector's way, so the first requests do not pay for a full collection of it
+    gc.collect()
+    gc.freeze()
+    return timings
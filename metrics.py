@@ -0,0 +1,126 @@
+import threading
+
+# Default latency buckets in seconds, from fast cache hits to slow LLM round trips
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    inner = ",".join(f'{k}="{v}"' for k, v in sorted(labels.items()))
+    return "{" + inner + "}"
+
+class Counter:
+    """Monotonically increasing counter, optionally split by labels"""
+
+    type_name = "counter"
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help_text = help_text
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(tuple(sorted(labels.items())), 0)
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        return [(self.name, dict(key), value) for key, value in items]
+
+class Gauge(Counter):
+    """Value that can go up and down, e.g. requests currently in flight"""
+
+    type_name = "gauge"
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = value
+
+class Histogram:
+    """Cumulative bucketed histogram in the Prometheus exposition format"""
+
+    type_name = "histogram"
+
+    def __init__(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def count(self, **labels):
+        series = self._series.get(tuple(sorted(labels.items())))
+        return series[2] if series else 0
+
+    def samples(self):
+        with self._lock:
+            items = [(key, list(s[0]), s[1], s[2]) for key, s in self._series.items()]
+        samples = []
+        for key, bucket_counts, total, count in items:
+            labels = dict(key)
+            running = 0
+            for bound, n in zip(self.buckets, bucket_counts):
+                running += n
+                samples.append((f"{self.name}_bucket", {**labels, "le": str(bound)}, running))
+            samples.append((f"{self.name}_bucket", {**labels, "le": "+Inf"}, count))
+            samples.append((f"{self.name}_sum", labels, total))
+            samples.append((f"{self.name}_count", labels, count))
+        return samples
+
+class Registry:
+    """Collection of metrics rendered together on the /metrics route"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, cls, name, help_text, **kwargs):
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = cls(name, help_text, **kwargs)
+            return self._metrics[name]
+
+    def counter(self, name, help_text):
+        return self._register(Counter, name, help_text)
+
+    def gauge(self, name, help_text):
+        return self._register(Gauge, name, help_text)
+
+    def histogram(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram, name, help_text, buckets=buckets)
+
+    def render(self):
+        """Render every registered metric in the Prometheus text format"""
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.append(f"# HELP {metric.name} {metric.help_text}")
+            lines.append(f"# TYPE {metric.name} {metric.type_name}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{_format_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+# Process-wide registry shared by the server, the graph and the tools
+registry = Registry()
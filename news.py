@@ -0,0 +1,173 @@
+import datetime, re, time
+
+import numpy as np
+
+# MinHash signature layout: BANDS * ROWS hash functions, near-duplicates must share a band
+BANDS = 16
+ROWS = 4
+SHINGLE_SIZE = 3
+DUPLICATE_SIMILARITY = 0.6
+
+# Half-life of an article's recency score, and how strongly query matches outweigh recency
+RECENCY_HALF_LIFE_HOURS = 24.0
+RELEVANCE_WEIGHT = 3.0
+
+SUMMARY_CHARS = 280
+
+WORD_PATTERN = re.compile(r"[a-z0-9]+")
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "has", "in", "is", "it",
+    "its", "of", "on", "or", "that", "the", "to", "was", "were", "will", "with", "what",
+    "whats", "how", "about", "news", "latest", "recent", "me", "show", "tell", "summarize",
+}
+
+_rng = np.random.default_rng(20240501)
+# Odd multipliers for the 32-bit hash permutations, one per signature column
+_HASH_A = _rng.integers(1, 1 << 32, size=BANDS * ROWS, dtype=np.uint32) | np.uint32(1)
+_HASH_B = _rng.integers(0, 1 << 32, size=BANDS * ROWS, dtype=np.uint32)
+_SHINGLE_MIX = np.array([0x9E3779B97F4A7C15, 0xC2B2AE3D27D4EB4F, 1], dtype=np.uint64)
+
+def _tokens(text):
+    return WORD_PATTERN.findall(text.lower())
+
+def tokenize(texts):
+    """Tokenize texts into one flat array of word IDs and the document index of each word.
+
+    Returns:
+        tuple: (word IDs, document indices, vocabulary dict of word to ID)
+    """
+    words_per_doc = [_tokens(text) for text in texts]
+    vocabulary = {}
+    ids = np.fromiter(
+        (vocabulary.setdefault(word, len(vocabulary)) for words in words_per_doc for word in words),
+        dtype=np.uint64,
+        count=sum(len(words) for words in words_per_doc)
+    )
+    docs = np.repeat(np.arange(len(texts)), [len(words) for words in words_per_doc])
+    return ids, docs, vocabulary
+
+def minhash_signatures(ids, docs, n_docs):
+    """MinHash signature (one row of BANDS * ROWS values) of each document's word shingles.
+
+    Documents too short for a single shingle get an all-zero signature.
+    """
+    signatures = np.zeros((n_docs, BANDS * ROWS), dtype=np.uint32)
+    if len(ids) < SHINGLE_SIZE:
+        return signatures
+
+    # Hash every run of SHINGLE_SIZE consecutive words that stays inside one document
+    windows = np.lib.stride_tricks.sliding_window_view(ids, SHINGLE_SIZE)
+    valid = docs[:len(windows)] == docs[SHINGLE_SIZE - 1:]
+    shingle_docs = docs[:len(windows)][valid]
+    if not len(shingle_docs):
+        return signatures
+    windows = windows[valid]
+    with np.errstate(over="ignore"):
+        mixed = windows[:, 0] * _SHINGLE_MIX[0] + windows[:, 1] * _SHINGLE_MIX[1] + windows[:, 2]
+        shingles = (mixed >> np.uint64(32)).astype(np.uint32)
+        # Laid out hash-major so the per-document minimum runs over contiguous memory
+        permuted = np.multiply.outer(_HASH_A, shingles) + _HASH_B[:, None]
+
+    # Shingles are grouped by document, so each group's minimum is one reduceat
+    starts = np.flatnonzero(np.r_[True, shingle_docs[1:] != shingle_docs[:-1]])
+    signatures[shingle_docs[starts]] = np.minimum.reduceat(permuted, starts, axis=1).T
+    return signatures
+
+def duplicate_mask(signatures):
+    """Mark rows that are near-duplicates of an earlier row.
+
+    Rows sharing any LSH band with an earlier row are candidates; a candidate is
+    a duplicate when its estimated Jaccard similarity with that row is at least
+    DUPLICATE_SIMILARITY. Earlier rows win, so order the input by preference.
+    All-zero rows (documents without shingles) are never marked.
+    """
+    n = len(signatures)
+    duplicate = np.zeros(n, dtype=bool)
+    if n < 2:
+        return duplicate
+
+    rows = np.arange(n)
+    has_shingles = signatures.any(axis=1)
+    for band in range(BANDS):
+        block = np.ascontiguousarray(signatures[:, band * ROWS:(band + 1) * ROWS])
+        keys = block.view(np.dtype((np.void, block.dtype.itemsize * ROWS))).ravel()
+        _, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+        representative = first[inverse]
+        candidates = rows[(representative != rows) & has_shingles]
+        if not len(candidates):
+            continue
+        similarity = (signatures[candidates] == signatures[representative[candidates]]).mean(axis=1)
+        duplicate[candidates[similarity >= DUPLICATE_SIMILARITY]] = True
+    return duplicate
+
+def relevance_scores(ids, docs, vocabulary, n_docs, query):
+    """Fraction of the query's content words found in each document"""
+    query_terms = {t for t in _tokens(query) if t not in STOPWORDS}
+    if not query_terms:
+        return np.zeros(n_docs)
+
+    is_query_term = np.zeros(len(vocabulary), dtype=bool)
+    is_query_term[[vocabulary[t] for t in query_terms if t in vocabulary]] = True
+    matches = is_query_term[ids.astype(np.intp)]
+    # Count each matching word once per document
+    pairs = np.unique(docs[matches] * len(vocabulary) + ids[matches].astype(np.intp))
+    return np.bincount(pairs // len(vocabulary), minlength=n_docs) / len(query_terms)
+
+def estimate_tokens(text):
+    # Roughly four characters per token for English text
+    return len(text) // 4 + 1
+
+def build_digest(articles, query="", token_budget=800, now=None):
+    """Turn raw Finnhub news into a short, ranked list of distinct stories.
+
+    Articles are scored by recency and by how well they match `query`, syndicated
+    copies of the same story are removed, and records are taken best-first until
+    `token_budget` is spent.
+
+    Args:
+        articles (list[dict]): Finnhub company_news items
+        query (str): The user's question, used for relevance ranking
+        token_budget (int): Approximate prompt tokens the digest may use
+        now (float): Unix timestamp used for recency, defaults to the current time
+
+    Returns:
+        list[dict]: Records with headline, source, url, datetime (ISO 8601 UTC) and summary
+    """
+    articles = [a for a in articles if a.get("headline") or a.get("summary")]
+    if not articles:
+        return []
+
+    now = time.time() if now is None else now
+    texts = [f"{a.get('headline', '')} {a.get('summary', '')}" for a in articles]
+    ids, docs, vocabulary = tokenize(texts)
+
+    published = np.array([a.get("datetime") or 0 for a in articles], dtype=float)
+    age_hours = np.clip((now - published) / 3600, 0, None)
+    relevance = relevance_scores(ids, docs, vocabulary, len(articles), query)
+    score = 0.5 ** (age_hours / RECENCY_HALF_LIFE_HOURS) * (1 + RELEVANCE_WEIGHT * relevance)
+
+    # Best-scoring copy of each story survives deduplication
+    order = np.argsort(-score, kind="stable")
+    signatures = minhash_signatures(ids, docs, len(articles))[order]
+    keep = order[~duplicate_mask(signatures)]
+
+    digest = []
+    used = 0
+    for i in keep:
+        article = articles[i]
+        summary = (article.get("summary") or "").strip()
+        if len(summary) > SUMMARY_CHARS:
+            summary = summary[:SUMMARY_CHARS].rsplit(" ", 1)[0] + "..."
+        record = {
+            "headline": article.get("headline", ""),
+            "source": article.get("source", ""),
+            "url": article.get("url", ""),
+            "datetime": datetime.datetime.fromtimestamp(article.get("datetime") or 0, datetime.timezone.utc).strftime("%Y-%m-%dT%H:%MZ"),
+            "summary": summary,
+        }
+        cost = estimate_tokens("".join(str(v) for v in record.values())) + 10
+        if digest and used + cost > token_budget:
+            break
+        digest.append(record)
+        used += cost
+    return digest
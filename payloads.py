@@ -0,0 +1,102 @@
+"""Column-oriented payloads of tool results for the client.
+
+Every tool result of the latest turn becomes one payload:
+
+    {"tool": "getStockRecommendation", "kind": "recommendations", "symbol": "AAPL",
+     "columns": {"period": [...], "buy": [...], ...},
+     "chart": {"type": "stacked_bar", "x": "period", "series": [...], "title": "..."}}
+
+Columns hold one list per field, so the client builds a DataFrame without
+reshaping. Chart types are "stacked_bar", "grouped_bar", "line", "bar",
+"metric" (one tile per row) and "table".
+"""
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+
+RECOMMENDATION_SERIES = ["strongBuy", "buy", "hold", "sell", "strongSell"]
+EARNINGS_FIELDS = ["period", "actual", "estimate", "surprisePercent"]
+QUOTE_FIELDS = ["c", "d", "dp", "h", "l", "o", "pc", "t"]
+PROFILE_FIELDS = ["name", "ticker", "exchange", "finnhubIndustry", "country", "currency", "marketCapitalization", "ipo", "weburl", "logo"]
+NEWS_FIELDS = ["datetime", "headline", "source", "url"]
+
+def columns_of(records, fields):
+    """Records as one list per field, None where a record lacks the field"""
+    return {field: [record.get(field) for record in records] for field in fields}
+
+def _recommendations(records, symbol):
+    records = sorted(records, key=lambda r: r.get("period") or "")
+    return "recommendations", columns_of(records, ["period", *RECOMMENDATION_SERIES]), {
+        "type": "stacked_bar", "x": "period", "series": RECOMMENDATION_SERIES, "title": f"Analyst recommendations, {symbol}"
+    }
+
+def _earnings(records, symbol):
+    records = sorted(records, key=lambda r: r.get("period") or "")
+    return "earnings", columns_of(records, EARNINGS_FIELDS), {
+        "type": "grouped_bar", "x": "period", "series": ["actual", "estimate"], "title": f"EPS vs. estimate, {symbol}"
+    }
+
+def _earnings_many(reports, symbol):
+    records = [
+        {"symbol": s, **report}
+        for s, symbol_reports in reports.items()
+        for report in sorted(symbol_reports or [], key=lambda r: r.get("period") or "")
+    ]
+    return "earnings", columns_of(records, ["symbol", *EARNINGS_FIELDS]), {
+        "type": "bar", "x": "period", "y": "surprisePercent", "color": "symbol", "title": "Earnings surprise (%)"
+    }
+
+def _quote(quote, symbol):
+    return "quotes", columns_of([{"symbol": symbol, **quote}], ["symbol", *QUOTE_FIELDS]), {
+        "type": "metric", "label": "symbol", "value": "c", "delta": "dp", "title": "Quote"
+    }
+
+def _quotes(quotes, symbol):
+    records = [{"symbol": s, **quote} for s, quote in quotes.items() if quote]
+    return "quotes", columns_of(records, ["symbol", *QUOTE_FIELDS]), {
+        "type": "metric", "label": "symbol", "value": "c", "delta": "dp", "title": "Quotes"
+    }
+
+def _profile(profile, symbol):
+    return "profiles", columns_of([profile], PROFILE_FIELDS), {"type": "table", "title": f"Company profile, {symbol}"}
+
+def _profiles(profiles, symbol):
+    return "profiles", columns_of([p for p in profiles.values() if p], PROFILE_FIELDS), {"type": "table", "title": "Company profiles"}
+
+def _news(articles, symbol):
+    return "news", columns_of(articles, NEWS_FIELDS), {"type": "table", "title": f"News, {symbol}"}
+
+def _candles(records, symbol):
+    return "candles", columns_of(records, ["date", "close", "sma50", "sma200"]), {
+        "type": "line", "x": "date", "series": ["close", "sma50", "sma200"], "title": f"Price history, {symbol}"
+    }
+
+BUILDERS = {
+    "getStockRecommendation": _recommendations,
+    "getCompanyEarnings": _earnings,
+    "getCompaniesEarnings": _earnings_many,
+    "getStockPrice": _quote,
+    "getStockPrices": _quotes,
+    "getStockData": _profile,
+    "getStockProfiles": _profiles,
+    "getCompanyNews": _news,
+    "getStockCandles": _candles,
+}
+
+def tool_payloads(messages):
+    """Payloads of every tool result since the latest human message, in call order"""
+    last_human = max((i for i, m in enumerate(messages) if isinstance(m, HumanMessage)), default=0)
+    turn = messages[last_human:]
+    call_args = {
+        call["id"]: call["args"]
+        for message in turn if isinstance(message, AIMessage)
+        for call in message.tool_calls
+    }
+
+    payloads = []
+    for message in turn:
+        if not isinstance(message, ToolMessage) or not message.artifact or message.name not in BUILDERS:
+            continue
+        args = call_args.get(message.tool_call_id, {})
+        symbol = args.get("symbol") or ", ".join(args.get("symbols") or [])
+        kind, columns, chart = BUILDERS[message.name](message.artifact, symbol)
+        payloads.append({"tool": message.name, "kind": kind, "symbol": symbol, "columns": columns, "chart": chart})
+    return payloads
@@ -0,0 +1,123 @@
+"""Compact, model-facing views of tool results.
+
+The LLM only sees what a projection keeps, serialized as minimal JSON or as a
+CSV-style table for lists of records. The raw Finnhub payload stays on the
+ToolMessage as its artifact, which is never sent to the model, so the client
+still gets every field.
+"""
+import datetime, functools, json, os
+
+from metrics import registry
+from news import estimate_tokens
+
+tool_output_tokens = registry.counter(
+    "finchat_tool_output_tokens_total",
+    "Approximate tokens of tool results as raw JSON and as sent to the LLM, by tool"
+)
+
+# Set TOOL_PROJECTION=0 to send the LLM raw JSON results, e.g. to compare prompt sizes
+ENABLED = os.getenv("TOOL_PROJECTION", "1") == "1"
+
+# How much history the model gets, the client's charts use the full artifact
+EARNINGS_QUARTERS = 4
+RECOMMENDATION_MONTHS = 6
+
+PROFILE_FIELDS = ("name", "ticker", "exchange", "finnhubIndustry", "country", "currency",
+                  "marketCapitalization", "shareOutstanding", "ipo")
+QUOTE_FIELDS = ("c", "d", "dp", "h", "l", "o", "pc")
+EARNINGS_FIELDS = ("period", "actual", "estimate", "surprisePercent")
+RECOMMENDATION_FIELDS = ("period", "strongBuy", "buy", "hold", "sell", "strongSell")
+
+NO_DATA = '{"error":"No data available"}'
+
+def _value(value):
+    """Round floats to 4 decimals without trailing zeros"""
+    if isinstance(value, float):
+        return float(f"{value:.4f}")
+    return value
+
+def _cell(value):
+    if value is None:
+        return ""
+    text = str(_value(value))
+    return f'"{text}"' if "," in text or '"' in text else text
+
+def compact_json(value):
+    return json.dumps(value, separators=(",", ":"), ensure_ascii=False, default=str)
+
+def table(records, columns):
+    """Records as a header line plus one comma-separated line per record"""
+    lines = [",".join(columns)]
+    lines += [",".join(_cell(record.get(column)) for column in columns) for record in records]
+    return "\n".join(lines)
+
+def _profile(profile):
+    return {k: _value(profile[k]) for k in PROFILE_FIELDS if profile.get(k) not in (None, "")}
+
+def _quote(quote):
+    record = {k: _value(quote.get(k)) for k in QUOTE_FIELDS}
+    if quote.get("t"):
+        record["t"] = datetime.datetime.fromtimestamp(quote["t"], datetime.timezone.utc).strftime("%Y-%m-%dT%H:%MZ")
+    return record
+
+def _latest(records, limit):
+    return sorted(records, key=lambda r: r.get("period") or "", reverse=True)[:limit]
+
+def project_profile(profile):
+    return compact_json(_profile(profile)) if profile else NO_DATA
+
+def project_quote(quote):
+    return compact_json(_quote(quote)) if quote else NO_DATA
+
+def project_earnings(reports):
+    return table(_latest(reports, EARNINGS_QUARTERS), EARNINGS_FIELDS) if reports else NO_DATA
+
+def project_recommendations(trends):
+    return table(_latest(trends, RECOMMENDATION_MONTHS), RECOMMENDATION_FIELDS) if trends else NO_DATA
+
+def project_quotes(quotes):
+    """Quotes of several symbols as one table, symbols without data listed as missing"""
+    rows = [{"symbol": symbol, **_quote(quote)} for symbol, quote in quotes.items() if quote]
+    missing = [symbol for symbol, quote in quotes.items() if not quote]
+    text = table(rows, ("symbol", *QUOTE_FIELDS, "t"))
+    return text + (f"\nno data: {' '.join(missing)}" if missing else "")
+
+def project_profiles(profiles):
+    return compact_json({symbol: _profile(profile) if profile else None for symbol, profile in profiles.items()})
+
+def project_earnings_many(reports):
+    rows = [
+        {"symbol": symbol, **report}
+        for symbol, symbol_reports in reports.items()
+        for report in _latest(symbol_reports or [], EARNINGS_QUARTERS)
+    ]
+    missing = [symbol for symbol, symbol_reports in reports.items() if not symbol_reports]
+    text = table(rows, ("symbol", *EARNINGS_FIELDS))
+    return text + (f"\nno data: {' '.join(missing)}" if missing else "")
+
+def record_tokens(tool_name, raw, projected):
+    """Count a result's tokens as raw JSON (what the tool used to return) and as projected"""
+    tool_output_tokens.inc(estimate_tokens(raw if isinstance(raw, str) else json.dumps(raw, ensure_ascii=False, default=str)),
+                           tool=tool_name, form="raw")
+    tool_output_tokens.inc(estimate_tokens(projected), tool=tool_name, form="projected")
+
+def projected(projection):
+    """Make a tool return (projection of its result, raw result), for `response_format="content_and_artifact"`"""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            raw = fn(*args, **kwargs)
+            content = projection(raw) if ENABLED else json.dumps(raw, ensure_ascii=False, default=str)
+            record_tokens(fn.__name__, raw, content)
+            return content, raw
+        return wrapper
+    return decorator
+
+def token_report():
+    """Raw and projected tokens per tool so far, with the share saved"""
+    report = {}
+    for _, labels, value in tool_output_tokens.samples():
+        report.setdefault(labels["tool"], {"raw": 0, "projected": 0})[labels["form"]] += value
+    for counts in report.values():
+        counts["saved"] = 1 - counts["projected"] / counts["raw"] if counts["raw"] else 0.0
+    return report
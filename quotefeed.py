@@ -0,0 +1,237 @@
+"""Live prices of the most requested symbols from Finnhub's websocket trades feed.
+
+Every price lookup counts towards its symbol's request frequency. A
+background thread keeps one websocket connection subscribed to the
+`max_symbols` most frequently requested symbols (least-frequently-used
+eviction, with counts halved every `decay_interval` seconds so interest
+fades), seeds each new subscription with one REST quote and then updates
+its last price, day range and change from every trade. Lookups of
+subscribed symbols are a dictionary read; everything else returns None so
+the caller falls back to REST.
+
+Requires the `websockets` package.
+"""
+import asyncio, datetime, json, threading, time
+from zoneinfo import ZoneInfo
+
+from metrics import registry
+
+quote_feed_lookups = registry.counter("finchat_quote_feed_lookups_total", "Price lookups by result: hit (live feed) or miss (REST)")
+quote_feed_trades = registry.counter("finchat_quote_feed_trades_total", "Trades received from the quote feed")
+quote_feed_subscribed = registry.gauge("finchat_quote_feed_subscribed", "Symbols the quote feed is subscribed to")
+quote_feed_connected = registry.gauge("finchat_quote_feed_connected", "1 while the quote feed's websocket is connected")
+
+MARKET_TIMEZONE = ZoneInfo("America/New_York")
+KEEP_BONUS = 1.25  # How much more often a symbol must be requested to displace a subscribed one
+
+def trading_day(timestamp):
+    """Exchange calendar date of a Unix timestamp"""
+    return datetime.datetime.fromtimestamp(timestamp, MARKET_TIMEZONE).date()
+
+def apply_trade(quote, price, timestamp):
+    """A Finnhub-style quote moved on by one trade, starting a new day range on a new trading day"""
+    if trading_day(timestamp) != trading_day(quote["t"]):
+        quote = {**quote, "o": price, "h": price, "l": price, "pc": quote["c"]}
+    change = price - quote["pc"]
+    return {
+        **quote,
+        "c": price,
+        "h": max(quote["h"], price),
+        "l": min(quote["l"], price),
+        "d": round(change, 4),
+        "dp": round(change / quote["pc"] * 100, 4) if quote["pc"] else None,
+        "t": int(timestamp),
+    }
+
+class RequestFrequency:
+    """Decaying request counts per symbol, the basis of least-frequently-used eviction"""
+
+    def __init__(self, max_tracked=10_000):
+        self.max_tracked = max_tracked
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def record(self, symbol):
+        with self._lock:
+            count = self._counts[symbol] = self._counts.get(symbol, 0.0) + 1.0
+        return count
+
+    def count(self, symbol):
+        return self._counts.get(symbol, 0.0)
+
+    def decay(self, factor=0.5, floor=0.25):
+        """Scale every count by `factor`, forgetting symbols that fall below `floor`"""
+        with self._lock:
+            self._counts = {s: c * factor for s, c in self._counts.items() if c * factor >= floor}
+            if len(self._counts) > self.max_tracked:
+                self._counts = dict(sorted(self._counts.items(), key=lambda item: -item[1])[:self.max_tracked])
+
+    def top(self, n, min_count=1.0, keep=(), keep_bonus=KEEP_BONUS):
+        """The `n` most requested symbols, with symbols in `keep` boosted so near-ties do not churn"""
+        with self._lock:
+            scored = [(c * keep_bonus if s in keep else c, s) for s, c in self._counts.items() if c >= min_count]
+        return {s for _, s in sorted(scored, reverse=True)[:n]}
+
+class QuoteFeed:
+    """Prices of hot symbols kept current by one websocket connection, started on the first lookup.
+
+    Args:
+        url (str): Websocket URL including the API token, e.g. "wss://ws.finnhub.io?token=..."
+        seed (callable): seed(symbol) returning a Finnhub REST quote, called once per new subscription
+        max_symbols (int): Most symbols subscribed at once, the plan's per-connection limit
+        min_requests (float): Decayed request count a symbol needs before it is subscribed
+        rebalance_interval (float): Seconds between updates of the subscription set
+        decay_interval (float): Seconds after which request counts are halved
+    """
+
+    def __init__(self, url, seed, max_symbols=50, min_requests=2.0, rebalance_interval=10.0, decay_interval=600.0):
+        self.url = url
+        self.seed = seed
+        self.max_symbols = max_symbols
+        self.min_requests = min_requests
+        self.rebalance_interval = rebalance_interval
+        self.decay_interval = decay_interval
+        self.frequency = RequestFrequency()
+        self._quotes = {}  # Symbol to its latest quote, replaced whole on every trade
+        self._live = set()  # Subscribed and seeded symbols whose quotes can be served
+        self._subscribed = set()
+        self._admit_at = min_requests
+        self._thread = None
+        self._loop = None
+        self._wake = None
+        self._stopped = None
+        self._stopping = False
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._stopping = False
+            self._thread = threading.Thread(target=lambda: asyncio.run(self._run()), name="quote-feed", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=5.0):
+        """Close the connection and end the background thread"""
+        self._stopping = True
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._stopped.set)
+            self._loop.call_soon_threadsafe(self._wake.set)
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def lookup(self, symbol):
+        """The live quote of `symbol` as Finnhub's REST API would return it, None if it is not subscribed"""
+        symbol = symbol.strip().upper()
+        count = self.frequency.record(symbol)
+        if self._thread is None:
+            self.start()
+        quote = self._quotes.get(symbol) if symbol in self._live else None
+        if quote is not None:
+            quote_feed_lookups.inc(result="hit")
+            return dict(quote)
+        quote_feed_lookups.inc(result="miss")
+        # A symbol that just became hot is subscribed now instead of at the next rebalance
+        if count >= self._admit_at and symbol not in self._subscribed and self._loop is not None:
+            self._loop.call_soon_threadsafe(self._wake.set)
+        return None
+
+    def live_symbols(self):
+        return set(self._live)
+
+    async def _run(self):
+        try:
+            import websockets
+        except ImportError:
+            print("The quote feed needs the websockets package, prices come from REST only")
+            return
+
+        self._loop = asyncio.get_running_loop()
+        self._wake = asyncio.Event()
+        self._stopped = asyncio.Event()
+        backoff = 1.0
+        while not self._stopping:
+            try:
+                async with websockets.connect(self.url, open_timeout=10, ping_interval=20) as ws:
+                    backoff = 1.0
+                    quote_feed_connected.set(1)
+                    manager = asyncio.create_task(self._manage(ws))
+                    try:
+                        async for raw in ws:
+                            self._handle(raw)
+                    finally:
+                        manager.cancel()
+            except Exception as e:
+                if not self._stopping:
+                    print(f"Quote feed connection failed: {e}")
+            finally:
+                # Trades may be missed until the next connection, so nothing is served from the table meanwhile
+                quote_feed_connected.set(0)
+                self._live.clear()
+                self._subscribed.clear()
+                quote_feed_subscribed.set(0)
+            if not self._stopping:
+                try:
+                    await asyncio.wait_for(self._stopped.wait(), backoff)
+                except asyncio.TimeoutError:
+                    pass
+                backoff = min(backoff * 2, 60.0)
+
+    async def _manage(self, ws):
+        """Rebalance the subscriptions periodically or when woken, decaying request counts as time passes"""
+        decayed_at = time.monotonic()
+        while not self._stopping:
+            if time.monotonic() - decayed_at >= self.decay_interval:
+                self.frequency.decay()
+                decayed_at = time.monotonic()
+            try:
+                await self._rebalance(ws)
+            except Exception as e:
+                print(f"Error updating quote feed subscriptions: {e}")
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.rebalance_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+        await ws.close()
+
+    async def _rebalance(self, ws):
+        wanted = self.frequency.top(self.max_symbols, min_count=self.min_requests, keep=self._subscribed)
+        for symbol in self._subscribed - wanted:
+            await ws.send(json.dumps({"type": "unsubscribe", "symbol": symbol}))
+            self._subscribed.discard(symbol)
+            self._live.discard(symbol)
+            self._quotes.pop(symbol, None)
+        added = wanted - self._subscribed
+        for symbol in added:
+            await ws.send(json.dumps({"type": "subscribe", "symbol": symbol}))
+            self._subscribed.add(symbol)
+        quote_feed_subscribed.set(len(self._subscribed))
+        # Trades only carry the price, the day's open, range and previous close come from one REST quote
+        loop = asyncio.get_running_loop()
+        seeded = await asyncio.gather(*(loop.run_in_executor(None, self.seed, s) for s in added), return_exceptions=True)
+        for symbol, quote in zip(added, seeded):
+            if isinstance(quote, Exception) or not quote or not quote.get("t"):
+                print(f"Error seeding live quote for {symbol}: {quote}")
+                continue
+            if symbol in self._subscribed:
+                self._quotes[symbol] = quote
+                self._live.add(symbol)
+        # Count a cold symbol needs to displace the least requested subscription
+        full = len(self._subscribed) >= self.max_symbols
+        self._admit_at = max(
+            min(self.frequency.count(s) for s in self._subscribed) * KEEP_BONUS if full else 0.0, self.min_requests
+        )
+
+    def _handle(self, raw):
+        message = json.loads(raw)
+        if message.get("type") != "trade":
+            return  # Pings and errors
+        for trade in message.get("data") or ():
+            symbol = trade.get("s")
+            quote = self._quotes.get(symbol)
+            quote_feed_trades.inc()
+            if quote is None or trade.get("p") is None:
+                continue
+            self._quotes[symbol] = apply_trade(quote, trade["p"], trade["t"] / 1000)
@@ -0,0 +1,41 @@
+import threading, time
+
+from metrics import registry
+
+rate_limit_wait = registry.histogram(
+    "finchat_rate_limit_wait_seconds",
+    "Time spent waiting for the upstream rate limiter"
+)
+
+class TokenBucket:
+    """Thread-safe token bucket shared by every caller of an upstream API.
+
+    Tokens refill at `rate` per second up to `capacity`, so short bursts are
+    allowed while the long-run call rate matches the plan's limit.
+    """
+
+    def __init__(self, rate, capacity, name="finnhub"):
+        self.rate = rate
+        self.capacity = capacity
+        self.name = name
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self):
+        """Block until a token is available and take it"""
+        start = time.monotonic()
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    rate_limit_wait.observe(now - start, upstream=self.name)
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
@@ -0,0 +1,145 @@
+import datetime, re
+
+# Common company names users type instead of tickers
+COMPANY_SYMBOLS = {
+    "apple": "AAPL", "microsoft": "MSFT", "nvidia": "NVDA", "tesla": "TSLA", "amazon": "AMZN",
+    "google": "GOOGL", "alphabet": "GOOGL", "meta": "META", "facebook": "META", "netflix": "NFLX",
+    "amd": "AMD", "intel": "INTC", "broadcom": "AVGO", "oracle": "ORCL", "salesforce": "CRM",
+    "adobe": "ADBE", "ibm": "IBM", "qualcomm": "QCOM", "cisco": "CSCO", "paypal": "PYPL",
+    "uber": "UBER", "airbnb": "ABNB", "shopify": "SHOP", "spotify": "SPOT", "disney": "DIS",
+    "nike": "NKE", "starbucks": "SBUX", "mcdonalds": "MCD", "coca-cola": "KO", "pepsi": "PEP",
+    "walmart": "WMT", "costco": "COST", "boeing": "BA", "visa": "V", "mastercard": "MA",
+    "jpmorgan": "JPM", "goldman": "GS", "berkshire": "BRK.B", "exxon": "XOM", "chevron": "CVX",
+    "pfizer": "PFE", "moderna": "MRNA", "palantir": "PLTR", "coinbase": "COIN",
+}
+
+# The fast path only answers prompts that are, as a whole, one of these templates around one subject
+SUBJECT = r"(?P<subject>\$?[a-z][a-z\-]*(?:\.[a-z])?)"
+PRICE_TEMPLATES = [
+    re.compile(rf"(?:what(?:'s|s| is) )?(?:the )?(?:current |latest )?(?:stock |share )?(?:price|quote) (?:of|for) {SUBJECT}(?: stock)?",
+               re.IGNORECASE),
+    re.compile(rf"{SUBJECT} (?:stock |share )?(?:price|quote)", re.IGNORECASE),
+    re.compile(rf"how much is {SUBJECT} (?:stock|trading at)", re.IGNORECASE),
+]
+PROFILE_TEMPLATES = [
+    re.compile(rf"tell me about {SUBJECT}(?: stock)?", re.IGNORECASE),
+    re.compile(rf"what does {SUBJECT} do", re.IGNORECASE),
+    re.compile(rf"(?:company )?(?:profile|info) (?:of|for) {SUBJECT}", re.IGNORECASE),
+]
+TICKER_PATTERN = re.compile(r"\$?\b[A-Z]{1,5}(?:\.[A-Z])?\b")
+NAME_PATTERN = re.compile(r"[a-z][a-z\-]*")
+# Upper-case words that are abbreviations far more often than tickers, even where a listing has the symbol
+NOT_TICKERS = {
+    "I", "A", "AM", "PM", "CEO", "CFO", "CFP", "ETF", "EPS", "USD", "IPO", "US", "OK", "AI", "IRA", "HSA", "FSA", "GDP",
+    "CPI", "ROI", "APR", "APY", "CD", "CDS", "FED", "SEC", "FAQ", "PE", "EV", "LLC", "REIT", "YTD", "ATH", "DCA", "FIRE",
+}
+# Names in COMPANY_SYMBOLS that are also everyday words, never enough on their own to answer without the LLM
+EVERYDAY_NAMES = {"apple", "amazon", "visa", "meta", "oracle", "intel", "uber"}
+KNOWN_TICKERS = set(COMPANY_SYMBOLS.values())
+
+# Set by llm.py to a symbols.SymbolCatalog, which resolves company names beyond COMPANY_SYMBOLS
+symbol_catalog = None
+
+def name_mentions(prompt):
+    """(name, symbol) pairs of companies a prompt mentions by name instead of ticker"""
+    mentions = []
+    words = NAME_PATTERN.findall(prompt.lower())
+    for word in words:
+        symbol = COMPANY_SYMBOLS.get(word)
+        if symbol and all(symbol != s for _, s in mentions):
+            mentions.append((word, symbol))
+    if symbol_catalog is not None:
+        # Names already known above are left out, so "meta" cannot also match another "Meta ..." listing
+        rest = " ".join(word for word in prompt.lower().split() if word.strip("?!.,;:") not in COMPANY_SYMBOLS)
+        for entry in symbol_catalog.index.mentions(rest):
+            if all(entry["symbol"] != s for _, s in mentions):
+                mentions.append((entry["name"], entry["symbol"]))
+    return mentions
+
+def find_symbols(prompt):
+    """Ticker symbols mentioned in a prompt, from upper-case tickers and company names"""
+    symbols = []
+    for token in TICKER_PATTERN.findall(prompt):
+        symbol = token.lstrip("$")
+        if symbol not in NOT_TICKERS and symbol not in symbols:
+            symbols.append(symbol)
+    for _, symbol in name_mentions(prompt):
+        if symbol not in symbols:
+            symbols.append(symbol)
+    return symbols
+
+def confirmed_symbol(subject):
+    """The ticker a template's subject certainly means, or None.
+
+    "$TSLA" always counts. An upper-case word counts if it is a known ticker or,
+    once the symbol index is loaded, a listed one. A lower-case word counts if
+    it is a company name in COMPANY_SYMBOLS that is not also an everyday word.
+    """
+    if subject.startswith("$"):
+        symbol = subject[1:].upper()
+        return symbol if TICKER_PATTERN.fullmatch(symbol) else None
+    if subject.isupper():
+        if subject in NOT_TICKERS or not TICKER_PATTERN.fullmatch(subject):
+            return None
+        if subject in KNOWN_TICKERS:
+            return subject
+        index = symbol_catalog.index if symbol_catalog is not None else None
+        return subject if index is not None and subject in index.by_symbol else None
+    name = subject.lower()
+    return None if name in EVERYDAY_NAMES else COMPANY_SYMBOLS.get(name)
+
+def classify(prompt):
+    """Detect a simple, single-intent question about one ticker.
+
+    Returns:
+        tuple: ("price" or "profile", symbol) when the whole prompt is one of the price
+        or profile templates about a confirmed ticker, otherwise None
+    """
+    if not isinstance(prompt, str):
+        return None
+    text = " ".join(prompt.replace("’", "'").split()).rstrip("?!. ")
+    for intent, templates in (("price", PRICE_TEMPLATES), ("profile", PROFILE_TEMPLATES)):
+        for template in templates:
+            match = template.fullmatch(text)
+            if match:
+                symbol = confirmed_symbol(match.group("subject"))
+                return (intent, symbol) if symbol else None
+    return None
+
+def render_price(symbol, quote):
+    """Markdown answer for a getStockPrice result, or None if the quote is empty"""
+    if not quote or not quote.get("c"):
+        return None
+    change = quote.get("d") or 0
+    arrow = "🔺" if change >= 0 else "🔻"
+    updated = datetime.datetime.fromtimestamp(quote.get("t") or 0, datetime.timezone.utc).strftime("%Y-%m-%d %H:%M UTC")
+    return (
+        f"## {symbol} is trading at **${quote['c']:,.2f}**\n\n"
+        f"- **Change:** {arrow} {change:+,.2f} ({(quote.get('dp') or 0):+.2f}%)\n"
+        f"- **Day range:** ${quote.get('l', 0):,.2f} – ${quote.get('h', 0):,.2f}\n"
+        f"- **Open:** ${quote.get('o', 0):,.2f}\n"
+        f"- **Previous close:** ${quote.get('pc', 0):,.2f}\n\n"
+        f"*Last updated {updated}. This is market data, not financial advice.*"
+    )
+
+def render_profile(symbol, profile):
+    """Markdown answer for a getStockData result, or None if the profile is empty"""
+    if not profile or not profile.get("name"):
+        return None
+    lines = [f"## {profile['name']} ({profile.get('ticker', symbol)})", ""]
+    if profile.get("finnhubIndustry"):
+        lines.append(f"- **Industry:** {profile['finnhubIndustry']}")
+    if profile.get("exchange"):
+        lines.append(f"- **Exchange:** {profile['exchange']}")
+    if profile.get("country"):
+        lines.append(f"- **Country:** {profile['country']}")
+    if profile.get("marketCapitalization"):
+        # Finnhub reports market capitalization in millions
+        lines.append(f"- **Market cap:** ${profile['marketCapitalization'] / 1000:,.1f}B {profile.get('currency', '')}".rstrip())
+    if profile.get("ipo"):
+        lines.append(f"- **IPO:** {profile['ipo']}")
+    if profile.get("weburl"):
+        lines.append(f"- **Website:** [{profile['weburl']}]({profile['weburl']})")
+    lines.append("")
+    lines.append("*Ask a follow-up question for analysis, news or earnings.*")
+    return "\n".join(lines)
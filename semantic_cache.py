@@ -0,0 +1,123 @@
+import re, threading, time, zlib
+
+import numpy as np
+
+from metrics import registry
+
+semantic_cache_requests = registry.counter("finchat_semantic_cache_requests_total", "Response cache lookups by result (hit or miss)")
+semantic_cache_lookup = registry.histogram(
+    "finchat_semantic_cache_lookup_seconds",
+    "Time to embed a prompt and search the response cache",
+    buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1)
+)
+
+WORD_PATTERN = re.compile(r"[a-z0-9/$.%]+")
+NUMBER_PATTERN = re.compile(r"\d+(?:[.,/]\d+)*")
+# Filler words that change between paraphrases without changing the question
+FILLER_WORDS = {
+    "a", "an", "the", "please", "can", "could", "would", "you", "me", "i", "to", "is", "are",
+    "what", "whats", "tell", "about", "explain", "describe", "give", "some", "do", "does", "my",
+}
+
+def numbers_of(text):
+    """Numbers in a text, such as ages, amounts and "50/30/20", without thousands separators"""
+    return frozenset(n.replace(",", "") for n in NUMBER_PATTERN.findall(text))
+
+class HashingEmbedder:
+    """Local, dependency-free text embedding from hashed word unigrams, bigrams and character trigrams.
+
+    Anything with the same `embed(texts) -> np.ndarray` interface, such as a
+    sentence-transformers model, can be used instead.
+    """
+
+    def __init__(self, dim=512):
+        self.dim = dim
+
+    def _features(self, text):
+        words = [w.strip(".") for w in WORD_PATTERN.findall(text.lower())]
+        words = [w for w in words if w and w not in FILLER_WORDS]
+        features = list(words)
+        features += [f"{a} {b}" for a, b in zip(words, words[1:])]
+        joined = " ".join(words)
+        features += [joined[i:i + 3] for i in range(len(joined) - 2)]
+        return features
+
+    def embed(self, texts):
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature in self._features(text):
+                h = zlib.crc32(feature.encode("utf-8"))
+                # Signed hashing keeps unrelated features from adding up
+                vectors[row, h % self.dim] += 1.0 if h & 0x80000000 else -1.0
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-9)
+
+class SemanticCache:
+    """Cache of answers keyed by prompt embedding, matched by cosine similarity.
+
+    A lookup returns the answer of the most similar stored prompt if its
+    similarity is at least `threshold`, it has not expired and both prompts
+    mention the same ticker symbols and numbers ("retirement at 25" is not
+    "retirement at 45", however similar the words). When full, expired entries are dropped
+    first, then the least recently used one.
+    """
+
+    def __init__(self, embedder=None, threshold=0.96, max_entries=1000, ttl=24 * 60 * 60, symbols_of=None):
+        self.embedder = embedder if embedder is not None else HashingEmbedder()
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.symbols_of = symbols_of or (lambda text: frozenset())
+        self._vectors = None
+        self._entries = []  # [answer, symbols, numbers, expires_at, last_used] per row of _vectors
+        self._lock = threading.Lock()
+
+    def lookup(self, prompt):
+        """Cached answer for a near-duplicate of `prompt`, or None"""
+        start = time.perf_counter()
+        query = self.embedder.embed([prompt])[0]
+        symbols = frozenset(self.symbols_of(prompt))
+        numbers = numbers_of(prompt)
+        answer = None
+        with self._lock:
+            if self._entries:
+                similarities = self._vectors[:len(self._entries)] @ query
+                best = int(np.argmax(similarities))
+                entry = self._entries[best]
+                now = time.monotonic()
+                if similarities[best] >= self.threshold and entry[3] > now and entry[1] == symbols and entry[2] == numbers:
+                    entry[4] = now
+                    answer = entry[0]
+        semantic_cache_requests.inc(result="hit" if answer is not None else "miss")
+        semantic_cache_lookup.observe(time.perf_counter() - start)
+        return answer
+
+    def store(self, prompt, answer, ttl=None):
+        """Remember `answer` for `prompt` for `ttl` seconds (the cache default if None)"""
+        ttl = self.ttl if ttl is None else ttl
+        if ttl <= 0:
+            return
+        vector = self.embedder.embed([prompt])[0]
+        now = time.monotonic()
+        entry = [answer, frozenset(self.symbols_of(prompt)), numbers_of(prompt), now + ttl, now]
+        with self._lock:
+            if self._vectors is None:
+                self._vectors = np.zeros((self.max_entries, len(vector)), dtype=np.float32)
+            if len(self._entries) < self.max_entries:
+                row = len(self._entries)
+                self._entries.append(entry)
+            else:
+                expired = [i for i, e in enumerate(self._entries) if e[3] <= now]
+                row = expired[0] if expired else min(range(len(self._entries)), key=lambda i: self._entries[i][4])
+                self._entries[row] = entry
+            self._vectors[row] = vector
+
+    def clear(self):
+        with self._lock:
+            self._entries = []
+
+    def stats(self):
+        hits = semantic_cache_requests.value(result="hit")
+        misses = semantic_cache_requests.value(result="miss")
+        total = hits + misses
+        return {"entries": len(self._entries), "hits": hits, "misses": misses, "hit_rate": hits / total if total else 0.0}
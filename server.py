@@ -1,54 +1,152 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
 from pydantic import BaseModel
-from llm import create_graph  # Import create_graph instead of graph
+from typing import Optional
+from contextlib import asynccontextmanager
+from llm import get_graph, checkpointer, run_config, replay_tool_messages, warm_up
+from batch import BatchJobs, expand, run_batch
+from cache import snapshot
+from coalesce import Coalescer, normalize_prompt
 from langchain_core.messages import HumanMessage, ToolMessage
-import uuid
+from metrics import registry
+from payloads import tool_payloads
+from tracing import span, trace_request
+import asyncio, json, os, time, uuid
 
-app = FastAPI()
+# Outcome of the start-up warm-up that /readyz reports
+startup = {"status": "warming", "error": None, "seconds": None, "steps": {}}
+startup_seconds = registry.gauge("finchat_startup_warmup_seconds", "Seconds the start-up warm-up took, by step (total until /readyz passed)")
+
+async def prewarm():
+    start = time.perf_counter()
+    try:
+        startup["steps"] = await warm_up()
+        startup["status"] = "ready"
+    except Exception as e:
+        print(f"Error warming up the server: {e}")
+        startup["status"], startup["error"] = "failed", str(e)
+    startup["seconds"] = round(time.perf_counter() - start, 3)
+    for step, seconds in startup["steps"].items():
+        startup_seconds.set(seconds, step=step)
+    startup_seconds.set(startup["seconds"], step="total")
+
+@asynccontextmanager
+async def lifespan(app):
+    # Warm up in the background, so the process answers /healthz at once and /readyz once it is warm
+    task = asyncio.create_task(prewarm())
+    yield
+    task.cancel()
+
+app = FastAPI(lifespan=lifespan)
+
+# Concurrency limits for the chat path, requests beyond the queue depth get a 429
+MAX_CONCURRENT_CHATS = int(os.getenv("MAX_CONCURRENT_CHATS", "32"))
+MAX_QUEUED_CHATS = int(os.getenv("MAX_QUEUED_CHATS", "128"))
+
+chat_in_flight = registry.gauge("finchat_chat_in_flight", "Chat requests currently running the graph")
+chat_queued = registry.gauge("finchat_chat_queued", "Chat requests waiting for a free slot")
+chat_rejected = registry.counter("finchat_chat_rejected_total", "Chat requests rejected because the queue was full")
+chat_queue_wait = registry.histogram("finchat_chat_queue_wait_seconds", "Time spent waiting for a free chat slot")
+chat_latency = registry.histogram("finchat_chat_latency_seconds", "End-to-end chat request latency")
+
+class ChatLimiter:
+    """Bound the number of concurrent graph runs and the number of requests waiting for one"""
+
+    def __init__(self, max_concurrent, max_queued):
+        self.max_concurrent = max_concurrent
+        self.max_queued = max_queued
+        self.waiting = 0
+        self._semaphore = None
+
+    async def acquire(self):
+        """Wait for a free slot, raising a 429 when too many requests are already waiting"""
+        # Created lazily so the semaphore binds to the running event loop
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrent)
+        if self._semaphore.locked() and self.waiting >= self.max_queued:
+            chat_rejected.inc()
+            raise HTTPException(status_code=429, detail="Server busy, try again shortly", headers={"Retry-After": "1"})
+
+        self.waiting += 1
+        chat_queued.inc()
+        start = time.perf_counter()
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+            chat_queued.dec()
+        chat_queue_wait.observe(time.perf_counter() - start)
+        chat_in_flight.inc()
+
+    def release(self):
+        chat_in_flight.dec()
+        self._semaphore.release()
+
+chat_limiter = ChatLimiter(MAX_CONCURRENT_CHATS, MAX_QUEUED_CHATS)
+
+# Items of one batch answered at the same time, and the most items a batch may hold
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "8"))
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "1000"))
+
+batch_jobs = BatchJobs(ttl=float(os.getenv("BATCH_JOB_TTL_SECONDS", "3600")))
+
+# Identical first prompts arriving within this many seconds of each other share one graph run, 0 turns it off
+coalescer = Coalescer(window=float(os.getenv("COALESCE_WINDOW_SECONDS", "5")))
 
 # Define the request body model using Pydantic
 class PromptReq(BaseModel):
     prompt: str
+    session_id: Optional[str] = None  # Continue an earlier conversation, a one-off thread if missing
+
+class BatchReq(BaseModel):
+    prompts: list[str] = []
+    template: Optional[str] = None  # Prompt with a {symbol} field, asked once per symbol
+    symbols: list[str] = []
+    concurrency: Optional[int] = None  # At most BATCH_CONCURRENCY
 
-# Store graph instances - create a new instance for each thread
-graph_instances = {}
+class ResetReq(BaseModel):
+    session_id: Optional[str] = None  # Reset one conversation, all of them if missing
 
 @app.get("/")
 async def get():
     return {"message": "Hello, World!"}
 
 @app.post("/reset")
-async def reset_state():
-    """Reset the graph state completely"""
-    global graph_instances
-    graph_instances = {}  # Clear all graph instances
+async def reset_state(request: Optional[ResetReq] = None):
+    """Reset one session's graph state, or the graph state completely"""
+    if request is not None and request.session_id:
+        await checkpointer.adelete_thread(thread_config(request.session_id)["configurable"]["thread_id"])
+        return {"status": f"Session {request.session_id} reset successfully"}
+    await asyncio.to_thread(checkpointer.clear)  # Forget every conversation thread
     return {"status": "All graph states reset successfully"}
 
-@app.post("/")
-async def chat(request: PromptReq):
-    # Create a unique thread ID for each request
-    thread_id = f"thread-{uuid.uuid4()}"
-    config = {"configurable": {"thread_id": thread_id}}
-    
-    # Create a fresh graph for this request
-    graph = create_graph()
-    graph_instances[thread_id] = graph
-    
-    # Reset chart data and message ID for new request
-    messages = {"messages": [HumanMessage(request.prompt)]}
-    
-    # Get response from graph
-    output = graph.invoke(messages, config)
-    
-    # Find the ToolMessage in the messages list
+@app.get("/healthz")
+async def healthz():
+    """Liveness: the process is up and serving requests"""
+    return {"status": "ok"}
+
+@app.get("/readyz")
+async def readyz():
+    """Readiness: 200 once the LLM clients, graph and upstream connections are warm, 503 until then"""
+    return JSONResponse(startup, status_code=200 if startup["status"] == "ready" else 503)
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Expose server metrics in the Prometheus text format"""
+    return registry.render()
+
+def extract_tool_data(messages):
+    """Pick the tool payload, its type and the chart message ID from the latest turn's messages"""
     tool_message = None
     tool_type = None
     message_id = None
     
-    for msg in output["messages"]:
+    # Only look at the messages produced since the latest prompt
+    last_human = max((i for i, m in enumerate(messages) if isinstance(m, HumanMessage)), default=0)
+    for msg in messages[last_human:]:
         if isinstance(msg, ToolMessage):
-            if msg.name == "getStockRecommendation":
-                tool_message = msg.content
+            if msg.name in ("getStockRecommendation", "getStockCandles"):
+                tool_message = tool_payload(msg)
                 tool_type = "chart"
                 message_id = f"assistant-{uuid.uuid4()}"  # Generate unique ID
                 
@@ -57,14 +155,251 @@ async def chat(request: PromptReq):
                 tool_message = None
                 tool_type = "news"
             else:
-                tool_message = msg.content
+                tool_message = tool_payload(msg)
                 tool_type = "data"
             break
 
-    # Return response with tool data, type and message ID
+    return tool_message, tool_type, message_id
+
+def tool_payload(msg):
+    """The full tool result as JSON for the client: the artifact if the tool kept one, else the model-facing content"""
+    if msg.artifact is None:
+        return msg.content
+    return json.dumps(msg.artifact, ensure_ascii=False, default=str)
+
+def thread_config(session_id=None):
+    """Thread config for a session on the shared graph, or a one-off thread without one"""
+    thread_id = f"thread-{session_id or uuid.uuid4()}"
+    return run_config(thread_id)
+
+async def drop_one_off_thread(request, config):
+    """Delete the thread of a request without a session once its turn is done, so it never evicts a session's thread"""
+    if not request.session_id:
+        await checkpointer.adelete_thread(config["configurable"]["thread_id"])
+
+async def coalesce_key(request, config):
+    """Normalized prompt under which the request may share a graph run, None once its session has history"""
+    if not coalescer.enabled:
+        return None
+    if request.session_id:
+        state = await get_graph().aget_state(config)
+        if state.values.get("messages"):
+            return None
+    return normalize_prompt(request.prompt)
+
+async def take_flight(request, config, streaming=False):
+    """Join the graph run of an identical prompt, or lead a new one once a chat slot is free.
+
+    A `streaming` request needs token and tool events, so it only joins runs of other
+    streaming requests, and any later request may join the run it leads.
+    Returns the flight and whether this request leads it, i.e. still has to start it.
+    """
+    key = await coalesce_key(request, config)
+    flight = coalescer.join(key, streaming)
+    if flight is not None:
+        return flight, False
+    flight = coalescer.lead(key, streaming)
+    try:
+        with span("queue"):
+            await chat_limiter.acquire()
+    except HTTPException as e:
+        # Requests that joined meanwhile get the same 429
+        flight.fail(e)
+        raise
+    except BaseException:
+        # Cancelled while queued, the followers must not wait for a run that never starts
+        flight.cancel()
+        raise
+    return flight, True
+
+def turn_result(messages, thread_id):
+    """What every request sharing a turn needs: the response body and the turn's messages"""
+    last_human = max((i for i, m in enumerate(messages) if isinstance(m, HumanMessage)), default=0)
+    tool_message, tool_type, message_id = extract_tool_data(messages)
     return {
-        "message": output["messages"][-1].content,
-        "tool_data": tool_message,
-        "tool_type": tool_type,
-        "message_id": message_id  # Include message ID in response
-    }
\ No newline at end of file
+        "thread_id": thread_id,
+        "messages": messages[last_human + 1:],
+        "body": {
+            "message": messages[-1].content,
+            "tool_data": tool_message,
+            "tool_type": tool_type,
+            "message_id": message_id,
+            "tool_results": tool_payloads(messages),  # Every tool result, column-oriented
+        }
+    }
+
+async def finish_turn(request, config, turn):
+    """Response body of a shared turn for one request, adding the turn to its session if another thread ran it"""
+    thread_id = config["configurable"]["thread_id"]
+    if request.session_id and thread_id != turn["thread_id"]:
+        with span("coalesced_copy"):
+            copies = replay_tool_messages(turn["messages"])
+            await get_graph().aupdate_state(config, {"messages": [HumanMessage(request.prompt)] + copies}, as_node="home")
+            await checkpointer.aflush()
+    body = dict(turn["body"], session_id=request.session_id)
+    if body["message_id"] is not None:
+        body["message_id"] = f"assistant-{uuid.uuid4()}"  # Still unique per response
+    return body
+
+@app.post("/")
+async def chat(request: PromptReq):
+    config = thread_config(request.session_id)
+    
+    # Reset chart data and message ID for new request
+    messages = {"messages": [HumanMessage(request.prompt)]}
+
+    async def run(publish):
+        try:
+            with span("graph"):
+                output = await get_graph().ainvoke(messages, config)
+            if request.session_id:
+                # Make the new turn visible to every worker before answering
+                with span("checkpoint_flush"):
+                    await checkpointer.aflush()
+        finally:
+            chat_limiter.release()
+            await drop_one_off_thread(request, config)
+        with span("serialization"):
+            return turn_result(output["messages"], config["configurable"]["thread_id"])
+    
+    with trace_request("chat") as trace:
+        # Get response from graph, waiting for a free slot or an identical prompt's run first
+        start = time.perf_counter()
+        flight, leader = await take_flight(request, config)
+        if leader:
+            # The run times itself as "graph"
+            flight.start(run)
+            turn = await flight.result()
+        else:
+            with span("coalesced"):
+                turn = await flight.result()
+        chat_latency.observe(time.perf_counter() - start)
+        
+        with span("serialization"):
+            # Return response with tool data, type and message ID
+            body = json.dumps(await finish_turn(request, config, turn), ensure_ascii=False, default=str)
+
+    headers = {"Server-Timing": trace.server_timing(), "X-Trace-Id": trace.trace_id}
+    return Response(content=body, media_type="application/json", headers=headers)
+
+def batch_plan(request):
+    """Items and concurrency of a batch request, or a 400 if it is empty, too large or malformed"""
+    if request.template is not None and "{symbol}" not in request.template:
+        raise HTTPException(status_code=400, detail="The template needs a {symbol} field")
+    items = expand(request.prompts, request.template, request.symbols)
+    if not items:
+        raise HTTPException(status_code=400, detail="Give prompts, or a template and symbols")
+    if len(items) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"At most {BATCH_MAX_ITEMS} items per batch")
+    concurrency = min(request.concurrency or BATCH_CONCURRENCY, BATCH_CONCURRENCY)
+    return items, max(concurrency, 1)
+
+async def answer_batch_item(item):
+    """Answer one batch prompt on a one-off thread that is dropped afterwards"""
+    config = thread_config()
+    with trace_request("batch"):
+        with span("queue"):
+            await chat_limiter.acquire()
+        try:
+            with span("graph"):
+                output = await get_graph().ainvoke({"messages": [HumanMessage(item["prompt"])]}, config)
+        finally:
+            chat_limiter.release()
+            await checkpointer.adelete_thread(config["configurable"]["thread_id"])
+    return {"message": output["messages"][-1].content, "tool_results": tool_payloads(output["messages"])}
+
+async def batch_results(items, concurrency):
+    """Item events in the order the batch items finish"""
+    # Every item sees the same Finnhub data, and each lookup is made once per batch
+    with snapshot():
+        async for event in run_batch(items, answer_batch_item, concurrency):
+            yield event
+
+@app.post("/batch")
+async def batch(request: BatchReq):
+    """Answer many prompts, streaming one NDJSON event per item as it finishes, then a "done" event"""
+    items, concurrency = batch_plan(request)
+
+    async def events():
+        start = time.perf_counter()
+        failed = 0
+        async for event in batch_results(items, concurrency):
+            failed += "error" in event
+            yield ndjson(event)
+        yield ndjson({"type": "done", "items": len(items), "failed": failed, "seconds": round(time.perf_counter() - start, 3)})
+
+    return StreamingResponse(events(), media_type="application/x-ndjson")
+
+@app.post("/batch/jobs")
+async def start_batch_job(request: BatchReq):
+    """Run a batch in the background, poll GET /batch/jobs/{job_id} for its results"""
+    items, concurrency = batch_plan(request)
+    try:
+        job_id = batch_jobs.start(batch_results(items, concurrency), total=len(items))
+    except RuntimeError as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "60"})
+    return {"job_id": job_id, "items": len(items)}
+
+@app.get("/batch/jobs/{job_id}")
+async def get_batch_job(job_id: str, offset: int = 0):
+    """Status of a batch job and its item results from `offset` on, in the order they finished"""
+    job = batch_jobs.get(job_id, offset)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown batch job")
+    return job
+
+def ndjson(event):
+    return json.dumps(event, ensure_ascii=False, default=str) + "\n"
+
+@app.post("/stream")
+async def chat_stream(request: PromptReq):
+    """Stream the answer as NDJSON events: token, tool_start, tool_end, then final"""
+    config = thread_config(request.session_id)
+    messages = {"messages": [HumanMessage(request.prompt)]}
+
+    async def run(publish):
+        try:
+            with trace_request("stream"):
+                with span("graph"):
+                    async for event in get_graph().astream_events(messages, config, version="v2"):
+                        kind = event["event"]
+                        if kind == "on_chat_model_stream":
+                            content = event["data"]["chunk"].content
+                            if content:
+                                publish({"type": "token", "content": content})
+                        elif kind == "on_tool_start":
+                            publish({"type": "tool_start", "name": event["name"], "input": event["data"].get("input")})
+                        elif kind == "on_tool_end":
+                            publish({"type": "tool_end", "name": event["name"]})
+                if request.session_id:
+                    with span("checkpoint_flush"):
+                        await checkpointer.aflush()
+
+                with span("serialization"):
+                    state = await get_graph().aget_state(config)
+                    return turn_result(state.values["messages"], config["configurable"]["thread_id"])
+        finally:
+            chat_limiter.release()
+            await drop_one_off_thread(request, config)
+
+    # Take the slot before the response starts so a full queue still gets a 429. The run
+    # continues if this client leaves, requests sharing it still want the answer
+    flight, leader = await take_flight(request, config, streaming=True)
+    if leader:
+        flight.start(run)
+
+    async def events():
+        start = time.perf_counter()
+        try:
+            # Events from before a late subscriber joined are replayed first
+            async for event in flight.follow():
+                yield ndjson(event)
+            turn = await flight.result()
+            yield ndjson({"type": "final", **await finish_turn(request, config, turn)})
+        except Exception as e:
+            print(f"Error streaming response: {e}")
+            yield ndjson({"type": "error", "error": str(e)})
+        finally:
+            chat_latency.observe(time.perf_counter() - start)
+
+    return StreamingResponse(events(), media_type="application/x-ndjson")
@@ -0,0 +1,310 @@
+"""In-process index of ticker symbols and company names.
+
+Built from a Finnhub `stock_symbols` snapshot and saved as one compressed
+msgpack file, so a restart loads it in milliseconds instead of downloading
+the list again. Names are split into normalized tokens ("BERKSHIRE HATHAWAY
+INC-CL B" becomes berkshire, hathaway, b) held in a sorted vocabulary for
+prefix lookups, with a trigram index over the vocabulary for misspellings.
+"""
+import bisect, os, re, threading, time, zlib
+
+import ormsgpack
+
+from metrics import registry
+
+symbol_lookups = registry.counter("finchat_symbol_lookups_total", "Symbol index lookups by kind (search or mentions) and result (hit or miss)")
+
+FORMAT_VERSION = 1
+# Corporate suffixes and share-class markers that say nothing about which company is meant
+NAME_SUFFIXES = {
+    "inc", "incorporated", "corp", "corporation", "co", "company", "ltd", "limited", "plc", "llc", "lp", "sa",
+    "ag", "nv", "se", "the", "cl", "class", "com", "holdings", "hldgs", "holding", "group", "grp", "adr", "ads",
+}
+# Words common in prompts and company names alike ("target price", "general advice"), only resolved with the words
+# after them ("general motors")
+COMMON_WORDS = {
+    "what", "whats", "is", "are", "was", "the", "a", "an", "of", "for", "to", "in", "on", "at", "and", "or", "vs", "with",
+    "how", "much", "show", "tell", "me", "my", "i", "it", "its", "this", "that", "can", "do", "does", "should", "about",
+    "price", "prices", "stock", "stocks", "share", "shares", "quote", "news", "today", "current", "company", "market",
+    "earnings", "buy", "sell", "target", "best", "first", "general", "american", "national", "united", "global",
+    "international", "new", "one", "data", "real", "live", "trading", "value", "big", "up", "down", "high", "low",
+    "open", "close", "report", "analyst", "recommendation", "recommendations", "trends", "history", "performance",
+    "growth", "dividend", "rate", "rates", "fund", "funds", "etf", "index", "good", "great", "time", "energy",
+    "health", "bank", "capital", "financial", "power", "gold", "silver", "oil", "gas", "water", "home", "digital",
+    "smart", "next", "direct", "prime", "public", "summarize", "recent", "display", "give", "get", "latest",
+}
+# Everyday and personal-finance words that are also whole company names ("bitcoin", "avalanche"), never resolved
+# alone, and a span made only of these or COMMON_WORDS is never resolved at all ("emergency fund")
+SINGLE_WORD_STOPLIST = COMMON_WORDS | {
+    "bitcoin", "crypto", "ethereum", "coin", "coins", "avalanche", "snowball", "debt", "debts", "loan", "loans",
+    "mortgage", "credit", "card", "cards", "emergency", "savings", "saving", "budget", "budgeting", "retirement",
+    "pension", "income", "tax", "taxes", "roth", "ira", "bond", "bonds", "cash", "money", "interest", "inflation",
+    "insurance", "estate", "property", "rent", "house", "car", "college", "education", "student", "family", "kids",
+    "wealth", "rich", "safe", "safety", "risk", "return", "returns", "portfolio", "plan", "planning", "rule",
+    "strategy", "advice", "average", "averaging", "dollar", "cost", "costs", "compound", "account", "accounts",
+    "pay", "paying", "spend", "spending", "work", "job", "life", "future", "freedom", "simple", "easy", "why", "when",
+    "where", "which", "who", "will", "would", "could", "better", "versus", "explain", "help", "need",
+}
+PREFIX_LIMIT = 64  # Vocabulary tokens a prefix may expand to
+FUZZY_LIMIT = 3  # Close vocabulary tokens used for a misspelled word
+FUZZY_THRESHOLD = 0.3  # Trigram similarity a misspelling must reach
+
+WORD_PATTERN = re.compile(r"[a-z0-9]+")
+
+def normalize(text):
+    """Lower-case name tokens without punctuation or corporate suffixes"""
+    words = WORD_PATTERN.findall(text.lower().replace("'", "").replace("&", " and "))
+    return [w for w in words if w not in NAME_SUFFIXES]
+
+def _trigrams(token):
+    padded = f" {token} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+class SymbolIndex:
+    """Immutable lookup structures over one symbol list snapshot.
+
+    Args:
+        symbols (list): Ticker symbols
+        names (list): Company names, parallel to `symbols`
+        kinds (list): Security types such as "Common Stock", parallel to `symbols`
+        fetched_at (float): Unix time the snapshot was downloaded
+    """
+
+    def __init__(self, symbols, names, kinds, fetched_at=0.0, tokens=None, postings=None, starts=None):
+        self.symbols = symbols
+        self.names = names
+        self.kinds = kinds
+        self.fetched_at = fetched_at
+        self.tokens = tokens if tokens is not None else [" ".join(normalize(name)) for name in names]
+        if postings is None:
+            postings, starts = {}, {}
+            for i, joined in enumerate(self.tokens):
+                words = joined.split()
+                for word in dict.fromkeys(words):
+                    postings.setdefault(word, []).append(i)
+                if words:
+                    starts.setdefault(words[0], []).append(i)
+        # Entry IDs by name token, and by the first token of the name
+        self.postings = postings
+        self.starts = starts
+        # Lists sort common stock first, so a symbol listed twice resolves to its main line
+        self.by_symbol = {symbol: i for i, symbol in reversed(list(enumerate(symbols)))}
+        self.vocab = sorted(postings)
+        self._trigram_index = None
+        self._trigram_lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.symbols)
+
+    @classmethod
+    def from_finnhub(cls, records, fetched_at=None):
+        """Index of a Finnhub stock_symbols response, without entries lacking a symbol or name"""
+        records = [r for r in records or [] if r.get("symbol") and r.get("description")]
+        # Common stock sorts first so it wins ties between listings of the same company
+        records.sort(key=lambda r: (r.get("type") != "Common Stock", r["symbol"]))
+        return cls(
+            [r.get("displaySymbol") or r["symbol"] for r in records],
+            [r["description"] for r in records],
+            [r.get("type") or "" for r in records],
+            fetched_at=time.time() if fetched_at is None else fetched_at
+        )
+
+    def save(self, path):
+        """Write the snapshot and its token index as zlib-compressed msgpack, replacing the file atomically"""
+        data = zlib.compress(ormsgpack.packb({
+            "version": FORMAT_VERSION, "fetched_at": self.fetched_at,
+            "symbols": self.symbols, "names": self.names, "kinds": self.kinds, "tokens": self.tokens,
+            "postings": self.postings, "starts": self.starts,
+        }), 6)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        """Index saved by `save`, or None if the file is missing or from another format version"""
+        try:
+            with open(path, "rb") as f:
+                data = ormsgpack.unpackb(zlib.decompress(f.read()))
+        except FileNotFoundError:
+            return None
+        if data.get("version") != FORMAT_VERSION:
+            return None
+        # The token index is stored too, so loading is decoding rather than rebuilding
+        return cls(data["symbols"], data["names"], data["kinds"], fetched_at=data["fetched_at"], tokens=data["tokens"],
+                   postings=data["postings"], starts=data["starts"])
+
+    def _words(self, i):
+        return self.tokens[i].split()
+
+    def entry(self, i):
+        return {"symbol": self.symbols[i], "name": self.names[i], "type": self.kinds[i]}
+
+    def _fuzzy(self, word):
+        """Vocabulary tokens spelled like `word`, with their trigram similarity"""
+        with self._trigram_lock:
+            if self._trigram_index is None:
+                # Built on the first misspelling, most lookups never need it
+                index = {}
+                for t, token in enumerate(self.vocab):
+                    for gram in _trigrams(token):
+                        index.setdefault(gram, []).append(t)
+                self._trigram_index = index
+        grams = _trigrams(word)
+        shared = {}
+        for gram in grams:
+            for t in self._trigram_index.get(gram, ()):
+                shared[t] = shared.get(t, 0) + 1
+        scored = []
+        for t, count in shared.items():
+            similarity = count / (len(grams) + len(_trigrams(self.vocab[t])) - count)
+            if similarity >= FUZZY_THRESHOLD:
+                scored.append((similarity, self.vocab[t]))
+        return [(token, similarity) for similarity, token in sorted(scored, reverse=True)[:FUZZY_LIMIT]]
+
+    def _matches(self, word):
+        """Entry IDs matching one query word with a weight: 2 for the whole token, 1 for a prefix, less for a misspelling"""
+        weights = dict.fromkeys(self.postings.get(word, ()), 2.0)
+        if len(word) >= 2:
+            start = bisect.bisect_left(self.vocab, word)
+            for token in self.vocab[start:start + PREFIX_LIMIT]:
+                if not token.startswith(word):
+                    break
+                for i in self.postings[token]:
+                    weights.setdefault(i, 1.0)
+        if not weights and len(word) >= 3:
+            for token, similarity in self._fuzzy(word):
+                for i in self.postings[token]:
+                    weights[i] = max(weights.get(i, 0.0), similarity)
+        return weights
+
+    def search(self, query, limit=5):
+        """Best entries for a symbol, company name, name prefix or misspelled name"""
+        results = []
+        exact = self.by_symbol.get(query.strip().upper())
+        if exact is not None:
+            results.append(exact)
+
+        words = normalize(query)
+        if words:
+            per_word = [self._matches(word) for word in words]
+            # Entries matching every word, or failing that any word
+            common = set(per_word[0]).intersection(*per_word[1:])
+            candidates = common or set().union(*per_word)
+            scores = {i: sum(matches.get(i, 0.0) for matches in per_word) for i in candidates}
+            ranked = sorted(scores, key=lambda i: (
+                -scores[i], len(self._words(i)), self.kinds[i] != "Common Stock", len(self.symbols[i])
+            ))
+            results += [i for i in ranked[:limit + 1] if i != exact]
+
+        symbol_lookups.inc(kind="search", result="hit" if results else "miss")
+        return [self.entry(i) for i in results[:limit]]
+
+    def _resolve_span(self, span):
+        """The one entry whose name begins with all the words of a multi-word span, or is exactly a single word"""
+        if len(span) == 1:
+            # Share-class letters do not count, so "snowflake" is the full name of "SNOWFLAKE INC-CLASS A"
+            candidates = [i for i in self.starts.get(span[0], ()) if [w for w in self._words(i) if len(w) > 1] == span]
+        else:
+            candidates = [i for i in self.starts.get(span[0], ()) if self._words(i)[:len(span)] == span]
+        if len(candidates) == 1:
+            return candidates[0]
+        complete = [i for i in candidates if len(self._words(i)) == len(span)]
+        if len(complete) == 1:
+            return complete[0]
+        return None
+
+    def mentions(self, text, max_words=3):
+        """Entries of company names mentioned in free text, such as "coca-cola" or "palo alto networks", in order"""
+        words = normalize(text)
+        found = []
+        i = 0
+        while i < len(words):
+            word = words[i]
+            if len(word) < 2 or word not in self.starts:
+                i += 1
+                continue
+            # The longest span that names exactly one company wins
+            shortest = 2 if word in SINGLE_WORD_STOPLIST else 1
+            for n in range(min(max_words, len(words) - i), shortest - 1, -1):
+                span = words[i:i + n]
+                if all(w in SINGLE_WORD_STOPLIST for w in span):
+                    continue
+                match = self._resolve_span(span)
+                if match is not None:
+                    found.append(self.entry(match))
+                    i += n
+                    break
+            else:
+                i += 1
+        symbol_lookups.inc(kind="mentions", result="hit" if found else "miss")
+        return found
+
+class SymbolCatalog:
+    """The current SymbolIndex, loaded from `path` and refreshed in the background once it is `max_age` old.
+
+    Reading `index` never blocks on Finnhub: it returns the loaded snapshot
+    (empty until the first download finishes) and starts a refresh thread when
+    the snapshot is stale.
+
+    Args:
+        path (str): File of the saved snapshot
+        fetch (callable): fetch() returning a Finnhub stock_symbols response
+        max_age (float): Seconds after which the snapshot is downloaded again
+    """
+
+    def __init__(self, path, fetch, max_age=24 * 60 * 60):
+        self.path = path
+        self.fetch = fetch
+        self.max_age = max_age
+        self._index = None
+        self._lock = threading.Lock()
+        self._refreshing = False
+        self._retry_at = 0.0
+
+    def _load(self):
+        index = None
+        try:
+            index = SymbolIndex.load(self.path)
+        except Exception as e:
+            print(f"Error loading symbol index {self.path}: {e}")
+        return index or SymbolIndex([], [], [])
+
+    @property
+    def index(self):
+        if self._index is None:
+            with self._lock:
+                if self._index is None:
+                    self._index = self._load()
+        if time.time() - self._index.fetched_at > self.max_age:
+            self.refresh_in_background()
+        return self._index
+
+    def refresh(self):
+        """Download the symbol list, save it and swap it in, keeping the old index if the download fails"""
+        try:
+            index = SymbolIndex.from_finnhub(self.fetch())
+            if not len(index):
+                raise ValueError("empty symbol list")
+            index.save(self.path)
+            self._index = index
+        except Exception as e:
+            print(f"Error refreshing symbol index: {e}")
+            # Try again in a few minutes rather than on every lookup
+            self._retry_at = time.monotonic() + 300
+
+    def refresh_in_background(self):
+        with self._lock:
+            if self._refreshing or time.monotonic() < self._retry_at:
+                return
+            self._refreshing = True
+
+        def run():
+            try:
+                self.refresh()
+            finally:
+                self._refreshing = False
+
+        threading.Thread(target=run, name="symbol-refresh", daemon=True).start()
@@ -0,0 +1,132 @@
+"""Per-request latency spans.
+
+Every span is timed into the `finchat_span_seconds` histogram on /metrics and
+appended to the current request's trace. Set FINCHAT_TRACE_LOG=1 to log each
+finished trace as one JSON line, and FINCHAT_OTEL=1 to also emit the spans
+through OpenTelemetry (the `opentelemetry-api` package, plus an SDK/exporter
+configured the usual way, e.g. with `opentelemetry-instrument`).
+"""
+import contextvars, functools, json, logging, os, time, uuid
+from contextlib import contextmanager
+
+from metrics import registry
+
+span_seconds = registry.histogram(
+    "finchat_span_seconds",
+    "Duration of traced operations by span name",
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+)
+tool_seconds = registry.histogram("finchat_tool_seconds", "Duration of tool calls by tool and Finnhub cache status")
+llm_tokens = registry.counter("finchat_llm_tokens_total", "Tokens sent to and received from the LLM")
+
+TRACE_LOG = os.getenv("FINCHAT_TRACE_LOG", "0") == "1"
+logger = logging.getLogger("finchat.trace")
+
+_tracer = None
+if os.getenv("FINCHAT_OTEL", "0") == "1":
+    try:
+        from opentelemetry import trace as otel_trace
+        _tracer = otel_trace.get_tracer("finchat")
+    except ImportError:
+        print("FINCHAT_OTEL is set but opentelemetry-api is not installed, OpenTelemetry export disabled")
+
+_current_trace = contextvars.ContextVar("finchat_trace", default=None)
+_current_span = contextvars.ContextVar("finchat_span", default=None)
+
+class Trace:
+    """Spans recorded while serving one request"""
+
+    def __init__(self, name):
+        self.name = name
+        self.trace_id = uuid.uuid4().hex
+        self.start = time.perf_counter()
+        self.spans = []
+
+    def server_timing(self):
+        """Total time per span name as a Server-Timing header value"""
+        totals = {}
+        for span in self.spans:
+            totals[span["name"]] = totals.get(span["name"], 0.0) + span["duration"]
+        return ", ".join(f"{name};dur={duration * 1000:.1f}" for name, duration in totals.items())
+
+    def to_dict(self):
+        return {
+            "trace_id": self.trace_id,
+            "name": self.name,
+            "duration": time.perf_counter() - self.start,
+            "spans": self.spans,
+        }
+
+@contextmanager
+def trace_request(name):
+    """Collect the spans of one request, logging them at the end if FINCHAT_TRACE_LOG is set"""
+    trace = Trace(name)
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _current_trace.reset(token)
+        if TRACE_LOG:
+            logger.info(json.dumps(trace.to_dict(), default=str))
+
+@contextmanager
+def span(name, **attributes):
+    """Time a block of work as a span of the current request"""
+    record = {"name": name, "attributes": attributes}
+    token = _current_span.set(record)
+    otel_span = _tracer.start_as_current_span(name, attributes=attributes) if _tracer else None
+    if otel_span is not None:
+        otel_span.__enter__()
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        record["duration"] = time.perf_counter() - start
+        _current_span.reset(token)
+        span_seconds.observe(record["duration"], span=name)
+        if otel_span is not None:
+            otel_span.__exit__(None, None, None)
+        trace = _current_trace.get()
+        if trace is not None:
+            record["offset"] = start - trace.start
+            trace.spans.append(record)
+
+def annotate(**attributes):
+    """Add attributes to the innermost open span, if any"""
+    record = _current_span.get()
+    if record is not None:
+        record["attributes"].update(attributes)
+
+def record_cache_result(endpoint, result):
+    """Note a Finnhub cache hit or miss on the open span"""
+    record = _current_span.get()
+    if record is not None:
+        record["attributes"].setdefault("cache", []).append(f"{endpoint}:{result}")
+
+def record_llm_usage(message):
+    """Add prompt and completion token counts from an LLM response to the open span and /metrics"""
+    usage = getattr(message, "usage_metadata", None) or {}
+    prompt_tokens = usage.get("input_tokens", 0)
+    completion_tokens = usage.get("output_tokens", 0)
+    llm_tokens.inc(prompt_tokens, kind="prompt")
+    llm_tokens.inc(completion_tokens, kind="completion")
+    annotate(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+
+def traced_tool(fn):
+    """Record a span per call of a tool function, with its symbols and Finnhub cache status"""
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        symbols = kwargs.get("symbol") or ",".join(kwargs.get("symbols") or [])
+        start = time.perf_counter()
+        with span("tool", tool=fn.__name__, symbol=symbols) as record:
+            result = fn(*args, **kwargs)
+        cache = record["attributes"].get("cache", [])
+        status = "none" if not cache else "hit" if all(c.endswith(":hit") for c in cache) else "miss"
+        tool_seconds.observe(time.perf_counter() - start, tool=fn.__name__, cache=status)
+        return result
+    return wrapper
+
+def propagate(fn):
+    """Run `fn` in a copy of the current context, for work handed to a thread pool"""
+    context = contextvars.copy_context()
+    return functools.partial(context.run, fn)